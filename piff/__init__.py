@@ -83,17 +83,18 @@ from .mean_interp import Mean
 from .polynomial_interp import Polynomial, polynomial_types
 from .basis_interp import BasisInterp, BasisPolynomial
 from .knn_interp import kNNInterp
-from .gp_interp import GPInterp, ExplicitKernel, AnisotropicRBF
+# GPInterp, ExplicitKernel, AnisotropicRBF are imported lazily from gp_interp.  See below.
 
 # Outlier handlers are named BlahOutliers where Blah is what they are called in teh config file
-from .outliers import Outliers, ChisqOutliers
+from .outliers import Outliers, ChisqOutliers, MADOutliers
 
 # Input handlers are named InputBlah where Blah is what they are called in the config file
 from .input import Input, InputFiles
-from .star import Star, StarData, StarFit
+from .star import Star, StarData, StarFit, StarList
 
 # Output handlers are named OutputBlah where Blah is what they are called in the config file
 from .output import Output, OutputFile
+from .npz_file import NpzFile
 
 # PSF classes are named BlahPSF where Blah is what they are called in the config file
 from .psf import PSF, read
@@ -105,8 +106,50 @@ from .stats import Stats, RhoStats, ShapeHistogramsStats
 from .twod_stats import TwoDHistStats, WhiskerStats
 
 # Optics
-from .optical_model import Optical, optical_templates
+# Optical, optical_templates are imported lazily from optical_model.  See below.
 
 # Leave these in their own namespaces
 from . import util
-from . import des
+# des is imported lazily.  See below.
+
+# These modules import sklearn or galsim at module level, which is slow, so they are only
+# imported when one of their names is first accessed as an attribute of piff (which includes
+# the getattr(piff, type_name) lookups used by the config processing).  This requires the
+# module-level __getattr__ of Python 3.7.  On earlier versions, they are imported right away.
+_lazy_names = {
+    'GPInterp' : 'gp_interp',
+    'ExplicitKernel' : 'gp_interp',
+    'AnisotropicRBF' : 'gp_interp',
+    'Optical' : 'optical_model',
+    'optical_templates' : 'optical_model',
+    'des' : 'des',
+}
+
+def _import_lazy(name):
+    import importlib
+    module = importlib.import_module('.' + _lazy_names[name], __name__)
+    value = module if name == _lazy_names[name] else getattr(module, name)
+    globals()[name] = value
+    return value
+
+def _import_lazy_modules():
+    """Import all the lazily imported modules.
+
+    This is needed when looking for a class by name among all the subclasses of some base
+    class, e.g. when reading a file, since a subclass isn't known until its module is imported.
+    """
+    for name in _lazy_names:
+        _import_lazy(name)
+
+import sys
+if sys.version_info >= (3,7):
+    def __getattr__(name):
+        if name in _lazy_names:
+            return _import_lazy(name)
+        raise AttributeError("module %r has no attribute %r"%(__name__, name))
+
+    def __dir__():
+        return sorted(list(globals()) + list(_lazy_names))
+else:  # pragma: no cover
+    _import_lazy_modules()
+del sys
@@ -0,0 +1,442 @@
+# Copyright (c) 2016 by Mike Jarvis and the other collaborators on GitHub at
+# https://github.com/rmjarvis/Piff  All rights reserved.
+#
+# Piff is free software: Redistribution and use in source and binary forms
+# with or without modification, are permitted provided that the following
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the disclaimer given in the accompanying LICENSE
+#    file.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the disclaimer given in the documentation
+#    and/or other materials provided with the distribution.
+
+"""
+.. module:: bench
+
+Benchmarks for the various stages of building and using a Piff PSF.
+
+This makes a synthetic star field, and then times each stage of the fitting process
+(reading the input, initializing and fitting the models, solving the interpolation,
+refluxing, outlier rejection), as well as drawing the PSF, writing and reading it,
+and computing each of the Stats.  This is done for each combination of the requested
+models and interpolators.  The results are written to a JSON file so they can be compared
+across releases.
+
+Run it from the command line as:
+
+    python -m piff.bench --nstars 200 --output bench.json
+
+Use ``python -m piff.bench --help`` to see the available options.
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import os
+import time
+import json
+
+
+# The models and interpolators to benchmark, by name.  Each value is a function that
+# makes the object, so the construction is done fresh for each run.
+def _make_gaussian():
+    import piff
+    return piff.Gaussian(fastfit=True)
+
+def _make_kolmogorov():
+    import piff
+    return piff.Kolmogorov()
+
+def _make_pixelgrid():
+    import piff
+    return piff.PixelGrid(scale=0.3, size=17)
+
+def _make_optical():
+    import piff
+    return piff.Optical(template='des')
+
+def _make_mean():
+    import piff
+    return piff.Mean()
+
+def _make_polynomial():
+    import piff
+    return piff.Polynomial(order=1)
+
+def _make_basis_polynomial():
+    import piff
+    return piff.BasisPolynomial(order=1)
+
+def _make_knn():
+    import piff
+    return piff.kNNInterp(n_neighbors=5)
+
+def _make_gp():
+    import piff
+    return piff.GPInterp(kernel='RBF(200.)', optimize=False)
+
+bench_models = {
+    'Gaussian' : _make_gaussian,
+    'Kolmogorov' : _make_kolmogorov,
+    'PixelGrid' : _make_pixelgrid,
+    'Optical' : _make_optical,
+}
+
+bench_interps = {
+    'Mean' : _make_mean,
+    'Polynomial' : _make_polynomial,
+    'BasisPolynomial' : _make_basis_polynomial,
+    'kNNInterp' : _make_knn,
+    'GPInterp' : _make_gp,
+}
+
+
+def make_field(dir, nstars=100, image_size=2048, stamp_size=32, seed=1234):
+    """Make a synthetic star field image and catalog, and write them to files.
+
+    The PSF is a Gaussian whose size and shape vary linearly across the image.
+
+    :param dir:         The directory in which to write the files.
+    :param nstars:      The number of stars to draw. [default: 100]
+    :param image_size:  The size of the (square) image. [default: 2048]
+    :param stamp_size:  The size of the postage stamps to use. [default: 32]
+    :param seed:        The random number seed. [default: 1234]
+
+    :returns: image_file, cat_file
+    """
+    import galsim
+    import fitsio
+
+    rng = np.random.RandomState(seed)
+    image = galsim.Image(image_size, image_size, wcs=galsim.JacobianWCS(0.26, 0.02, -0.01, 0.27))
+    x = rng.uniform(stamp_size, image_size-stamp_size, nstars)
+    y = rng.uniform(stamp_size, image_size-stamp_size, nstars)
+    for xx, yy in zip(x, y):
+        sigma = 0.9 + 0.1 * xx / image_size
+        g1 = 0.05 * (yy / image_size - 0.5)
+        g2 = 0.03 * (xx / image_size - 0.5)
+        psf = galsim.Gaussian(sigma=sigma).shear(g1=g1, g2=g2) * 1.e4
+        bounds = galsim.BoundsI(int(xx)-stamp_size//2, int(xx)+stamp_size//2,
+                                int(yy)-stamp_size//2, int(yy)+stamp_size//2) & image.bounds
+        psf.drawImage(image=image[bounds], center=galsim.PositionD(xx,yy), add_to_image=True)
+    image.addNoise(galsim.GaussianNoise(rng=galsim.BaseDeviate(seed), sigma=1.))
+
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+    image_file = os.path.join(dir, 'bench_image.fits')
+    cat_file = os.path.join(dir, 'bench_cat.fits')
+    image.write(image_file)
+    data = np.empty(nstars, dtype=[('x',float), ('y',float)])
+    data['x'] = x
+    data['y'] = y
+    fitsio.write(cat_file, data, clobber=True)
+    return image_file, cat_file
+
+
+def bench_one(model_name, interp_name, image_file, cat_file, dir, stamp_size=32, ndraw=100,
+              logger=None):
+    """Time each stage for a single combination of model and interpolator.
+
+    :param model_name:  The name of the model (one of the keys of bench_models).
+    :param interp_name: The name of the interpolator (one of the keys of bench_interps).
+    :param image_file:  The image file from make_field.
+    :param cat_file:    The catalog file from make_field.
+    :param dir:         A directory for the output files.
+    :param stamp_size:  The stamp size to use. [default: 32]
+    :param ndraw:       How many times to draw the PSF. [default: 100]
+    :param logger:      A logger object for logging debug info. [default: None]
+
+    :returns: a dict of the times in seconds for each stage.
+    """
+    import piff
+    from .util import Timings
+
+    timer = Timings()
+
+    # Input
+    input = piff.InputFiles(image_file, cat_file, stamp_size=stamp_size)
+    with timer('Input.readImages'):
+        input.readImages()
+        input.readStarCatalogs()
+        input.setPointing()
+    with timer('Input.makeStars'):
+        orig_stars = input.makeStars()
+    wcs = input.getWCS()
+
+    model = bench_models[model_name]()
+    interp = bench_interps[interp_name]()
+
+    # One iteration of the fitting process, following SimplePSF.fit.
+    with timer('Model.initialize'):
+        stars = [ model.initialize(s, mask=True) for s in orig_stars ]
+    with timer('Interp.initialize'):
+        stars = interp.initialize(stars)
+    quadratic_chisq = hasattr(model, 'chisq') and interp.degenerate_points
+    if quadratic_chisq:
+        with timer('Model.chisq'):
+            stars = [ model.chisq(s) for s in stars ]
+    else:
+        with timer('Model.fit'):
+            stars = [ model.fit(s) for s in stars ]
+    with timer('Interp.solve'):
+        interp.solve(stars)
+    if hasattr(model, 'reflux'):
+        with timer('reflux'):
+            stars = [ model.reflux(interp.interpolate(s)) for s in stars ]
+    outliers = piff.ChisqOutliers(nsigma=4)
+    with timer('Outliers.removeOutliers'):
+        outliers.removeOutliers(stars)
+
+    # The full fit
+    psf = piff.SimplePSF(bench_models[model_name](), bench_interps[interp_name](),
+                         outliers=outliers)
+    with timer('SimplePSF.fit'):
+        psf.fit(orig_stars, wcs, input.pointing, logger=logger)
+
+    # Drawing
+    chipnum = list(wcs.keys())[0]
+    xy = [ (s.image_pos.x, s.image_pos.y) for s in psf.stars ]
+    xy = [ xy[i % len(xy)] for i in range(ndraw) ]
+    with timer('PSF.draw'):
+        for x, y in xy:
+            psf.draw(x, y, chipnum=chipnum, stamp_size=stamp_size)
+
+    # I/O
+    for format in ['fits', 'npz']:
+        file_name = os.path.join(dir, 'bench_psf.' + format)
+        with timer('PSF.write_' + format):
+            psf.write(file_name, format=format)
+        with timer('PSF.read_' + format):
+            piff.read(file_name, format=format)
+
+    # Stats
+    with timer('Stats.measureShapes'):
+        shapes = piff.Stats.measureShapes(psf, psf.stars)
+    for stats in [ piff.ShapeHistogramsStats(), piff.RhoStats(), piff.TwoDHistStats(),
+                   piff.WhiskerStats() ]:
+        with timer(stats.__class__.__name__ + '.compute'):
+            stats.compute(psf, psf.stars, shapes=shapes)
+
+    return dict([ (name, timer[name]) for name in timer.keys() ])
+
+
+def bench_logging(model_name, interp_name, image_file, cat_file, stamp_size=32,
+                  verbosities=(0,1,2,3)):
+    """Time SimplePSF.fit at different logging verbosity levels.
+
+    The log output goes to os.devnull, so this measures the cost of building the log
+    messages rather than the cost of writing them to a terminal.
+
+    :param model_name:  The name of the model (one of the keys of bench_models).
+    :param interp_name: The name of the interpolator (one of the keys of bench_interps).
+    :param image_file:  The image file from make_field.
+    :param cat_file:    The catalog file from make_field.
+    :param stamp_size:  The stamp size to use. [default: 32]
+    :param verbosities: Which verbosity levels to run. [default: (0,1,2,3)]
+
+    :returns: a dict of the fit time in seconds, indexed by verbosity level.
+    """
+    import logging
+    import piff
+
+    input = piff.InputFiles(image_file, cat_file, stamp_size=stamp_size)
+    input.readImages()
+    input.readStarCatalogs()
+    input.setPointing()
+    stars = input.makeStars()
+    wcs = input.getWCS()
+
+    logging_levels = { 0: logging.CRITICAL, 1: logging.WARNING, 2: logging.INFO,
+                       3: logging.DEBUG }
+    logger = logging.getLogger('piff_bench')
+    logger.propagate = False
+    devnull = open(os.devnull, 'w')
+    handler = logging.StreamHandler(devnull)
+    logger.addHandler(handler)
+
+    times = {}
+    try:
+        for verbose in verbosities:
+            logger.setLevel(logging_levels[verbose])
+            psf = piff.SimplePSF(bench_models[model_name](), bench_interps[interp_name]())
+            t0 = time.time()
+            psf.fit(stars, wcs, input.pointing, logger=logger)
+            times[verbose] = time.time() - t0
+    finally:
+        logger.removeHandler(handler)
+        devnull.close()
+    return times
+
+
+def bench_fitters(image_file, cat_file, stamp_size=32, models=('Gaussian', 'Kolmogorov'),
+                  fitters=('lmfit', 'least_squares')):
+    """Compare the minimizers available for the GSObjectModel fits.
+
+    For each model and fitter, this fits all the stars once, starting from the initialized
+    (moment-based) parameters, and records the time and the number of function and Jacobian
+    evaluations.  Each function evaluation of lmfit draws the model once, and its numerical
+    Jacobian draws it once per varied parameter, which is included in its nfev.  For
+    least_squares, each function evaluation and each Jacobian evaluation is done with one
+    batch of FFTs.
+
+    :param image_file:  The image file from make_field.
+    :param cat_file:    The catalog file from make_field.
+    :param stamp_size:  The stamp size to use. [default: 32]
+    :param models:      Which GSObjectModel classes to use, by name in the piff module.
+                        [default: ('Gaussian', 'Kolmogorov')]
+    :param fitters:     Which fitters to compare. [default: ('lmfit', 'least_squares')]
+
+    :returns: a list of dicts with the model, fitter, time, nfev and njev for each run.
+    """
+    import piff
+
+    input = piff.InputFiles(image_file, cat_file, stamp_size=stamp_size)
+    input.readImages()
+    input.readStarCatalogs()
+    input.setPointing()
+    orig_stars = input.makeStars()
+
+    runs = []
+    for model_name in models:
+        for fitter in fitters:
+            model = getattr(piff, model_name)(fitter=fitter)
+            stars = [ model.initialize(s) for s in orig_stars ]
+            nfev = 0
+            njev = 0
+            t0 = time.time()
+            for star in stars:
+                if fitter == 'least_squares':
+                    _, results = model._least_squares_minimize(star)
+                    njev += results.njev
+                else:
+                    results = model._lmfit_minimize(model._lmfit_params(star), star)
+                nfev += results.nfev
+            runs.append({ 'model' : model_name, 'fitter' : fitter, 'nstars' : len(stars),
+                          'time' : time.time() - t0, 'nfev' : nfev, 'njev' : njev })
+    return runs
+
+
+def run_benchmarks(nstars=100, models=None, interps=None, dir='bench_output', ndraw=100,
+                   seed=1234, verbosities=None, fitters=None, logger=None):
+    """Run the benchmarks for each combination of the given models and interpolators.
+
+    If a combination fails (e.g. an interpolator that doesn't work with a given model),
+    the error is recorded in the results rather than stopping the run.
+
+    :param nstars:      The number of stars in the synthetic field. [default: 100]
+    :param models:      A list of model names. [default: None, which means all of
+                        bench_models]
+    :param interps:     A list of interpolator names. [default: None, which means all of
+                        bench_interps]
+    :param dir:         The directory to use for temporary files. [default: 'bench_output']
+    :param ndraw:       How many times to draw the PSF. [default: 100]
+    :param seed:        The random number seed. [default: 1234]
+    :param verbosities: Optionally, a list of logging verbosity levels at which to time the
+                        fit for each combination (see bench_logging). [default: None]
+    :param fitters:     Optionally, a list of GSObjectModel fitters to compare (see
+                        bench_fitters). [default: None]
+    :param logger:      A logger object for logging debug info. [default: None]
+
+    :returns: a dict with the results, suitable for writing as JSON.
+    """
+    import sys
+    import piff
+
+    if models is None:
+        models = sorted(bench_models)
+    if interps is None:
+        interps = sorted(bench_interps)
+
+    t0 = time.time()
+    image_file, cat_file = make_field(dir, nstars=nstars, seed=seed)
+    results = {
+        'piff_version' : piff.__version__,
+        'python_version' : sys.version.split()[0],
+        'nstars' : nstars,
+        'ndraw' : ndraw,
+        'make_field' : time.time() - t0,
+        'runs' : [],
+    }
+
+    for model_name in models:
+        for interp_name in interps:
+            if logger:
+                logger.warning("Benchmarking %s model with %s interpolator",
+                               model_name, interp_name)
+            run = { 'model' : model_name, 'interp' : interp_name }
+            try:
+                run['times'] = bench_one(model_name, interp_name, image_file, cat_file, dir,
+                                         ndraw=ndraw)
+                if verbosities:
+                    run['fit_time_by_verbosity'] = bench_logging(
+                            model_name, interp_name, image_file, cat_file,
+                            verbosities=verbosities)
+            except Exception as e:
+                if logger:
+                    logger.warning("Caught %r.  Skipping this combination.", e)
+                run['error'] = repr(e)
+            results['runs'].append(run)
+
+    if fitters:
+        if logger:
+            logger.warning("Benchmarking fitters %s", fitters)
+        results['fitters'] = bench_fitters(image_file, cat_file, fitters=fitters)
+    return results
+
+
+def main(argv=None):
+    """Run the benchmarks from the command line.
+    """
+    import argparse
+    import piff
+
+    parser = argparse.ArgumentParser(description='Benchmark the stages of a Piff PSF fit.',
+                                     prog='python -m piff.bench')
+    parser.add_argument('--nstars', type=int, default=100,
+                        help='Number of stars in the synthetic field (default: 100)')
+    parser.add_argument('--models', nargs='+', default=None, choices=sorted(bench_models),
+                        help='Which models to benchmark (default: all)')
+    parser.add_argument('--interps', nargs='+', default=None, choices=sorted(bench_interps),
+                        help='Which interpolators to benchmark (default: all)')
+    parser.add_argument('--ndraw', type=int, default=100,
+                        help='Number of PSF images to draw (default: 100)')
+    parser.add_argument('--dir', default='bench_output',
+                        help='Directory for temporary files (default: bench_output)')
+    parser.add_argument('--verbosities', nargs='+', type=int, default=None,
+                        choices=[0,1,2,3],
+                        help='Also time the fit at each of these logging verbosity levels')
+    parser.add_argument('--fitters', nargs='+', default=None,
+                        choices=['lmfit', 'least_squares'],
+                        help='Also compare these fitters for the GSObjectModel fits')
+    parser.add_argument('--output', default='bench.json',
+                        help='Name of the output JSON file (default: bench.json)')
+    parser.add_argument('-v', '--verbose', type=int, default=1,
+                        help='Verbosity level (default: 1)')
+    args = parser.parse_args(argv)
+
+    logger = piff.setup_logger(verbose=args.verbose)
+    results = run_benchmarks(nstars=args.nstars, models=args.models, interps=args.interps,
+                             dir=args.dir, ndraw=args.ndraw, verbosities=args.verbosities,
+                             fitters=args.fitters, logger=logger)
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    logger.warning("Wrote benchmark results to %s", args.output)
+
+    for run in results['runs']:
+        if 'times' in run:
+            print('%s + %s:'%(run['model'], run['interp']))
+            for stage in sorted(run['times']):
+                print('    %-30s %10.4f s'%(stage, run['times'][stage]))
+            for verbose, t in sorted(run.get('fit_time_by_verbosity', {}).items()):
+                print('    %-30s %10.4f s'%('SimplePSF.fit verbose=%d'%verbose, t))
+        else:
+            print('%s + %s: %s'%(run['model'], run['interp'], run['error']))
+    for run in results.get('fitters', []):
+        print('%s fit with %s: %10.4f s, nfev = %d, njev = %d'%(
+              run['model'], run['fitter'], run['time'], run['nfev'], run['njev']))
+
+
+if __name__ == '__main__':
+    main()
@@ -123,13 +123,19 @@ def piffify(config, logger=None):
         if key not in config:
             raise ValueError("%s field is required in config dict"%key)
 
+    timings = piff.util.Timings()
+
     # read in the input images
-    stars, wcs, pointing = piff.Input.process(config['input'], logger=logger)
+    with timings('input'):
+        stars, wcs, pointing = piff.Input.process(config['input'], logger=logger)
 
     psf = piff.PSF.process(config['psf'], logger=logger)
-    psf.fit(stars, wcs, pointing, logger=logger)
+    psf.fit(stars, wcs, pointing, logger=logger, timings=timings)
 
     # write it out to a file
     output = piff.Output.process(config['output'], logger=logger)
-    output.write(psf, logger=logger)
+    output.write(psf, logger=logger, timings=timings)
+
+    logger.info("Time spent in each stage:")
+    timings.log(logger)
 
@@ -135,6 +135,43 @@ class DECamInfo(object):
         pixHalfSize[:63, 1] *= 2
         self.infoLowerLeftCorner = self.infoArr - pixHalfSize
         self.infoUpperRightCorner = self.infoArr + pixHalfSize
+        self._buildChipGrid()
+
+    # The size in mm of the cells in the chip lookup grid.  This is half the width of a chip,
+    # so each cell overlaps at most a few chips.
+    _grid_cell_size = 15.36
+
+    def _buildChipGrid(self):
+        """Build a regular grid over the focal plane, listing the chips that overlap each cell.
+
+        Finding the chip for a position then only requires checking the few chips listed for
+        its cell, rather than all 70 of them.
+        """
+        # First entry is a fake entry. Skip it!
+        lower = self.infoLowerLeftCorner[1:]
+        upper = self.infoUpperRightCorner[1:]
+        cell = self._grid_cell_size
+        self._grid_x0, self._grid_y0 = np.min(lower, axis=0)
+        nx, ny = (np.floor((np.max(upper, axis=0) - np.min(lower, axis=0)) / cell) + 1).astype(int)
+        cells = [ [ [] for i in range(nx) ] for j in range(ny) ]
+        for chipnum in range(1, len(self.infoArr)):
+            i1, j1 = self._gridIndex(*self.infoLowerLeftCorner[chipnum])
+            i2, j2 = self._gridIndex(*self.infoUpperRightCorner[chipnum])
+            for j in range(j1, j2+1):
+                for i in range(i1, i2+1):
+                    cells[j][i].append(chipnum)
+        # Store as an array, padded with 0, which means no chip.
+        ncand = max(len(c) for row in cells for c in row)
+        self._chip_grid = np.zeros((ny, nx, ncand), dtype=int)
+        for j in range(ny):
+            for i in range(nx):
+                self._chip_grid[j, i, :len(cells[j][i])] = cells[j][i]
+
+    def _gridIndex(self, xPos, yPos):
+        # The indices of the cells in the chip lookup grid for the given positions.
+        i = np.floor((np.asarray(xPos) - self._grid_x0) / self._grid_cell_size).astype(int)
+        j = np.floor((np.asarray(yPos) - self._grid_y0) / self._grid_cell_size).astype(int)
+        return i, j
 
     def getPosition_chipnum(self, chipnums, ix, iy):
         """Given chipnum and pixel coordinates return focal_plane coordinates [mm]
@@ -239,26 +276,64 @@ class DECamInfo(object):
         """
         return self.getPosition_chipnum(chipnums, ix, iy)
 
+    def getChipnum(self, xPos, yPos):
+        """Given focal_plane coordinates [mm] return the chip numbers
+
+        :param xPos, yPos:  Arrays of x and y coordinates, in mm on the focal plane
+
+        :returns chipnums:  Array of ccd numbers.  Positions that are not on any chip get 0.
+        """
+        xPos = np.atleast_1d(np.asarray(xPos, dtype=float))
+        yPos = np.atleast_1d(np.asarray(yPos, dtype=float))
+        i, j = self._gridIndex(xPos, yPos)
+        ny, nx, ncand = self._chip_grid.shape
+        inside = (i >= 0) & (i < nx) & (j >= 0) & (j < ny)
+        # The candidate chips for each position: (N, ncand)
+        cand = np.zeros((len(xPos), ncand), dtype=int)
+        cand[inside] = self._chip_grid[j[inside], i[inside]]
+        lower = self.infoLowerLeftCorner[cand]
+        upper = self.infoUpperRightCorner[cand]
+        conds = ((cand > 0) &
+                 (xPos[:, None] >= lower[:, :, 0]) & (xPos[:, None] <= upper[:, :, 0]) &
+                 (yPos[:, None] >= lower[:, :, 1]) & (yPos[:, None] <= upper[:, :, 1]))
+        # If a position is on the boundary of two chips, use the first one.
+        first = np.argmax(conds, axis=1)
+        chipnums = cand[np.arange(len(xPos)), first]
+        chipnums[~np.any(conds, axis=1)] = 0
+        return chipnums
+
     def getPixel(self, xPos, yPos):
         """Given extname and focal_plane coordinates [mm] return pixel coordinates
 
         :param xPos, yPos:          Arrays of x and y coordinates, in mm on the focal plane
 
-        :returns chipnums ix, iy:   Arrays of chipnumbers, x and y coordinates in pixels
+        :returns chipnums ix, iy:   Arrays of chipnumbers, x and y coordinates in pixels.
+                                    Positions that are not on any chip get chipnum 0 and
+                                    ix, iy = nan.
         """
-        # get chipnums
-        pos = np.vstack((xPos, yPos)).T
-        # (Nsamp, Nchip, Ndim) = (len(xPos), 71, 2)
-        # first entry is a fake entry. Skip it!
-        conds = ((pos[:, None, 0] >= self.infoLowerLeftCorner[None, 1:, 0]) *
-                 (pos[:, None, 0] <= self.infoUpperRightCorner[None, 1:, 0]) *
-                 (pos[:, None, 1] >= self.infoLowerLeftCorner[None, 1:, 1]) *
-                 (pos[:, None, 1] <= self.infoUpperRightCorner[None, 1:, 1]))
-        chipnums = np.argwhere(conds)[:, 1] + 1
-
+        chipnums = self.getChipnum(xPos, yPos)
         ix, iy = self.getPixel_chipnum(chipnums, xPos, yPos)
+        off_chip = chipnums == 0
+        if np.any(off_chip):
+            ix = np.where(off_chip, np.nan, ix)
+            iy = np.where(off_chip, np.nan, iy)
         return chipnums, ix, iy
 
+    def pixel_to_focal_catalog(self, catalog, chipnum_col='ccdnum', x_col='x', y_col='y'):
+        """Get the focal plane positions for a whole catalog at once.
+
+        :param catalog:         A numpy structured array (e.g. a catalog read with fitsio, or
+                                the data of a StarList) or a dict of arrays.
+        :param chipnum_col:     The name of the column with the ccd numbers. [default: 'ccdnum']
+        :param x_col:           The name of the column with the x pixel positions. [default: 'x']
+        :param y_col:           The name of the column with the y pixel positions. [default: 'y']
+
+        :returns focal_x, focal_y:  Arrays of x and y coordinates in mm on the focal plane.
+        """
+        return self.getPosition_chipnum(np.asarray(catalog[chipnum_col], dtype=int),
+                                        np.asarray(catalog[x_col], dtype=float),
+                                        np.asarray(catalog[y_col], dtype=float))
+
     def pixel_to_focal_stardata(self, stardata):
         """Take stardata and add focal plane position to properties
 
@@ -269,16 +344,23 @@ class DECamInfo(object):
         # stardata needs to have ccdnum as a property!
         focal_x, focal_y = self.getPosition_chipnum(
             np.array([stardata['ccdnum']]), np.array([stardata['x']]), np.array([stardata['y']]))
+        return self._withFocal(stardata, focal_x[0], focal_y[0])
+
+    @staticmethod
+    def _withFocal(stardata, focal_x, focal_y):
+        # Make a new StarData with the given focal plane position added to the properties.
         properties = stardata.properties.copy()
-        properties['focal_x'] = focal_x[0]
-        properties['focal_y'] = focal_y[0]
+        properties['focal_x'] = focal_x
+        properties['focal_y'] = focal_y
         for key in ['x', 'y', 'u', 'v']:
             # Get rid of keys that constructor doesn't want to see:
             properties.pop(key,None)
+        # The field position doesn't change, so pass it along rather than recomputing it.
         return StarData(image=stardata.image,
                         image_pos=stardata.image_pos,
                         weight=stardata.weight,
                         pointing=stardata.pointing,
+                        field_pos=stardata.field_pos,
                         values_are_sb=stardata.values_are_sb,
                         properties=properties)
 
@@ -294,8 +376,22 @@ class DECamInfo(object):
     def pixel_to_focalList(self, stars):
         """Take stars and add focal plane position to properties
 
+        The focal plane positions for all the stars are computed together with one call to
+        getPosition.  If stars is a StarList, as read by Star.read, the positions are taken
+        from its table directly.
+
         :param stars:     Starlist with property 'ccdnum'
 
         :returns starsl:  New stars with updated properties
         """
-        return [Star(self.pixel_to_focal_stardata(star.data), star.fit) for star in stars]
+        from ..star import StarList
+        if len(stars) == 0:
+            return []
+        if isinstance(stars, StarList):
+            focal_x, focal_y = self.pixel_to_focal_catalog(stars.data)
+        else:
+            catalog = { key : [ star.data[key] for star in stars ]
+                        for key in ['ccdnum', 'x', 'y'] }
+            focal_x, focal_y = self.pixel_to_focal_catalog(catalog)
+        return [ Star(self._withFocal(star.data, fx, fy), star.fit)
+                 for star, fx, fy in zip(stars, focal_x, focal_y) ]
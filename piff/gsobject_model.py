@@ -17,10 +17,21 @@
 """
 
 import numpy as np
+import logging
+import weakref
 
 from .model import Model, ModelFitError
 from .star import Star, StarFit, StarData
-from .util import hsm
+from .util import hsm, LRUCache, adaptive_moments, add_shears, radial_kvalues
+
+# Tables of the fiducial profiles' Fourier transforms for the least_squares fitter, keyed by
+# repr(gsobj).  These only depend on the fiducial profile, so they are shared by all models
+# that use the same one, e.g. the models for each chip in a SingleChipPSF.
+_ktables = {}
+
+# The caches of transformed profiles for each model.  These are kept outside of the model
+# objects, so they don't affect comparisons of the models' states or get copied with them.
+_profile_caches = weakref.WeakKeyDictionary()
 
 
 class GSObjectModel(Model):
@@ -34,22 +45,46 @@ class GSObjectModel(Model):
                         position is fixed at input value and the fitted PSF may be off-center.
                         [default: True]
     :param include_pixel:   Include integration over pixel?  [default: True]
+    :param fitter:   Which minimizer to use when not using fastfit.  Options are 'lmfit', which
+                     uses lmfit.minimize with numerical derivatives, or 'least_squares', which
+                     uses scipy.optimize.least_squares with derivatives computed in Fourier
+                     space.  The latter requires the fiducial profile to be radially symmetric.
+                     [default: 'lmfit']
+    :param batch_fastfit:   With fastfit, fit all the stars together in fitStarList, measuring
+                     the moments with the vectorized adaptive moments in piff.util rather than
+                     HSM.  This is faster for many stars, but the results are slightly
+                     different from the HSM-based fit, which is still used to initialize the
+                     stars. [default: False]
     :param logger:   A logger object for logging debug info. [default: None]
     """
+    _fitters = ('lmfit', 'least_squares')
+
+    # The maximum number of stars to process together in fitStarList.
+    _batch_size = 1000
+
     def __init__(self, gsobj, fastfit=False, force_model_center=True, include_pixel=True,
-                 logger=None):
+                 fitter='lmfit', batch_fastfit=False, logger=None):
         if isinstance(gsobj, str):
             import galsim
             gsobj = eval(gsobj)
+        if fitter not in self._fitters:
+            raise ValueError("Invalid fitter %s.  Must be one of %s"%(fitter, self._fitters))
 
         self.kwargs = {'gsobj':repr(gsobj),
                        'fastfit':fastfit,
                        'force_model_center':force_model_center,
-                       'include_pixel':include_pixel}
+                       'include_pixel':include_pixel,
+                       'fitter':fitter,
+                       'batch_fastfit':batch_fastfit}
 
         # Center and normalize the fiducial model.
         self.gsobj = gsobj.withFlux(1.0).shift(-gsobj.centroid())
+        if fitter == 'least_squares' and not _is_radial(self.gsobj):
+            raise ValueError("fitter='least_squares' requires a radially symmetric fiducial "
+                             "profile.  Got gsobj = %r"%gsobj)
         self._fastfit = fastfit
+        self._fitter = fitter
+        self._batch_fastfit = batch_fastfit
         self._force_model_center = force_model_center
         self._method = 'auto' if include_pixel else 'no_pixel'
         # Params are [du, dv], scale, g1, g2, i.e., transformation parameters that bring the
@@ -62,7 +97,7 @@ class GSObjectModel(Model):
     def moment_fit(self, star, logger=None):
         """Estimate transformations needed to bring self.gsobj towards given star."""
         import galsim
-        flux, cenu, cenv, size, g1, g2 = star.data.properties['hsm']
+        flux, cenu, cenv, size, g1, g2, flag = star.data.getHSM()
         shape = galsim.Shear(g1=g1, g2=g2)
 
         ref_flux, ref_cenu, ref_cenv, ref_size, ref_g1, ref_g2, flag = hsm(self.draw(star))
@@ -88,6 +123,49 @@ class GSObjectModel(Model):
 
         return param_flux, param_du, param_dv, param_scale, param_g1, param_g2
 
+    def _transform(self, flux, du, dv, scale, g1, g2):
+        """Apply the given transformation to the fiducial profile.
+
+        This is equivalent to gsobj.dilate(scale).shear(g1=g1, g2=g2).shift(du, dv) * flux,
+        but the Jacobian of the dilation and shear is calculated directly, so GalSim only makes
+        a single Transformation of the fiducial profile.  The fiducial profile and any tables
+        it has built are reused each time.
+        """
+        # The shear matrix is [[1+g1, g2], [g2, 1-g1]] / sqrt(1-g^2).
+        factor = scale / np.sqrt(1. - g1*g1 - g2*g2)
+        prof = self.gsobj.transform(factor * (1.+g1), factor * g2, factor * g2, factor * (1.-g1))
+        # transform doesn't necessarily preserve the flux, so set it explicitly.
+        return prof.shift(du, dv).withFlux(flux)
+
+    @property
+    def _profile_cache(self):
+        # The same profile is often drawn many times, e.g. for all the stars when using the
+        # Mean interpolator, or when the fitted stars are drawn again for the stats.
+        cache = _profile_caches.get(self)
+        if cache is None:
+            cache = _profile_caches[self] = LRUCache(100)
+        return cache
+
+    def _getCachedProfile(self, flux, du, dv, scale, g1, g2):
+        """Get the transformed profile, using a cached one if these parameters have been used
+        recently.
+        """
+        key = (float(flux), float(du), float(dv), float(scale), float(g1), float(g2))
+        prof = self._profile_cache.get(key)
+        if prof is None:
+            prof = self._transform(*key)
+            self._profile_cache.put(key, prof)
+        return prof
+
+    def _unpackParams(self, params, flux=1., center=(0.,0.)):
+        # Get the (flux, du, dv, scale, g1, g2) to use for the given params and center.
+        if self._force_model_center:
+            scale, g1, g2 = params
+            du, dv = (0.0, 0.0)
+        else:
+            du, dv, scale, g1, g2 = params
+        return flux, du + center[0], dv + center[1], scale, g1, g2
+
     def getProfile(self, params):
         """Get a version of the model as a GalSim GSObject
 
@@ -98,12 +176,7 @@ class GSObjectModel(Model):
 
         :returns: a galsim.GSObject instance
         """
-        if self._force_model_center:
-            scale, g1, g2 = params
-            du, dv = (0.0, 0.0)
-        else:
-            du, dv, scale, g1, g2 = params
-        return self.gsobj.dilate(scale).shear(g1=g1, g2=g2).shift(du, dv)
+        return self._getCachedProfile(*self._unpackParams(params))
 
     def draw(self, star):
         """Draw the model on the given image.
@@ -113,30 +186,51 @@ class GSObjectModel(Model):
 
         :returns: a new Star instance with the data field having an image of the drawn model.
         """
-        prof = self.getProfile(star.fit.params).shift(star.fit.center) * star.fit.flux
+        prof = self._getCachedProfile(*self._unpackParams(star.fit.params, star.fit.flux,
+                                                          star.fit.center))
         image = star.image.copy()
         prof.drawImage(image, method=self._method, offset=(star.image_pos-image.trueCenter()))
         data = StarData(image, star.image_pos, star.weight, star.data.pointing)
         return Star(data, star.fit)
 
-    def _lmfit_resid(self, lmparams, star):
+    def _lmfit_resid(self, lmparams, image, sqrt_weight, offset, model_image):
         """Residual function to use with lmfit.  Essentially `chi` from `chisq`, but not summed
         over pixels yet.
 
-        :param lmparams:  An lmfit.Parameters() instance.  The model.
-        :param star:    A Star instance.  The data.
+        The things that don't depend on the parameters are computed once in _lmfit_minimize
+        rather than for each function evaluation.
+
+        :param lmparams:    An lmfit.Parameters() instance.  The model.
+        :param image:       The star's image.  The data.
+        :param sqrt_weight: The square root of the star's weight array.
+        :param offset:      The offset to use for drawing the model.
+        :param model_image: An image to use for drawing the model.
 
         :returns: `chi` as a flattened numpy array.
         """
-        image, weight, image_pos = star.data.getImage()
         flux, du, dv, scale, g1, g2 = lmparams.valuesdict().values()
         # Fit du and dv regardless of force_model_center.  The difference is whether the fit
         # value is recorded (force_model_center=False) or discarded (force_model_center=True).
-        prof = self.gsobj.dilate(scale).shear(g1=g1, g2=g2).shift(du, dv) * flux
-        model_image = image.copy()
-        prof.drawImage(model_image, method=self._method,
-                       offset=(image_pos - model_image.trueCenter()))
-        return (np.sqrt(weight.array)*(model_image.array - image.array)).ravel()
+        # The parameters are different for each evaluation, so don't use the profile cache.
+        prof = self._transform(flux, du, dv, scale, g1, g2)
+        prof.drawImage(model_image, method=self._method, offset=offset)
+        return (sqrt_weight * (model_image.array - image.array)).ravel()
+
+    def _start_values(self, star):
+        """Get the initial (flux, du, dv, scale, g1, g2) to use for fitting the given star.
+
+        Either use values currently in star.fit, or if those are absent, run HSM to get initial
+        values.
+        """
+        if star.fit.params is None:
+            return self.moment_fit(star)
+        flux = star.fit.flux
+        if self._force_model_center:
+            du, dv = star.fit.center
+            scale, g1, g2 = star.fit.params
+        else:
+            du, dv, scale, g1, g2 = star.fit.params
+        return flux, du, dv, scale, g1, g2
 
     def _lmfit_params(self, star, vary_params=True, vary_flux=True, vary_center=True):
         """Generate an lmfit.Parameters() instance from arguments.
@@ -150,20 +244,7 @@ class GSObjectModel(Model):
         """
         import lmfit
 
-        # Get initial parameter values.  Either use values currently in star.fit, or if those are
-        # absent, run HSM to get initial values.
-        if star.fit.params is None:
-            flux, du, dv, scale, g1, g2, flag = self.moment_fit(star)
-            if flag != 0:
-                raise RuntimeError("Error initializing star fit values using hsm.")
-        else:
-            flux = star.fit.flux
-            if self._force_model_center:
-                du, dv = star.fit.center
-                scale, g1, g2 = star.fit.params
-            else:
-                du, dv, scale, g1, g2 = star.fit.params
-
+        flux, du, dv, scale, g1, g2 = self._start_values(star)
         params = lmfit.Parameters()
         # Order of params is important!
         params.add('flux', value=flux, vary=vary_flux, min=0.0)
@@ -186,15 +267,18 @@ class GSObjectModel(Model):
         :returns: lmfit.MinimizerResult instance containing fit results.
         """
         import lmfit
-        if logger:
+        debug = logger is not None and logger.isEnabledFor(logging.DEBUG)
+        if debug:
             import time
             t0 = time.time()
             logger.debug("Start lmfit minimize.")
-        results = lmfit.minimize(self._lmfit_resid, params, args=(star,))
-        flux, du, dv, scale, g1, g2 = results.params.valuesdict().values()
+        image, weight, image_pos = star.data.getImage()
+        model_image = image.copy()
+        args = (image, np.sqrt(weight.array), image_pos - model_image.trueCenter(), model_image)
+        results = lmfit.minimize(self._lmfit_resid, params, args=args)
 
-        if logger:
-            logger.debug("End lmfit minimize.  Elapsed time: {0}".format(time.time() - t0))
+        if debug:
+            logger.debug("End lmfit minimize.  Elapsed time: %s", time.time() - t0)
         return results
 
     def lmfit(self, star, logger=None):
@@ -208,7 +292,8 @@ class GSObjectModel(Model):
         """
         params = self._lmfit_params(star)
         results = self._lmfit_minimize(params, star, logger=logger)
-        if logger:
+        if logger is not None and logger.isEnabledFor(logging.DEBUG):
+            # fit_report is fairly slow, so only make it if it will be output.
             import lmfit
             logger.debug(lmfit.fit_report(results))
         flux, du, dv, scale, g1, g2 = results.params.valuesdict().values()
@@ -217,15 +302,84 @@ class GSObjectModel(Model):
 
         return flux, du, dv, scale, g1, g2
 
+    def _getKTable(self):
+        """Get a table of the Fourier transform of the fiducial profile and its derivative as a
+        function of |k|.
+
+        :returns: (q, g, dg), where g = gsobj.kValue(q,0) and dg = dg/dq.
+        """
+        key = repr(self.gsobj)
+        if key not in _ktables:
+            # The fiducial profile has a size of order 1, so this spacing is fine enough that
+            # the linear interpolation is accurate to better than 1.e-5.
+            dq = 0.005
+            q, g = radial_kvalues(self.gsobj, dq=dq)
+            _ktables[key] = (q, g, np.gradient(g, dq))
+        return _ktables[key]
+
+    def _least_squares_minimize(self, star, vary_params=True, logger=None):
+        """Run scipy.optimize.least_squares on the given star, using derivatives computed in
+        Fourier space.
+
+        :param star:        Star to fit.
+        :param vary_params: Allow non-flux and non-center params to vary? [default: True]
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        :returns: (values, results), where values is the array of fitted
+                  (flux, du, dv, scale, g1, g2), and results is the scipy.optimize.OptimizeResult
+                  instance.
+        """
+        from scipy.optimize import least_squares
+        debug = logger is not None and logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            import time
+            t0 = time.time()
+            logger.debug("Start least_squares.")
+
+        # The same limits as in _lmfit_params.
+        lower = np.array([ 0., -np.inf, -np.inf, 0., -0.7, -0.7 ])
+        upper = np.array([ np.inf, np.inf, np.inf, np.inf, 0.7, 0.7 ])
+        values = np.clip(np.array(self._start_values(star), dtype=float), lower, upper)
+        vary = np.array([ True, True, True, vary_params, vary_params, vary_params ])
+
+        kfit = _KSpaceFitter(self, star, values, vary)
+        results = least_squares(kfit.resid, values[vary], jac=kfit.jac,
+                                bounds=(lower[vary], upper[vary]), x_scale='jac')
+        values[vary] = results.x
+
+        if debug:
+            logger.debug("End least_squares.  nfev = %d, njev = %d.  Elapsed time: %s",
+                         results.nfev, results.njev, time.time() - t0)
+        return values, results
+
+    def least_squares(self, star, logger=None):
+        """Fit parameters of the given star using scipy.optimize.least_squares with the
+        derivatives of the model computed analytically in Fourier space.
+
+        :param star:    A Star to fit.
+        :param logger:  A logger object for logging debug info. [default: None]
+
+        :returns: (flux, dx, dy, scale, g1, g2)
+        """
+        values, results = self._least_squares_minimize(star, logger=logger)
+        if not results.success:
+            raise RuntimeError("Error fitting with least_squares.")
+        return tuple(values)
+
     @staticmethod
     def with_hsm(star):
-        if not hasattr(star.data.properties, 'hsm'):
-            flux, cenu, cenv, size, g1, g2, flag = hsm(star)
-            if flag != 0:
-                raise RuntimeError("Error initializing star fit values using hsm.")
-            sd = star.data.copy()
-            sd.properties['hsm'] = flux, cenu, cenv, size, g1, g2
-            return Star(sd, star.fit)
+        """Make sure the HSM moments of the star's data have been measured successfully.
+
+        The moments are kept in star.data (see StarData.getHSM), so this only runs HSM the
+        first time it is called for a given star.
+
+        :param star:    The Star to check.
+
+        :returns: the same Star
+        """
+        flag = star.data.getHSM()[6]
+        if flag != 0:
+            raise RuntimeError("Error initializing star fit values using hsm.")
         return star
 
     def fit(self, star, fastfit=None, logger=None):
@@ -240,6 +394,9 @@ class GSObjectModel(Model):
         :param star:    A Star to fit.
         :param fastfit: Use fast HSM moments to fit? [default: None, which means use fitting mode
                         specified in the constructor.]
+
+        When not using fastfit, the minimizer is given by the `fitter` option in the
+        constructor.
         :param logger:  A logger object for logging debug info. [default: None]
 
         :returns: a new Star with the fitted parameters in star.fit
@@ -247,11 +404,13 @@ class GSObjectModel(Model):
         if fastfit is None:
             fastfit = self._fastfit
 
-        if not hasattr(star.data.properties, 'hsm'):
+        if star.fit.params is None:
             star = self.initialize(star)
 
         if fastfit:
             flux, du, dv, scale, g1, g2 = self.moment_fit(star, logger=logger)
+        elif self._fitter == 'least_squares':
+            flux, du, dv, scale, g1, g2 = self.least_squares(star, logger=logger)
         else:
             flux, du, dv, scale, g1, g2 = self.lmfit(star, logger=logger)
         # Make a StarFit object with these parameters
@@ -263,15 +422,144 @@ class GSObjectModel(Model):
             center = (0.0, 0.0)
 
         # Also need to compute chisq
-        prof = self.getProfile(params) * flux
+        prof = self._getCachedProfile(*self._unpackParams(params, flux, center))
         model_image = star.image.copy()
-        prof.shift(center).drawImage(model_image, method=self._method,
-                                     offset=(star.image_pos - model_image.trueCenter()))
+        prof.drawImage(model_image, method=self._method,
+                       offset=(star.image_pos - model_image.trueCenter()))
         chisq = np.sum(star.weight.array * (star.image.array - model_image.array)**2)
         dof = np.count_nonzero(star.weight.array) - self._nparams
         fit = StarFit(params, flux=flux, center=center, chisq=chisq, dof=dof)
         return Star(star.data, fit)
 
+    def fitStarList(self, stars, fastfit=None, logger=None):
+        """Fit many stars.
+
+        With fastfit and the batch_fastfit option, this is a batched version of the moment
+        fitting in fit.  The reference models for all the stars are drawn into a single stacked
+        array, and both the data and the models are measured with the vectorized adaptive
+        moments in piff.util rather than running HSM on each star.  The parameter updates are
+        then done as array operations.  The moments are not identical to the HSM moments used
+        by fit, so the results are close to, but not exactly the same as, calling fit for each
+        star.
+
+        Otherwise, this just calls fit for each star.
+
+        :param stars:   A list of Stars to fit.  These should already have been initialized.
+        :param fastfit: Use fast moments to fit? [default: None, which means use fitting mode
+                        specified in the constructor.]
+        :param logger:  A logger object for logging debug info. [default: None]
+
+        :returns: a list of new Stars with the fitted parameters.  Any stars that could not
+                  be fit are None in this list.
+        """
+        if fastfit is None:
+            fastfit = self._fastfit
+
+        fitted = [None] * len(stars)
+        if not (fastfit and self._batch_fastfit):
+            for i, star in enumerate(stars):
+                try:
+                    fitted[i] = self.fit(star, fastfit=fastfit, logger=logger)
+                except (ModelFitError, RuntimeError) as e:
+                    if logger:
+                        logger.debug("Error fitting star at %s: %s", star.image_pos, e)
+            return fitted
+
+        # Group the stars by the stamp shape, so they can be stacked into arrays.
+        groups = {}
+        for i, star in enumerate(stars):
+            groups.setdefault(star.image.array.shape, []).append(i)
+        for indices in groups.values():
+            for k in range(0, len(indices), self._batch_size):
+                batch = indices[k:k+self._batch_size]
+                batch_fitted = self._batchMomentFit([ stars[i] for i in batch ], logger=logger)
+                for i, star in zip(batch, batch_fitted):
+                    fitted[i] = star
+        if logger:
+            logger.debug("Batched moment fit: %d of %d stars failed",
+                         fitted.count(None), len(stars))
+        return fitted
+
+    def _drawBatch(self, stars, values):
+        """Draw the model for each star into a single stacked array.
+
+        :param stars:   A list of Stars, all with the same stamp shape.
+        :param values:  An array of shape (nstars, 6) with (flux, du, dv, scale, g1, g2).
+
+        :returns: an array of shape (nstars, ny, nx)
+        """
+        import galsim
+        images = np.zeros((len(stars),) + stars[0].image.array.shape)
+        for star, val, array in zip(stars, values, images):
+            b = star.image.bounds
+            image = galsim.Image(array, xmin=b.xmin, ymin=b.ymin, wcs=star.image.wcs)
+            # Each star has different parameters, so don't use the profile cache.
+            prof = self._transform(*val)
+            prof.drawImage(image, method=self._method,
+                           offset=(star.image_pos - image.trueCenter()))
+        return images
+
+    def _batchMomentFit(self, stars, logger=None):
+        """The implementation of fitStarList with fastfit for stars with the same stamp shape.
+        """
+        n = len(stars)
+        ny, nx = stars[0].image.array.shape
+        data = np.array([ s.image.array for s in stars ]).reshape(n, -1)
+        weight = np.array([ s.weight.array for s in stars ]).reshape(n, -1)
+        mask = weight != 0.
+
+        # The world coordinates of each pixel relative to image_pos, using the local wcs.
+        jac = [ s.data.local_wcs.jacobian() for s in stars ]
+        dudx, dudy, dvdx, dvdy = np.array([ (j.dudx, j.dudy, j.dvdx, j.dvdy) for j in jac ]).T
+        x = (np.array([ s.image.bounds.xmin - s.image_pos.x for s in stars ])[:,np.newaxis]
+             + np.tile(np.arange(nx), ny)[np.newaxis,:])
+        y = (np.array([ s.image.bounds.ymin - s.image_pos.y for s in stars ])[:,np.newaxis]
+             + np.repeat(np.arange(ny), nx)[np.newaxis,:])
+        u = dudx[:,np.newaxis] * x + dudy[:,np.newaxis] * y
+        v = dvdx[:,np.newaxis] * x + dvdy[:,np.newaxis] * y
+
+        # Current parameters, as in moment_fit.
+        values = np.array([ self._start_values(s) for s in stars ], dtype=float)
+        models = self._drawBatch(stars, values).reshape(n, -1)
+
+        flux, cenu, cenv, size, g1, g2, flag = adaptive_moments(data, u, v, mask)
+        ref_flux, ref_cenu, ref_cenv, ref_size, ref_g1, ref_g2, ref_flag = adaptive_moments(
+                models, u, v, mask)
+
+        param_flux, param_du, param_dv, param_scale, param_g1, param_g2 = values.T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            param_flux = param_flux * flux / ref_flux
+            param_scale = param_scale * size / ref_size
+        param_du = param_du + cenu - ref_cenu
+        param_dv = param_dv + cenv - ref_cenv
+        dg1, dg2 = add_shears(g1, g2, -ref_g1, -ref_g2)
+        param_g1, param_g2 = add_shears(param_g1, param_g2, dg1, dg2)
+        values = np.array([ param_flux, param_du, param_dv, param_scale, param_g1, param_g2 ]).T
+
+        good = ((flag == 0) & (ref_flag == 0) & np.all(np.isfinite(values), axis=1)
+                & (param_flux > 0.) & (param_scale > 0.) & (param_g1**2 + param_g2**2 < 1.))
+
+        # Also need to compute chisq
+        good_stars = [ s for s, g in zip(stars, good) if g ]
+        fitted = [None] * n
+        if len(good_stars) == 0:
+            return fitted
+        models = self._drawBatch(good_stars, values[good]).reshape(len(good_stars), -1)
+        chisq = np.sum(weight[good] * (data[good] - models)**2, axis=1)
+        dof = np.count_nonzero(weight[good], axis=1) - self._nparams
+
+        for i, c, d in zip(np.where(good)[0], chisq, dof):
+            flux, du, dv, scale, g1, g2 = values[i]
+            if self._force_model_center:
+                params = np.array([ scale, g1, g2 ])
+                center = (du, dv)
+            else:
+                params = np.array([ du, dv, scale, g1, g2 ])
+                center = (0.0, 0.0)
+            fitted[i] = Star(stars[i].data,
+                             StarFit(params, flux=flux, center=center, chisq=c, dof=d))
+        return fitted
+
     def initialize(self, star, mask=True, logger=None):
         """Initialize the given star's fit parameters.
 
@@ -305,7 +593,7 @@ class GSObjectModel(Model):
 
         :returns:           New Star instance, with updated flux, center, chisq, dof, worst
         """
-        if logger:
+        if logger is not None and logger.isEnabledFor(logging.DEBUG):
             logger.debug("Reflux for star:")
             logger.debug("    flux = %s",star.fit.flux)
             logger.debug("    center = %s",star.fit.center)
@@ -316,7 +604,16 @@ class GSObjectModel(Model):
             logger.debug("    image center = %s",star.data.image(star.data.image.center()))
             logger.debug("    weight center = %s",star.data.weight(star.data.weight.center()))
         do_center = fit_center and self._force_model_center
-        if do_center:
+        if do_center and self._fitter == 'least_squares':
+            values, results = self._least_squares_minimize(star, vary_params=False, logger=logger)
+            return Star(star.data, StarFit(star.fit.params,
+                                           flux = values[0],
+                                           center = (values[1], values[2]),
+                                           chisq = 2. * results.cost,
+                                           dof = np.count_nonzero(star.data.weight.array) - 3,
+                                           alpha = star.fit.alpha,
+                                           beta = star.fit.beta))
+        elif do_center:
             params = self._lmfit_params(star, vary_params=False)
             results = self._lmfit_minimize(params, star, logger=logger)
             return Star(star.data, StarFit(star.fit.params,
@@ -351,12 +648,19 @@ class Gaussian(GSObjectModel):
                         position is fixed at input value and the fitted PSF may be off-center.
                         [default: True]
     :param include_pixel:   Include integration over pixel?  [default: True]
+    :param fitter:   Which minimizer to use when not using fastfit, 'lmfit' or 'least_squares'.
+                     See GSObjectModel for details.  [default: 'lmfit']
+    :param batch_fastfit:   With fastfit, fit all the stars together in fitStarList using
+                     vectorized moments rather than HSM.  See GSObjectModel for details.
+                     [default: False]
     :param logger:   A logger object for logging debug info. [default: None]
     """
-    def __init__(self, fastfit=False, force_model_center=True, include_pixel=True, logger=None):
+    def __init__(self, fastfit=False, force_model_center=True, include_pixel=True,
+                 fitter='lmfit', batch_fastfit=False, logger=None):
         import galsim
         gsobj = galsim.Gaussian(sigma=1.0)
-        GSObjectModel.__init__(self, gsobj, fastfit, force_model_center, include_pixel, logger)
+        GSObjectModel.__init__(self, gsobj, fastfit, force_model_center, include_pixel,
+                               fitter=fitter, batch_fastfit=batch_fastfit, logger=logger)
         # We'd need self.kwargs['gsobj'] if we were reconstituting via the GSObjectModel
         # constructor, but since config['type'] for this will be Gaussian, it gets reconstituted
         # here, where there is no `gsobj` argument.  So remove `gsobj` from kwargs.
@@ -372,12 +676,19 @@ class Kolmogorov(GSObjectModel):
                         position is fixed at input value and the fitted PSF may be off-center.
                         [default: True]
     :param include_pixel:   Include integration over pixel?  [default: True]
+    :param fitter:   Which minimizer to use when not using fastfit, 'lmfit' or 'least_squares'.
+                     See GSObjectModel for details.  [default: 'lmfit']
+    :param batch_fastfit:   With fastfit, fit all the stars together in fitStarList using
+                     vectorized moments rather than HSM.  See GSObjectModel for details.
+                     [default: False]
     :param logger:   A logger object for logging debug info. [default: None]
     """
-    def __init__(self, fastfit=False, force_model_center=True, include_pixel=True, logger=None):
+    def __init__(self, fastfit=False, force_model_center=True, include_pixel=True,
+                 fitter='lmfit', batch_fastfit=False, logger=None):
         import galsim
         gsobj = galsim.Kolmogorov(half_light_radius=1.0)
-        GSObjectModel.__init__(self, gsobj, fastfit, force_model_center, include_pixel, logger)
+        GSObjectModel.__init__(self, gsobj, fastfit, force_model_center, include_pixel,
+                               fitter=fitter, batch_fastfit=batch_fastfit, logger=logger)
         # We'd need self.kwargs['gsobj'] if we were reconstituting via the GSObjectModel
         # constructor, but since config['type'] for this will be Kolmogorov, it gets reconstituted
         # here, where there is no `gsobj` argument.  So remove `gsobj` from kwargs.
@@ -396,16 +707,140 @@ class Moffat(GSObjectModel):
                         position is fixed at input value and the fitted PSF may be off-center.
                         [default: True]
     :param include_pixel:   Include integration over pixel?  [default: True]
+    :param fitter:   Which minimizer to use when not using fastfit, 'lmfit' or 'least_squares'.
+                     See GSObjectModel for details.  [default: 'lmfit']
+    :param batch_fastfit:   With fastfit, fit all the stars together in fitStarList using
+                     vectorized moments rather than HSM.  See GSObjectModel for details.
+                     [default: False]
     :param logger:   A logger object for logging debug info. [default: None]
     """
     def __init__(self, beta, trunc=0., fastfit=False, force_model_center=True, include_pixel=True,
-                 logger=None):
+                 fitter='lmfit', batch_fastfit=False, logger=None):
         import galsim
         gsobj = galsim.Moffat(half_light_radius=1.0, beta=beta, trunc=trunc)
-        GSObjectModel.__init__(self, gsobj, fastfit, force_model_center, include_pixel, logger)
+        GSObjectModel.__init__(self, gsobj, fastfit, force_model_center, include_pixel,
+                               fitter=fitter, batch_fastfit=batch_fastfit, logger=logger)
         # We'd need self.kwargs['gsobj'] if we were reconstituting via the GSObjectModel
         # constructor, but since config['type'] for this will be Moffat, it gets reconstituted
         # here, where there is no `gsobj` argument.  So remove `gsobj` from kwargs.
         del self.kwargs['gsobj']
         # Need to add `beta` and `trunc` though.
         self.kwargs.update(dict(beta=beta, trunc=trunc))
+
+
+def _is_radial(gsobj, rtol=1.e-6):
+    """Check whether a (centered) profile is radially symmetric, by comparing its Fourier
+    transform along a few different directions.
+
+    :param gsobj:   The GSObject to check.
+    :param rtol:    The tolerance relative to the total flux. [default: 1.e-6]
+
+    :returns: whether the profile is radially symmetric
+    """
+    f0 = abs(gsobj.kValue(0., 0.))
+    for q in gsobj.maxk * np.array([0.02, 0.05, 0.1, 0.2, 0.4]):
+        kx = gsobj.kValue(q, 0.)
+        ky = gsobj.kValue(0., q)
+        kd = gsobj.kValue(q/np.sqrt(2.), q/np.sqrt(2.))
+        if abs(kx-ky) > rtol * f0 or abs(kx-kd) > rtol * f0:
+            return False
+    return True
+
+
+class _KSpaceFitter(object):
+    """Compute the model image of a star for the parameters (flux, du, dv, scale, g1, g2)
+    along with its derivatives with respect to each parameter.
+
+    The fiducial profile is radially symmetric, so the Fourier transform of the transformed
+    profile is flux * g(|A k|) * exp(-i k.c), where A is the dilation and shear matrix and c is
+    the center.  The derivatives of this with respect to each parameter are simple functions
+    of g and dg/dk, so the model and all the derivative images are made with a single batch of
+    inverse FFTs rather than drawing the profile once for each parameter.
+
+    :param model:   The GSObjectModel being fit.
+    :param star:    The Star to fit.
+    :param values:  The initial (flux, du, dv, scale, g1, g2).  Any that are not varied are
+                    held fixed at these values.
+    :param vary:    A boolean array indicating which of the parameters are varied.
+    """
+    def __init__(self, model, star, values, vary):
+        self.qtab, self.gtab, self.dgtab = model._getKTable()
+        self.values = np.array(values, dtype=float)
+        self.vary = vary
+
+        image, weight, image_pos = star.data.getImage()
+        self.data = image.array
+        self.sqrt_weight = np.sqrt(weight.array)
+        b = image.bounds
+        N = 2 * max(b.xmax - b.xmin + 1, b.ymax - b.ymin + 1)
+
+        # The k values in image coordinates, and the corresponding world k values.
+        kx, ky = np.meshgrid(2.*np.pi * np.fft.rfftfreq(N), 2.*np.pi * np.fft.fftfreq(N))
+        jac = star.data.local_wcs.jacobian()
+        jinv = np.linalg.inv(np.array([[jac.dudx, jac.dudy], [jac.dvdx, jac.dvdy]]))
+        self.ku = jinv[0,0] * kx + jinv[1,0] * ky
+        self.kv = jinv[0,1] * kx + jinv[1,1] * ky
+
+        # Put the nominal center at the nearest pixel to image_pos in the FFT image, and
+        # apply the subpixel offset and the pixel response in k-space.
+        ix = int(np.floor(image_pos.x + 0.5))
+        iy = int(np.floor(image_pos.y + 0.5))
+        self.kfactor = np.exp(-1j * (kx * (image_pos.x-ix) + ky * (image_pos.y-iy)))
+        if model._method != 'no_pixel':
+            self.kfactor *= np.sinc(kx/(2.*np.pi)) * np.sinc(ky/(2.*np.pi))
+        self.N = N
+        self.xindex = (np.arange(b.xmin, b.xmax+1) - ix) % N
+        self.yindex = (np.arange(b.ymin, b.ymax+1) - iy) % N
+        self._x = None
+
+    def _compute(self, x):
+        # resid and jac are called with the same x, so only do the calculation once.
+        if self._x is not None and np.array_equal(x, self._x):
+            return
+        self._x = np.array(x)
+        self.values[self.vary] = x
+        flux, du, dv, scale, g1, g2 = self.values
+        ku = self.ku
+        kv = self.kv
+
+        # q = A k, where A = scale/sqrt(1-g^2) * [[1+g1, g2], [g2, 1-g1]]
+        s2 = 1. - g1*g1 - g2*g2
+        factor = scale / np.sqrt(s2)
+        qu = factor * ((1.+g1) * ku + g2 * kv)
+        qv = factor * (g2 * ku + (1.-g1) * kv)
+        qsq = qu*qu + qv*qv
+        q = np.sqrt(qsq)
+        g = np.interp(q, self.qtab, self.gtab, right=0.)
+        dg = np.interp(q, self.qtab, self.dgtab, right=0.)
+        # dg/dq / q, which is 0 at q=0, since dg/dq = 0 there.
+        dgq = dg / np.where(q > 0., q, 1.)
+
+        phase = self.kfactor * np.exp(-1j * (ku * du + kv * dv))
+        kimage = flux * g * phase
+        # d(kimage)/dp = flux * dg/dq * (q . dq/dp) / q * phase
+        fdgq = flux * dgq * phase
+        kimages = np.array([
+            kimage,
+            g * phase,                                                  # flux
+            -1j * ku * kimage,                                          # du
+            -1j * kv * kimage,                                          # dv
+            fdgq * qsq / scale,                                         # scale
+            fdgq * (factor * (qu*ku - qv*kv) + qsq * g1 / s2),          # g1
+            fdgq * (factor * (qu*kv + qv*ku) + qsq * g2 / s2),          # g2
+        ])
+        images = np.fft.irfft2(kimages, s=(self.N, self.N))
+        images = images[:, self.yindex[:,np.newaxis], self.xindex[np.newaxis,:]]
+        self._model = images[0]
+        self._deriv = images[1:][self.vary]
+
+    def resid(self, x):
+        """The residual function: `chi` as a flattened numpy array.
+        """
+        self._compute(x)
+        return (self.sqrt_weight * (self._model - self.data)).ravel()
+
+    def jac(self, x):
+        """The Jacobian of the residual function with respect to the varied parameters.
+        """
+        self._compute(x)
+        return (self.sqrt_weight * self._deriv).reshape(len(self._deriv), -1).T
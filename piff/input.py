@@ -20,6 +20,7 @@ from __future__ import print_function
 import numpy as np
 import glob
 import os
+import logging
 
 
 class Input(object):
@@ -192,6 +193,9 @@ class Input(object):
             if logger:
                 logger.info("Processing catalog %s with %d stars",fname,len(cat))
             nstars_in_image = 0
+            # Convert all the positions to field coordinates at once.
+            u, v, ra, dec = piff.StarData.calculateFieldPosArray(
+                    cat[self.x_col], cat[self.y_col], image.wcs, self.pointing)
             for k in range(len(cat)):
                 x = cat[self.x_col][k]
                 y = cat[self.y_col][k]
@@ -204,14 +208,17 @@ class Input(object):
                     bounds = bounds & image.bounds
                     if not bounds.isDefined():
                         if logger:
-                            logger.warning("Star at position %f,%f is off the edge of the image."%(x,y))
+                            logger.warning("Star at position %f,%f is off the edge of the image.",x,y)
                             logger.warning("Skipping this star.")
                         continue
                     if logger:
-                        logger.info("Star at position %f,%f is near the edge of the image."%(x,y))
-                        logger.info("Using smaller than the full stamp size: %s"%bounds)
+                        logger.info("Star at position %f,%f is near the edge of the image.",x,y)
+                        logger.info("Using smaller than the full stamp size: %s",bounds)
                 stamp = image[bounds]
                 props = { 'chipnum' : chipnum }
+                if ra is not None:
+                    props['ra'] = ra[k]
+                    props['dec'] = dec[k]
                 sky = None
                 if self.sky_col is not None:
                     sky = cat[self.sky_col][k]
@@ -235,12 +242,13 @@ class Input(object):
                 # if a star is totally masked, then don't add it!
                 if np.all(wt_stamp.array == 0):
                     if logger:
-                        logger.warning("Star at position %f,%f is completely masked."%(x,y))
+                        logger.warning("Star at position %f,%f is completely masked.",x,y)
                         logger.warning("Skipping this star.")
                     continue
                 pos = galsim.PositionD(x,y)
+                field_pos = galsim.PositionD(u[k], v[k])
                 data = piff.StarData(stamp, pos, weight=wt_stamp, pointing=self.pointing,
-                                     properties=props)
+                                     field_pos=field_pos, properties=props)
                 stars.append(piff.Star(data, None))
 
                 nstars_in_image += 1
@@ -544,13 +552,13 @@ class InputFiles(Input):
                 # The badpix image may be offset by 32768 from the true value.
                 # If so, subtract it off.
                 if np.any(badpix.array > 32767):
-                    if logger:
+                    if logger and logger.isEnabledFor(logging.DEBUG):
                         logger.debug('min(badpix) = %s',np.min(badpix.array))
                         logger.debug('max(badpix) = %s',np.max(badpix.array))
                         logger.debug("subtracting 32768 from all values in badpix image")
                     badpix -= 32768
                 if np.any(badpix.array < -32767):
-                    if logger:
+                    if logger and logger.isEnabledFor(logging.DEBUG):
                         logger.debug('min(badpix) = %s',np.min(badpix.array))
                         logger.debug('max(badpix) = %s',np.max(badpix.array))
                         logger.debug("adding 32768 to all values in badpix image")
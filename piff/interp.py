@@ -197,6 +197,11 @@ class Interp(object):
         # Check that interp_type is a valid Interp type.
         interp_classes = piff.util.get_all_subclasses(piff.Interp)
         valid_interp_types = dict([ (kls.__name__, kls) for kls in interp_classes ])
+        if interp_type not in valid_interp_types:
+            # It might be in a module that hasn't been imported yet.
+            piff._import_lazy_modules()
+            interp_classes = piff.util.get_all_subclasses(piff.Interp)
+            valid_interp_types = dict([ (kls.__name__, kls) for kls in interp_classes ])
         if interp_type not in valid_interp_types:
             raise ValueError("interpolator type %s is not a valid Piff Interpolator"%interp_type)
         interp_cls = valid_interp_types[interp_type]
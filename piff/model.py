@@ -169,6 +169,11 @@ class Model(object):
         # Check that model_type is a valid Model type.
         model_classes = piff.util.get_all_subclasses(piff.Model)
         valid_model_types = dict([ (c.__name__, c) for c in model_classes ])
+        if model_type not in valid_model_types:
+            # It might be in a module that hasn't been imported yet.
+            piff._import_lazy_modules()
+            model_classes = piff.util.get_all_subclasses(piff.Model)
+            valid_model_types = dict([ (c.__name__, c) for c in model_classes ])
         if model_type not in valid_model_types:
             raise ValueError("model type %s is not a valid Piff Model"%model_type)
         model_cls = valid_model_types[model_type]
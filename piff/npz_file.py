@@ -0,0 +1,151 @@
+# Copyright (c) 2016 by Mike Jarvis and the other collaborators on GitHub at
+# https://github.com/rmjarvis/Piff  All rights reserved.
+#
+# Piff is free software: Redistribution and use in source and binary forms
+# with or without modification, are permitted provided that the following
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the disclaimer given in the accompanying LICENSE
+#    file.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the disclaimer given in the documentation
+#    and/or other materials provided with the distribution.
+
+"""
+.. module:: npz_file
+"""
+
+from __future__ import print_function
+
+import numpy as np
+import json
+
+class NpzFile(object):
+    """A binary alternative to FITS files for storing Piff objects.
+
+    This implements the small part of the fitsio.FITS interface that the Piff write and read
+    functions use, so any Piff object that can be written to a FITS file can also be written
+    to one of these.  All the tables go into a single numpy .npz file along with a JSON
+    manifest listing the extensions and their headers.
+
+    Reading one of these avoids parsing FITS headers, and np.load only reads the
+    extensions that are actually accessed, so it is much faster than the FITS format
+    when many small PSF files need to be read.
+
+    Like fitsio.FITS, this can be used as a context manager:
+
+        >>> with piff.NpzFile(file_name, 'rw') as f:
+        ...     psf._write(f, 'psf')
+
+    :param file_name:   The name of the file.
+    :param mode:        'r' to read an existing file, 'rw' to write a new one. [default: 'r']
+    :param clobber:     Ignored. A file opened for writing is always overwritten.  This is
+                        just for compatibility with fitsio.FITS. [default: False]
+    """
+    format_name = 'piff_npz'
+    format_version = 1
+
+    def __init__(self, file_name, mode='r', clobber=False):
+        self.file_name = file_name
+        self.mode = mode
+        self._tables = {}
+        self._headers = {}
+        self._cache = {}
+        if mode == 'r':
+            self._npz = np.load(file_name, allow_pickle=False)
+            manifest = json.loads(str(self._npz['manifest']))
+            if manifest.get('format') != self.format_name:
+                raise IOError("%s is not a Piff npz file"%file_name)
+            self._headers = manifest['headers']
+        elif mode == 'rw':
+            self._npz = None
+        else:
+            raise ValueError("Invalid mode %s for NpzFile"%mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write_table(self, data, extname, header=None):
+        """Add a table to the file.
+
+        :param data:        A numpy structured array.
+        :param extname:     The name of the extension.
+        :param header:      An optional dict of header values to store with the table.
+                            [default: None]
+        """
+        if self.mode != 'rw':
+            raise IOError("NpzFile %s is not open for writing"%self.file_name)
+        self._tables[extname] = np.asarray(data)
+        if header is None:
+            header = {}
+        # Match the FITS convention of upper case header keys.
+        self._headers[extname] = dict([ (k.upper(), _to_json(v)) for k,v in header.items() ])
+
+    def close(self):
+        """Close the file.  If it was opened for writing, this is when it is written to disk.
+        """
+        if self.mode == 'rw' and self._tables is not None:
+            manifest = { 'format' : self.format_name,
+                         'version' : self.format_version,
+                         'headers' : self._headers }
+            tables = dict(self._tables, manifest=np.array(json.dumps(manifest)))
+            # Use an open file, so np.savez doesn't append .npz to the file name.
+            with open(self.file_name, 'wb') as f:
+                np.savez(f, **tables)
+            self._tables = None
+        elif self._npz is not None:
+            self._npz.close()
+            self._npz = None
+
+    def __contains__(self, extname):
+        return extname in self._headers
+
+    def __getitem__(self, extname):
+        if extname not in self:
+            raise KeyError("Extension %s not found in %s"%(extname, self.file_name))
+        return _NpzExtension(self, extname)
+
+    def _read_table(self, extname):
+        if self.mode == 'rw':
+            return self._tables[extname]
+        else:
+            # Each access to an NpzFile item reads it from disk again, so keep the result.
+            if extname not in self._cache:
+                self._cache[extname] = self._npz[extname]
+            return self._cache[extname]
+
+
+class _NpzExtension(object):
+    # The equivalent of a fitsio HDU object, with just the methods Piff uses.
+    def __init__(self, npz_file, extname):
+        self.npz_file = npz_file
+        self.extname = extname
+
+    def read(self):
+        return self.npz_file._read_table(self.extname)
+
+    def get_colnames(self):
+        return list(self.read().dtype.names)
+
+    def read_header(self):
+        return dict(self.npz_file._headers[self.extname])
+
+
+def _to_json(value):
+    # Convert numpy scalars to the corresponding python types, which json can handle.
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
+
+def is_npz_file(file_name):
+    """Check whether a file name is meant to use the npz format rather than FITS.
+
+    :param file_name:   The name of the file.
+
+    :returns: whether the file name ends in .npz
+    """
+    return file_name.endswith('.npz')
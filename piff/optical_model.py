@@ -25,6 +25,7 @@ import numpy as np
 
 from .model import Model
 from .star import Star, StarFit, StarData
+from .util import LRUCache, radial_kvalues
 
 # The only one here by default is 'des', but this allows people to easily add another template
 optical_templates = {
@@ -39,7 +40,26 @@ optical_templates = {
            },
 }
 
+# The keys of the OpticalPSF kwargs that describe the pupil plane geometry.  These go into a
+# galsim.Aperture, which is the same for any aberrations.
+_aperture_keys = ('circular_pupil', 'obscuration', 'oversampling', 'pad_factor',
+                  'nstruts', 'strut_thick', 'strut_angle', 'pupil_plane_im',
+                  'pupil_angle', 'pupil_plane_scale', 'pupil_plane_size')
+
+# Profiles made by Optical.getProfile, keyed by the fixed parameters of the model and the
+# (rounded) aberrations.  Making an OpticalPSF requires an FFT of the pupil plane, so this lets
+# repeated draws with the same aberrations reuse the same profile, even across models with
+# the same parameters, e.g. for each chip in a SingleChipPSF.  Each profile can hold fairly
+# large arrays, so only keep a few.
+_profile_cache = LRUCache(20)
+
 class Optical(Model):
+    # Aberrations that agree to this many decimal places (in waves) use the same profile.
+    _aberration_decimals = 6
+
+    # The number of aberration vectors to process together in drawStarList.
+    _batch_size = 8
+
     def __init__(self, template=None, logger=None, **kwargs):
         """Initialize the Optical Model
 
@@ -80,6 +100,13 @@ class Optical(Model):
         :param g1, g2:          Shear to apply to final image. Simulates vibrational modes.
                                 [default: 0]
 
+        There is also an option to speed up drawing many stars at once.
+
+        :param batch_draw:      Whether drawStarList should use the batched FFT renderer, rather
+                                than calling draw for each star.  This is faster, but the images
+                                are only accurate to about 1.e-4 of the peak value.  See
+                                drawStarList for details. [default: False]
+
         Since there are a lot of parameters here, we provide the option of setting many of them
         from a template value.  e.g. template = 'des' will use the values stored in the dict
         piff.optical_model.optical_templates['des'].
@@ -141,6 +168,7 @@ class Optical(Model):
         self.sigma = kwargs.pop('sigma',None)
         self.g1 = kwargs.pop('g1',None)
         self.g2 = kwargs.pop('g2',None)
+        self.batch_draw = kwargs.pop('batch_draw',False)
 
         # Check that no unexpected parameters were passed in:
         extra_kwargs = [k for k in kwargs if k not in optical_psf_keys and k not in kolmogorov_keys]
@@ -158,6 +186,41 @@ class Optical(Model):
             if key in self.kwargs:
                 self.kwargs[key] = repr(self.kwargs[key])
 
+        self._cache_key = self._makeCacheKey()
+        self._aper = None
+        self._pupil = None
+        self._atm_table = None
+
+    def _makeCacheKey(self):
+        """Make a hashable key from all the fixed parameters of the profile.
+        """
+        items = []
+        for key, value in sorted(self.optical_psf_kwargs.items()):
+            if key == 'pupil_plane_im':
+                # Use a hash of the image, rather than its repr, which may be large.
+                import hashlib
+                value = hashlib.sha1(np.ascontiguousarray(value.array).tobytes()).hexdigest()
+            items.append((key, repr(value)))
+        kolmogorov = tuple((key, repr(value)) for key, value
+                           in sorted(self.kolmogorov_kwargs.items()))
+        return (tuple(items), kolmogorov, self.sigma, self.g1, self.g2)
+
+    def _getAperture(self):
+        """Get a galsim.Aperture for the pupil plane geometry, which can be used for any
+        aberrations.
+
+        :returns: the galsim.Aperture, or None if this version of GalSim doesn't have them.
+        """
+        if self._aper is None and hasattr(galsim, 'Aperture'):
+            kwargs = { key : self.optical_psf_kwargs[key] for key in self.optical_psf_kwargs
+                                                          if key in _aperture_keys }
+            # These defaults are different for Aperture than for OpticalPSF.
+            kwargs.setdefault('oversampling', 1.5)
+            kwargs.setdefault('pad_factor', 1.5)
+            self._aper = galsim.Aperture(diam=self.optical_psf_kwargs['diam'],
+                                         lam=self.optical_psf_kwargs['lam'], **kwargs)
+        return self._aper
+
     def fit(self, star):
         """Warning: This method just updates the fit with the chisq and dof!
 
@@ -180,11 +243,26 @@ class Optical(Model):
     def getProfile(self, params):
         """Get a version of the model as a GalSim GSObject
 
+        The profiles are cached, so calling this again with the same aberrations (up to
+        rounding at the level of 1.e-6 waves) returns the same object.
+
         :param params:      A np array with [z4, z5, z6...z11]
 
         :returns: a galsim.GSObject instance
         """
-        import galsim
+        if params is None:
+            params = []
+        aberrations = tuple(float(a) for a in np.round(params, self._aberration_decimals))
+        key = (self._cache_key, aberrations)
+        prof = _profile_cache.get(key)
+        if prof is None:
+            prof = self._makeProfile(aberrations)
+            _profile_cache.put(key, prof)
+        return prof
+
+    def _makeProfile(self, params):
+        """The implementation of getProfile without the caching.
+        """
         prof = []
         # gaussian
         if self.sigma is not None:
@@ -200,7 +278,15 @@ class Optical(Model):
             pass
         else:
             aberrations = [0,0,0,0] + list(params)
-            optics = galsim.OpticalPSF(aberrations=aberrations, **self.optical_psf_kwargs)
+            aper = self._getAperture()
+            if aper is None:
+                optics = galsim.OpticalPSF(aberrations=aberrations, **self.optical_psf_kwargs)
+            else:
+                # Reuse the aperture, so the pupil plane doesn't need to be built again.
+                # obscuration is still needed for annular Zernikes.
+                kwargs = { key : self.optical_psf_kwargs[key] for key in self.optical_psf_kwargs
+                                        if key not in _aperture_keys or key == 'obscuration' }
+                optics = galsim.OpticalPSF(aberrations=aberrations, aper=aper, **kwargs)
             prof.append(optics)
             # convolve together
 
@@ -214,6 +300,173 @@ class Optical(Model):
 
         return prof
 
+    def drawStarList(self, stars, logger=None):
+        """Draw the model for many stars.
+
+        By default, this just calls draw for each star.  With the batch_draw option, rather
+        than building a galsim.OpticalPSF for each star, it sets up the pupil plane once,
+        evaluates the Zernike wavefront for a batch of aberration vectors at a time, and gets
+        the optical transfer functions (OTFs) with stacked FFTs.  These are multiplied by the
+        Fourier transform of the atmospheric and Gaussian components, sheared, and drawn onto
+        each star's image with an inverse FFT.
+
+        The batched rendering is an approximation, since it bilinearly interpolates the OTFs,
+        which are only computed on a discrete grid.  The images typically differ from the ones
+        made by draw by up to about 1.e-4 of the peak value.
+
+        :param stars:   A list of Star instances with the fitted parameters to use for drawing
+                        and a data field that acts as a template image for the drawn model.
+        :param logger:  A logger object for logging debug info. [default: None]
+
+        :returns: a list of new Star instances with the data fields having images of the
+                  drawn models.
+        """
+        if (not self.batch_draw or len(stars) == 0 or self._getAperture() is None or
+                any(s.fit.params is None or len(s.fit.params) == 0 for s in stars)):
+            # Before GalSim 2.0, there is no Aperture to use for the pupil plane.
+            # And if there are no aberrations, there is no optical component to batch.
+            return [ self.draw(s) for s in stars ]
+
+        if logger:
+            logger.debug("Drawing %d stars in batches of %d", len(stars), self._batch_size)
+        drawn = []
+        for k in range(0, len(stars), self._batch_size):
+            batch = stars[k:k+self._batch_size]
+            otfs = self._getOTFs(np.array([ s.fit.params for s in batch ]))
+            for star, otf in zip(batch, otfs):
+                drawn.append(self._drawOTF(star, otf))
+        return drawn
+
+    def _getPupil(self, nparams):
+        """Set up the pupil plane for drawStarList.
+
+        :param nparams:     The number of Zernike coefficients, starting at z4.
+
+        :returns: (illuminated, N, basis), where illuminated is the boolean array of the
+                  illuminated pupil pixels, N is the size of the padded arrays to use for the
+                  FFTs, and basis is an array of shape (nparams, nilluminated) with the value of
+                  each Zernike polynomial at each illuminated pixel.
+        """
+        if self._pupil is None or len(self._pupil[2]) != nparams:
+            aper = self._getAperture()
+            illuminated = aper.illuminated
+            npix = illuminated.shape[0]
+            scale = aper.pupil_plane_scale
+            diam = self.optical_psf_kwargs['diam']
+            # Pad the pupil enough that its autocorrelation doesn't wrap around.
+            N = max(npix, int(np.ceil(2. * diam / scale)) + 2)
+            N += N % 2
+            u = (np.arange(npix) - npix//2) * scale
+            u, v = np.meshgrid(u, u)
+            rho = (u + 1j*v)[illuminated] / (0.5 * diam)
+            r = np.abs(rho)
+            theta = np.angle(rho)
+            basis = np.array([ _zernike(j, r, theta) for j in range(4, 4+nparams) ])
+            self._pupil = (illuminated, N, basis)
+        return self._pupil
+
+    def _getOTFs(self, params):
+        """Compute the OTFs of the optical component for a batch of aberration vectors.
+
+        :param params:      An array of shape (nbatch, nparams) with [z4, z5, ...] for each.
+
+        :returns: an array of shape (nbatch, N, N) with the OTF as a function of the
+                  displacement in the pupil plane in pupil pixels.
+        """
+        illuminated, N, basis = self._getPupil(params.shape[1])
+        npix = illuminated.shape[0]
+        # The wavefront in waves for each set of aberrations.
+        wf = params.dot(basis)
+        pupil = np.zeros((len(params), N, N), dtype=complex)
+        pupil[:, :npix, :npix][:, illuminated] = np.exp(2j * np.pi * wf)
+        # The OTF is the autocorrelation of the pupil function.
+        otf = np.fft.ifft2(np.abs(np.fft.fft2(pupil))**2)
+        otf /= otf[:, 0, 0][:, np.newaxis, np.newaxis]
+        return otf
+
+    def _getAtmosphereTable(self, qmax):
+        """Get a table of the Fourier transform of the atmospheric and Gaussian components.
+
+        :param qmax:    The maximum k value needed.
+
+        :returns: (q, g) or None if there are neither of these components.
+        """
+        if self._atm_table is None:
+            prof = []
+            if self.sigma is not None:
+                prof.append(galsim.Gaussian(sigma=self.sigma))
+            if len(self.kolmogorov_kwargs) > 0:
+                prof.append(galsim.Kolmogorov(**self.kolmogorov_kwargs))
+            if len(prof) == 0:
+                self._atm_table = ()
+            else:
+                self._atm_table = radial_kvalues(galsim.Convolve(prof), qmax=qmax)
+        return self._atm_table if len(self._atm_table) > 0 else None
+
+    def _drawOTF(self, star, otf):
+        """Draw the model for a star given the OTF of the optical component.
+        """
+        image = star.data.image.copy()
+        b = image.bounds
+        ny, nx = image.array.shape
+        N = 2 * max(nx, ny)
+
+        # The k values (in scale_unit^-1) at which the OTF is nonzero.
+        scale_unit = self.optical_psf_kwargs.get('scale_unit', galsim.arcsec)
+        if isinstance(scale_unit, str):
+            scale_unit = galsim.AngleUnit.from_name(scale_unit)
+        units_per_rad = galsim.radians / scale_unit
+        lam = self.optical_psf_kwargs['lam'] * 1.e-9   # meters
+        qmax = 2. * np.pi * self.optical_psf_kwargs['diam'] / lam / units_per_rad
+        atm = self._getAtmosphereTable(qmax)
+        if atm is not None:
+            qmax = min(qmax, atm[0][-1])
+
+        # The shear matrix.  This is applied after the convolution, so the sheared profile
+        # has F(k) = F_unsheared(S k).
+        g1 = self.g1 or 0.
+        g2 = self.g2 or 0.
+        gsq = g1*g1 + g2*g2
+        S = np.array([[1.+g1, g2], [g2, 1.-g1]]) / np.sqrt(1.-gsq)
+
+        # The k values in image coordinates, going out far enough to include all of the
+        # profile.  The image is sampled without the pixel, so the k values beyond the Nyquist
+        # frequency get folded back in.
+        jac = star.data.local_wcs.jacobian()
+        J = np.array([[jac.dudx, jac.dudy], [jac.dvdx, jac.dvdy]])
+        kmax = qmax * np.sqrt((1.+np.sqrt(gsq)) / (1.-np.sqrt(gsq))) * np.linalg.norm(J, 2)
+        nfold = 2 * int(np.ceil(max(kmax/np.pi - 1., 0.) / 2.)) + 1
+        M = N * nfold
+        kx, ky = np.meshgrid(2.*np.pi/N * (np.arange(M) - M//2),
+                             2.*np.pi/N * (np.arange(M) - M//2))
+        jinv = np.linalg.inv(J)
+        ku = jinv[0,0] * kx + jinv[1,0] * ky
+        kv = jinv[0,1] * kx + jinv[1,1] * ky
+        qu = S[0,0] * ku + S[0,1] * kv
+        qv = S[1,0] * ku + S[1,1] * kv
+
+        # The OTF is tabulated as a function of the displacement in pupil pixels.
+        factor = lam * units_per_rad / (2. * np.pi * self._getAperture().pupil_plane_scale)
+        kimage = _bilinear_wrap(otf, qu * factor, qv * factor)
+        if atm is not None:
+            kimage *= np.interp(np.sqrt(qu*qu + qv*qv), atm[0], atm[1], right=0.)
+
+        # Shift to the star's position.  Put the nearest pixel at the origin of the FFT image.
+        pos = star.data.image_pos + galsim.PositionD(*star.fit.center)
+        ix = int(np.floor(pos.x + 0.5))
+        iy = int(np.floor(pos.y + 0.5))
+        kimage *= np.exp(-1j * (kx * (pos.x-ix) + ky * (pos.y-iy)))
+
+        # Fold into a single period.  M//2 is an odd multiple of N/2, so after summing the
+        # blocks, shift by N/2 to put k=0 at index 0.
+        kimage = np.fft.ifftshift(kimage.reshape(nfold, N, nfold, N).sum(axis=(0,2)))
+        full = np.fft.ifft2(kimage).real
+        xindex = (np.arange(b.xmin, b.xmax+1) - ix) % N
+        yindex = (np.arange(b.ymin, b.ymax+1) - iy) % N
+        image.array[:,:] = full[yindex[:,np.newaxis], xindex[np.newaxis,:]]
+        data = StarData(image, star.data.image_pos, star.data.weight)
+        return Star(data, star.fit)
+
     def draw(self, star):
         """Draw the model on the given image.
 
@@ -229,3 +482,51 @@ class Optical(Model):
         image = prof.drawImage(star.data.image.copy(), method='no_pixel', offset=offset)
         data = StarData(image, star.data.image_pos, star.data.weight)
         return Star(data, star.fit)
+
+
+def _noll_to_zern(j):
+    """Convert a Noll index j to the radial order n and azimuthal order m of the Zernike
+    polynomial.  Positive m means cos(m theta), negative m means sin(|m| theta).
+    """
+    n = 0
+    j1 = j-1
+    while j1 > n:
+        n += 1
+        j1 -= n
+    m = (-1)**j * ((n % 2) + 2 * ((j1 + ((n+1) % 2)) // 2))
+    return n, m
+
+def _zernike(j, r, theta):
+    """Evaluate the Noll-indexed Zernike polynomial Z_j at polar coordinates (r, theta) on the
+    unit disk, using the same normalization as GalSim.
+    """
+    from math import factorial
+    n, m = _noll_to_zern(j)
+    am = abs(m)
+    R = np.zeros_like(r)
+    for k in range((n-am)//2 + 1):
+        coef = ((-1)**k * factorial(n-k) /
+                (factorial(k) * factorial((n+am)//2 - k) * factorial((n-am)//2 - k)))
+        R += coef * r**(n-2*k)
+    if m == 0:
+        return np.sqrt(n+1.) * R
+    elif m > 0:
+        return np.sqrt(2.*(n+1.)) * R * np.cos(m * theta)
+    else:
+        return np.sqrt(2.*(n+1.)) * R * np.sin(am * theta)
+
+def _bilinear_wrap(array, x, y):
+    """Bilinear interpolation of a periodic 2d array at (possibly non-integer) indices x, y,
+    where x is the index along the second axis and y along the first.
+    """
+    ny, nx = array.shape
+    x0 = np.floor(x)
+    y0 = np.floor(y)
+    fx = x - x0
+    fy = y - y0
+    ix0 = x0.astype(int) % nx
+    iy0 = y0.astype(int) % ny
+    ix1 = (ix0 + 1) % nx
+    iy1 = (iy0 + 1) % ny
+    return ((1.-fx) * (1.-fy) * array[iy0, ix0] + fx * (1.-fy) * array[iy0, ix1] +
+            (1.-fx) * fy * array[iy1, ix0] + fx * fy * array[iy1, ix1])
@@ -19,7 +19,6 @@
 from __future__ import print_function
 import math
 import numpy as np
-from scipy.stats import chi2
 
 from .util import write_kwargs, read_kwargs
 
@@ -72,6 +71,17 @@ class Outliers(object):
         kwargs.update(config_outliers)
         return kwargs
 
+    def removeOutliers(self, stars, logger=None):
+        """Remove outliers from a list of stars.
+
+        :param stars:       A list of Star instances
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        :returns: stars, nremoved   A new list of stars without outliers, and how many outliers
+                                    were removed.
+        """
+        raise NotImplementedError("Derived classes must define the removeOutliers function")
+
     def write(self, fits, extname):
         """Write an Outliers to a FITS file.
 
@@ -142,7 +152,7 @@ class Outliers(object):
 class MADOutliers(Outliers):
     """An Outliers handler using mean absolute deviation (MAD) for defining outliers.
 
-        MAD = < |x - median] >
+        MAD = < |x - median| >
 
     The range of values to keep in the sample are
 
@@ -150,13 +160,23 @@ class MADOutliers(Outliers):
 
     where nmad is a parameter specified by the user.
 
-    The user can specify this parameter in one of two ways.  
+    The user can specify this parameter in one of two ways.
 
         1. The user can specify nmad directly.
         2. The user can specify nsigma, in which case nmad = sqrt(pi/2) nsigma, the equivalent
            value for a Gaussian distribution.
+
+    The values x are the fitted parameter vectors of the stars, star.fit.params.  If an
+    interpolator is provided to :func:`removeOutliers`, the residuals of the fitted parameters
+    relative to the interpolated parameters are used instead.  The median and MAD are computed
+    separately for each parameter, and a star is declared an outlier if any of its parameters
+    is outside the allowed range.
+
+    Unlike ChisqOutliers, this does not require drawing the model for each star, so it is
+    quite fast.  For very large numbers of stars, the median and MAD may be estimated from a
+    random subsample of the stars by setting nsample.
     """
-    def __init__(self, nmad=None, nsigma=None):
+    def __init__(self, nmad=None, nsigma=None, max_remove=None, nsample=None):
         """
         Either nmad or nsigma must be provided.
 
@@ -164,27 +184,106 @@ class MADOutliers(Outliers):
                             something is declared an outlier.
         :param nsigma:      The number of sigma equivalent if the underlying distribution is
                             Gaussian.
+        :param max_remove:  The maximum number of outliers to remove on each iteration.
+                            [default: None]
+        :param nsample:     If given, estimate the median and MAD from a random subsample of
+                            this many stars when there are more stars than this.
+                            [default: None, which means use all the stars]
         """
         if nmad is None and nsigma is None:
             raise TypeError("Either nmad or nsigma is required")
+        if nmad is not None and nsigma is not None:
+            raise TypeError("Only one of nmad or nsigma may be given.")
         if nsigma is not None:
             nmad = math.sqrt(math.pi/2) * nsigma
         self.nmad = nmad
+        self.max_remove = max_remove
+        self.nsample = nsample
+        # This tells SimplePSF that it should call removeOutliers with the fitted parameters
+        # rather than the refluxed, interpolated ones.
+        self.uses_params = True
 
         self.kwargs = {
             'nmad' : nmad,
+            'max_remove' : max_remove,
+            'nsample' : nsample,
         }
 
-    def removeOutliers(self, stars):
+    def _median_mad(self, resid):
+        """Compute the median and MAD of each column of resid, possibly using a subsample.
+        """
+        if self.nsample is not None and len(resid) > self.nsample:
+            # Use a fixed seed, so the results are deterministic.
+            np_rng = np.random.RandomState(len(resid))
+            index = np_rng.choice(len(resid), size=self.nsample, replace=False)
+            sample = resid[index]
+        else:
+            sample = resid
+        median = np.median(sample, axis=0)
+        mad = np.mean(np.abs(sample - median), axis=0)
+        return median, mad
+
+    def removeOutliers(self, stars, logger=None, interp=None):
         """Remove outliers from a list of stars based on their fit parameters.
 
+        After this call, the (scaled) deviations of each star's most discrepant parameter
+        are available as the attribute ``last_dev``.  Stars with last_dev > nmad are outliers.
+
         :param stars:       A list of Star instances
+        :param logger:      A logger object for logging debug info. [default: None]
+        :param interp:      Optionally, an Interp instance to use for computing the residuals
+                            of the fitted parameters from the interpolated values.
+                            [default: None]
 
-        :returns:           A new list of stars without outliers
+        :returns: stars, nremoved   A new list of stars without outliers, and how many outliers
+                                    were removed.
         """
-        # I started writing this class, but then realized this isn't what we want to do
-        # for the PixelGrid model.  So leave this for now...
-        raise NotImplemented("MAD algorithm not implemented")
+        nstars = len(stars)
+        if logger:
+            logger.debug("Checking %d stars for outliers", nstars)
+        if nstars == 0:
+            return stars, 0
+
+        params = np.array([ s.fit.params for s in stars ], dtype=float)
+        if interp is not None:
+            interp_stars = interp.interpolateList(stars)
+            resid = params - np.array([ s.fit.params for s in interp_stars ], dtype=float)
+        else:
+            resid = params
+
+        median, mad = self._median_mad(resid)
+        if logger:
+            logger.debug("median = %s",median)
+            logger.debug("mad = %s",mad)
+
+        # Parameters with mad == 0 can't have any outliers.  Just ignore them.
+        use = mad > 0
+        dev = np.zeros(nstars, dtype=float)
+        if np.any(use):
+            dev = np.max(np.abs(resid[:,use] - median[use]) / mad[use], axis=1)
+        self.last_dev = dev
+
+        bad = dev > self.nmad
+        nremoved = np.count_nonzero(bad)
+        if logger:
+            logger.info("Found %d stars with a parameter more than %.2f MAD from the median",
+                        nremoved, self.nmad)
+            logger.debug("dev = %s",dev[bad])
+
+        if nremoved == 0:
+            return stars, 0
+
+        if self.max_remove is not None and nremoved > self.max_remove:
+            # Remove the ones with the largest deviations.
+            nremoved = self.max_remove
+            bad = np.zeros(nstars, dtype=bool)
+            if nremoved > 0:
+                bad[np.argpartition(dev, -nremoved)[-nremoved:]] = True
+
+        good_stars = [ stars[i] for i in np.flatnonzero(~bad) ]
+
+        assert nremoved == len(stars) - len(good_stars)
+        return good_stars, nremoved
 
 
 class ChisqOutliers(Outliers):
@@ -233,6 +332,7 @@ class ChisqOutliers(Outliers):
         self.ndof = ndof
         self.prob = prob
         self.max_remove = max_remove
+        self._thresh_memo = {}
 
         self.kwargs = {
             'thresh' : thresh,
@@ -247,11 +347,42 @@ class ChisqOutliers(Outliers):
         elif self.ndof is not None:
             return self.ndof * dof
         else:
+            from scipy.stats import chi2
             return chi2.isf(self.prob, dof)
-        
+
+    def getThresholds(self, dof):
+        """Get the chisq threshold to use for each of an array of dof values.
+
+        The thresholds are only calculated once for each unique value of dof.  When using
+        prob or nsigma, this avoids repeated calls to ``chi2.isf``, which can be slow when
+        there are many stars.  The values are also memoized between calls, since the dof
+        rarely changes between iterations.
+
+        :param dof:         An array of the degrees of freedom for each star.
+
+        :returns: an array of the threshold values with the same shape as dof.
+        """
+        dof = np.asarray(dof)
+        if self.thresh is not None:
+            return np.full(dof.shape, self.thresh, dtype=float)
+        elif self.ndof is not None:
+            return self.ndof * dof.astype(float)
+        else:
+            unique_dof, index = np.unique(dof, return_inverse=True)
+            missing = [ d for d in unique_dof if d not in self._thresh_memo ]
+            if len(missing) > 0:
+                from scipy.stats import chi2
+                self._thresh_memo.update(zip(missing, chi2.isf(self.prob, missing)))
+            unique_thresh = np.array([ self._thresh_memo[d] for d in unique_dof ], dtype=float)
+            return unique_thresh[index].reshape(dof.shape)
+
     def removeOutliers(self, stars, logger=None):
         """Remove outliers from a list of stars based on their chisq values.
 
+        After this call, the chisq, dof and threshold values used for each of the input stars
+        are available as the attributes ``last_chisq``, ``last_dof``, and ``last_thresh``
+        respectively.
+
         :param stars:       A list of Star instances
         :param logger:      A logger object for logging debug info. [default: None]
 
@@ -262,48 +393,53 @@ class ChisqOutliers(Outliers):
         if logger:
             logger.debug("Checking %d stars for outliers", nstars)
 
-        chisq = np.array([ s.fit.chisq for s in stars ])
+        chisq = np.fromiter((s.fit.chisq for s in stars), dtype=float, count=nstars)
         dof = np.array([ s.fit.dof for s in stars ])
+        thresh = self.getThresholds(dof)
+
+        self.last_chisq = chisq
+        self.last_dof = dof
+        self.last_thresh = thresh
 
-        thresh = np.array([ self._get_thresh(d) for d in dof ])
+        if nstars == 0:
+            return stars, 0
 
         if logger:
             if np.all(dof == dof[0]):
                 logger.debug("dof = %f, thresh = %f",dof[0],thresh[0])
             else:
-                min_dof = np.min(dof)
-                max_dof = np.max(dof)
-                logger.debug("Minimum dof = %d with thresh = %f",min_dof,self._get_thresh(min_dof))
-                logger.debug("Maximum dof = %d with thresh = %f",max_dof,self._get_thresh(max_dof))
+                imin = np.argmin(dof)
+                imax = np.argmax(dof)
+                logger.debug("Minimum dof = %d with thresh = %f",dof[imin],thresh[imin])
+                logger.debug("Maximum dof = %d with thresh = %f",dof[imax],thresh[imax])
 
-        nremoved = np.sum(chisq > thresh)
+        diff = chisq - thresh
+        bad = diff > 0
+        nremoved = np.count_nonzero(bad)
 
         if logger:
             logger.info("Found %d stars with chisq > thresh", nremoved)
-            logger.debug("chisq = %s",chisq[chisq > thresh])
-            logger.debug("thresh = %s",thresh[chisq > thresh])
+            logger.debug("chisq = %s",chisq[bad])
+            logger.debug("thresh = %s",thresh[bad])
 
         if nremoved == 0:
-            good_stars = stars
-        elif self.max_remove is None or nremoved <= self.max_remove:
-            good = chisq <= thresh
-            good_stars = [ s for g, s in zip(good, stars) if g ]
-        else:
+            return stars, 0
+
+        if self.max_remove is not None and nremoved > self.max_remove:
             # Since the thresholds are not necessarily all equal, this might be tricky to
             # figure out which ones should be removed.
-            # e.g. if max_remove == 1 and we have items with 
+            # e.g. if max_remove == 1 and we have items with
             #    chisq = 20, thresh = 15
             #    chisq = 40, thresh = 32
             # which one should we remove?
             # The first has larger chisq/thresh, and the second has larger chisq - thresh.
             # I semi-arbitrarily remove based on the difference.
-            nremoved  = self.max_remove
-            diff = chisq - thresh
-            new_thresh_index = np.argpartition(diff, -nremoved)[-nremoved]
-            new_thresh = diff[new_thresh_index]
-            good = diff < new_thresh
-            good_stars = [ s for g, s in zip(good, stars) if g ]
+            nremoved = self.max_remove
+            bad = np.zeros(nstars, dtype=bool)
+            if nremoved > 0:
+                bad[np.argpartition(diff, -nremoved)[-nremoved:]] = True
+
+        good_stars = [ stars[i] for i in np.flatnonzero(~bad) ]
 
         assert nremoved == len(stars) - len(good_stars)
         return good_stars, nremoved
-
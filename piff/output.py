@@ -19,7 +19,7 @@
 from __future__ import print_function
 
 import os
-from .util import ensure_dir
+from .util import ensure_dir, Timings
 
 class Output(object):
     """The base class for handling the output for writing a Piff model.
@@ -68,11 +68,13 @@ class Output(object):
         kwargs = config_output.copy()
         return kwargs
 
-    def write(self, psf, logger=None):
+    def write(self, psf, logger=None, timings=None):
         """Write a PSF object to the output file.
 
         :param psf:         A piff.PSF instance
         :param logger:      A logger object for logging debug info. [default: None]
+        :param timings:     Optionally, a Timings instance in which to record the time spent
+                            in each stage of the output. [default: None]
         """
         raise NotImplemented("Derived classes must define the write function")
 
@@ -91,7 +93,7 @@ class Output(object):
 #       keeping the code for writing and reading PSF objects to a file in the PSF class,
 #       so this class is really bare-bones, just farming out the work to PSF.
 class OutputFile(Output):
-    """An Output handler that just writes to a FITS file.
+    """An Output handler that just writes to a FITS file (or optionally an npz file).
 
     This is the only Output handler we have, so it doesn't need to be specified by name
     with a ``type`` field.
@@ -99,16 +101,31 @@ class OutputFile(Output):
     It includes specification of both the output file name as well as potentially some
     statistics to output as well.
     """
-    def __init__(self, file_name, dir=None, stats_list=None, logger=None):
+    def __init__(self, file_name, dir=None, stats_list=None, nproc=1, use_threads=False,
+                 format=None, timing_file=None, logger=None):
         """
         :param file_name:   The file name to write the data to.
         :param dir:         Optionally specify a directory for this file. [default: None]
         :param stats_list:  Optionally a list of Stats instances to also output. [default: None]
+        :param nproc:       How many processes to use for measuring the shapes for the stats.
+                            nproc <= 0 means use the number of cpus. [default: 1]
+        :param use_threads: Whether to use threads rather than processes for the shape
+                            measurements when nproc != 1. [default: False]
+        :param format:      The file format to use, either 'fits' or 'npz'.  [default: None,
+                            which means use 'npz' if the file name ends in .npz and 'fits'
+                            otherwise]
+        :param timing_file: Optionally, a file name to which to write a JSON report of the time
+                            and peak memory used by each stage of building the PSF.
+                            [default: None]
         :param logger:      A logger object for logging debug info. [default: None]
         """
         # TODO: could probably also add an option to output one or more catalogs with information
         #       about the star lists, measured size/shape, etc.
         self.file_name = file_name
+        self.format = format
+        self.nproc = nproc
+        self.use_threads = use_threads
+        self.timing_file = timing_file
         if stats_list is not None:
             self.stats_list = stats_list
         else:
@@ -118,8 +135,12 @@ class OutputFile(Output):
         # Apply the directory name to all file names.
         if dir is not None:
             self.file_name = os.path.join(dir, self.file_name)
+            if self.timing_file is not None:
+                self.timing_file = os.path.join(dir, self.timing_file)
             for stats in self.stats_list:
                 stats.file_name = os.path.join(dir, stats.file_name)
+                if getattr(stats, 'corr_file_name', None) is not None:
+                    stats.corr_file_name = os.path.join(dir, stats.corr_file_name)
 
     @classmethod
     def parseKwargs(cls, config_output, logger=None):
@@ -138,22 +159,45 @@ class OutputFile(Output):
             kwargs['stats_list'] = stats
         return kwargs
 
-    def write(self, psf, logger=None):
+    def write(self, psf, logger=None, timings=None):
         """Write a PSF object to the output file.
 
+        If timing_file was given, a report of the timings is also written out at the end.
+
         :param psf:         A piff.PSF instance
         :param logger:      A logger object for logging debug info. [default: None]
+        :param timings:     Optionally, a Timings instance in which to record the time spent
+                            in each stage of the output. [default: None, which means use
+                            psf.timings if present, else start a new one]
         """
+        if timings is None:
+            timings = getattr(psf, 'timings', None)
+        if timings is None:
+            timings = Timings()
+
         if logger:
             logger.warning("Writing PSF to %s", self.file_name)
         ensure_dir(self.file_name)
-        psf.write(self.file_name, logger=logger)
+        with timings('write'):
+            psf.write(self.file_name, logger=logger, format=self.format)
 
         if logger:
             logger.debug("stats_list = %s",self.stats_list)
-        for stats in self.stats_list:
-            stats.compute(psf,psf.stars,logger=logger)
-            stats.write(logger=logger)
+        if len(self.stats_list) > 0:
+            # The shape measurements are the same for all the stats, so only do them once.
+            import piff
+            if logger:
+                logger.info("Measuring shapes of %d stars for stats",len(psf.stars))
+            with timings('measureShapes'):
+                shapes = piff.Stats.measureShapes(psf, psf.stars, logger=logger,
+                                                  nproc=self.nproc, use_threads=self.use_threads)
+            for stats in self.stats_list:
+                with timings('stats'):
+                    stats.compute(psf,psf.stars,logger=logger,shapes=shapes)
+                    stats.write(logger=logger)
+
+        if self.timing_file is not None:
+            timings.write(self.timing_file, logger=logger)
 
     def read(self, logger=None):
         """Read a PSF object that was written to an output file back in.
@@ -165,6 +209,6 @@ class OutputFile(Output):
         import piff
         if logger:
             logger.info("Reading PSF from %s", self.file_name)
-        piff.PSF.read(self.file_name)
+        return piff.PSF.read(self.file_name, logger=logger, format=self.format)
 
 
@@ -18,6 +18,7 @@
 
 from __future__ import print_function
 import numpy as np
+import logging
 
 from .model import Model
 from .star import Star, StarFit
@@ -559,7 +560,10 @@ class PixelGrid(Model):
 
         :returns:           New Star instance, with updated flux, center, chisq, dof, worst
         """
-        if logger:
+        # This is called for every star in every iteration, so only build the debug output
+        # if it will actually be used.
+        debug = logger is not None and logger.isEnabledFor(logging.DEBUG)
+        if debug:
             logger.debug("Reflux for star:")
             logger.debug("    flux = %s",star.fit.flux)
             logger.debug("    center = %s",star.fit.center)
@@ -579,7 +583,7 @@ class PixelGrid(Model):
         center = star.fit.center
         prev_chisq = 1.e500
         for iteration in range(max_iterations):
-            if logger:
+            if debug:
                 logger.debug("Start iteration %d",iteration)
             # Start by getting all interpolation coefficients for all observed points
             data, weight, u, v = star.data.getDataVector()
@@ -620,14 +624,14 @@ class PixelGrid(Model):
                 derivs = mod.reshape(mod.shape+(1,))
                 # derivs should end up with shape (npts, nconstraints)
             resid = data - mod*flux
-            if logger:
+            if debug:
                 logger.debug("total pixels = %s, nopsf = %s",len(pvals),np.sum(nopsf))
 
             # Now begin construction of alpha/beta/chisq that give
             # chisq vs linearized model.
             rw = resid * weight
             chisq = np.sum(resid * rw)
-            if logger:
+            if debug:
                 logger.debug("initial chisq = %s",chisq)
             beta = np.dot( derivs.T,rw)
             alpha = np.dot( derivs.T*weight, derivs)
@@ -635,7 +639,7 @@ class PixelGrid(Model):
                 df = np.linalg.solve(alpha, beta)
             except Exception as e:
                 if do_center:
-                    if logger:
+                    if debug:
                         logger.debug("Caught exception %s",e)
                         logger.debug("Turning off centering and retrying")
                     do_center = False
@@ -644,31 +648,31 @@ class PixelGrid(Model):
                     raise
             dchi = np.dot(beta, df)
             chisq = chisq - dchi
-            if logger:
+            if debug:
                 logger.debug("chisq -= %s => %s",dchi,chisq)
             # Record worst single pixel chisq:
             resid -= np.dot(derivs,df)
             rw = resid * weight
             worst_chisq = np.max(resid * rw)
-            if logger:
+            if debug:
                 logger.debug("worst_chisq = %s",worst_chisq)
 
             # update the flux (and center) of the star
-            if logger:
+            if debug:
                 logger.debug("initial flux = %s",flux)
             flux += df[0]
-            if logger:
+            if debug:
                 logger.debug("flux += %s => %s",df[0],flux)
             ###print(iteration,'chisq',chisq,flux,center,df) ###
-            if logger:
+            if debug:
                 logger.debug("center = %s",center)
             if do_center:
                 center = (center[0]+df[1],
                           center[1]+df[2])
-                if logger:
+                if debug:
                     logger.debug("center += (%s,%s) => %s",df[1],df[2],center)
             dof = np.count_nonzero(weight) - self._constraints
-            if logger:
+            if debug:
                 logger.debug("dchi, chisq_thresh, dof, do_center = %s, %s, %s, %s",
                              dchi,chisq_thresh,dof,do_center)
             if (dchi < chisq_thresh * dof) or not do_center:
@@ -688,7 +692,7 @@ class PixelGrid(Model):
                 assert do_center  # The logic of the above test means this should be True here.
                 do_center = False
                 center = (center[0]-df[1], center[1]-df[2])  # undo the last centroid update.
-                if logger:
+                if debug:
                     logger.debug("chisq increased in reflux.  Turning off centering.")
             prev_chisq = chisq
 
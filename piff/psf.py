@@ -19,7 +19,7 @@
 from __future__ import print_function
 
 import numpy as np
-import fitsio
+import logging
 
 from .star import Star, StarData
 from .util import write_kwargs, read_kwargs
@@ -62,9 +62,10 @@ class PSF(object):
         :returns: a PSF instance of the appropriate type.
         """
         import piff
-        import yaml
 
-        if logger:
+        if logger and logger.isEnabledFor(logging.DEBUG):
+            # Only run yaml.dump if the output will actually be used.
+            import yaml
             logger.debug("Parsing PSF based on config dict:")
             logger.debug(yaml.dump(config_psf, default_flow_style=False))
 
@@ -127,6 +128,8 @@ class PSF(object):
         sky coordinates rather than image coordinates, you can provide an image with just a
         pixel scale for the WCS.
 
+        If you are drawing the PSF many times at the same positions, see enableDrawCache.
+
         :param x:           The image x position.
         :param y:           The image y position.
         :param chipnum:     Which chip to use for WCS information. [default: 0, which is
@@ -142,15 +145,29 @@ class PSF(object):
 
         :returns:           A GalSim Image of the PSF
         """
-        import galsim
         properties = {'chipnum' : chipnum}
-        for key in self.extra_interp_properties:
-            if key not in kwargs:
-                raise TypeError("Extra interpolation property %r is required"%key)
-            properties = kwags.pop(key)
-        if len(kwargs) != 0:
-            raise TypeError("draw got an unexpecte keyword argument %r"%kwargs.keys()[0])
-
+        properties.update(self._getExtraProperties(kwargs, 'draw'))
+
+        # If the draw cache is enabled, we may be able to reuse an image we drew before.
+        draw_cache = getattr(self, '_draw_cache', None)
+        if draw_cache is not None and image is None:
+            key = self._drawCacheKey(x, y, offset, stamp_size, properties)
+            cached_image = draw_cache.get(key)
+            if cached_image is None:
+                cached_image = self._drawUncached(x, y, chipnum, 1.0, offset, stamp_size, None,
+                                                  properties, logger)
+                draw_cache.put(key, cached_image)
+            image = cached_image.copy()
+            if flux != 1.0:
+                image *= flux
+            return image
+
+        return self._drawUncached(x, y, chipnum, flux, offset, stamp_size, image,
+                                  properties, logger)
+
+    def _drawUncached(self, x, y, chipnum, flux, offset, stamp_size, image, properties, logger):
+        # The implementation of draw, not using the draw cache.
+        import galsim
         image_pos = galsim.PositionD(x,y)
         world_pos = StarData.calculateFieldPos(image_pos, self.wcs[chipnum], self.pointing,
                                                properties)
@@ -176,16 +193,224 @@ class PSF(object):
         star = self.drawStar(star)
         return star.data.image
 
-    def write(self, file_name, logger=None):
+    def buildGrid(self, nx=16, ny=16, per_chip=True, bounds=None, tol=None, ncheck=20,
+                  stamp_size=32, seed=None, logger=None):
+        """Precompute the PSF on a regular grid, to speed up drawing.
+
+        See SimplePSF.buildGrid for details.  Not all PSF classes implement this.
+        """
+        raise NotImplementedError("buildGrid is not implemented for %s"%self.__class__.__name__)
+
+    def removeGrid(self):
+        """Remove the grid built by buildGrid.
+        """
+        pass
+
+    def enableDrawCache(self, max_size=1000, tol=0.):
+        """Turn on a cache of the images drawn by the draw function.
+
+        This is useful when the PSF is drawn many times at the same or nearly the same
+        positions, e.g. for forced photometry of overlapping detections.  The images are
+        cached according to the chipnum, position, offset, stamp size and any extra
+        interpolation properties.  They are stored with unit flux, so calls with different
+        fluxes can share the same cached image.  A copy of the cached image is returned, so
+        it is safe to modify the result.
+
+        If tol > 0, positions are rounded to a multiple of tol pixels for the cache lookup,
+        so a draw at a position within about tol of a previous one will return the image that
+        was drawn at the previous position.  The default, tol=0, only reuses images drawn at
+        exactly the same position.
+
+        Images drawn into a user-provided image are not cached.
+
+        The number of hits and misses are available as psf.draw_cache_hits and
+        psf.draw_cache_misses.
+
+        :param max_size:    The maximum number of images to keep in the cache.  When it is
+                            full, the least recently used image is removed. [default: 1000]
+        :param tol:         The tolerance in pixels for matching positions. [default: 0]
+        """
+        from .util import LRUCache
+        self._draw_cache = LRUCache(max_size)
+        self._draw_cache_tol = tol
+
+    def disableDrawCache(self):
+        """Turn off the cache of drawn images, and release the memory it used.
+        """
+        self._draw_cache = None
+
+    def clearDrawCache(self):
+        """Remove all the images from the draw cache, if it is enabled.
+
+        This should be done if the PSF solution changes.  The fit functions do so
+        automatically.
+        """
+        if getattr(self, '_draw_cache', None) is not None:
+            self._draw_cache.clear()
+
+    @property
+    def draw_cache_hits(self):
+        """The number of calls to draw that used a cached image.
+        """
+        draw_cache = getattr(self, '_draw_cache', None)
+        return draw_cache.hits if draw_cache is not None else 0
+
+    @property
+    def draw_cache_misses(self):
+        """The number of calls to draw that were not found in the cache.
+        """
+        draw_cache = getattr(self, '_draw_cache', None)
+        return draw_cache.misses if draw_cache is not None else 0
+
+    def _drawCacheKey(self, x, y, offset, stamp_size, properties):
+        # The key to use for the draw cache.
+        tol = self._draw_cache_tol
+        if tol > 0:
+            x = int(np.floor(x/tol + 0.5))
+            y = int(np.floor(y/tol + 0.5))
+        else:
+            x = float(x)
+            y = float(y)
+        return (x, y, tuple(offset), stamp_size, tuple(sorted(properties.items())))
+
+    def drawMany(self, x, y, chipnum=0, flux=1.0, offset=(0,0), stamp_size=48, out=None,
+                 logger=None, **kwargs):
+        """Draws images of the PSF at many locations.
+
+        This is equivalent to calling draw for each position, but the interpolation is done
+        for all the positions at once using interp.interpolateList, and the images are written
+        into a single 3d numpy array rather than returned as separate GalSim images:
+
+            >>> stamps = psf.drawMany(x=x_array, y=y_array, chipnum=4, stamp_size=32)
+            >>> stamps.shape
+            (len(x_array), 32, 32)
+
+        Each image uses the local Jacobian of the WCS at its position, as in draw.
+
+        Any of chipnum, flux, offset, and the extra interpolation properties may be given
+        either as a single value to use for all the positions or as an array with one value
+        per position.
+
+        :param x:           An array of image x positions.
+        :param y:           An array of image y positions.
+        :param chipnum:     Which chip(s) to use for WCS information. [default: 0, which is
+                            appropriate if only using a single chip]
+        :param flux:        Flux of PSF to be drawn [default: 1.0]
+        :param offset:      (dx,dy) tuple giving offset of stellar center relative
+                            to star.data.image_pos, or an array of these with shape (n,2).
+                            [default: (0,0)]
+        :param stamp_size:  The size of the images to construct if out is not provided.
+                            [default: 48]
+        :param out:         An existing numpy array of shape (n, ny, nx) into which to draw
+                            the images, if desired. [default: None]
+        :param logger:      A logger object for logging debug info. [default: None]
+        :param **kwargs:    Additional properties required for the interpolation.
+
+        :returns:           A numpy array of shape (n, ny, nx) with the images of the PSF
+        """
+        import galsim
+        x = np.atleast_1d(np.asarray(x, dtype=float))
+        y = np.atleast_1d(np.asarray(y, dtype=float))
+        n = len(x)
+        if x.shape != (n,) or y.shape != (n,):
+            raise ValueError("x and y must be 1d arrays of the same length")
+        # Use tolist to get python types, rather than numpy scalars.
+        chipnums = np.broadcast_to(np.asarray(chipnum), (n,)).tolist()
+        flux = np.broadcast_to(np.asarray(flux, dtype=float), (n,))
+        offset = np.broadcast_to(np.asarray(offset, dtype=float), (n,2))
+        extra_props = self._getExtraProperties(kwargs, 'drawMany')
+        for key in extra_props:
+            extra_props[key] = np.broadcast_to(np.asarray(extra_props[key]), (n,)).tolist()
+
+        if out is None:
+            out = np.empty((n, stamp_size, stamp_size), dtype=float)
+        elif out.ndim != 3 or out.shape[0] != n:
+            raise ValueError("out must have shape (%d, ny, nx)"%n)
+        ny, nx = out.shape[1:]
+
+        if logger:
+            logger.debug("Drawing %d stars", n)
+
+        # Convert the positions to field coordinates all at once for each chip.
+        u = np.empty(n)
+        v = np.empty(n)
+        ra = dec = None
+        chipnum_array = np.array(chipnums)
+        for c in set(chipnums):
+            use = chipnum_array == c
+            u[use], v[use], ra_c, dec_c = StarData.calculateFieldPosArray(
+                    x[use], y[use], self.wcs[c], self.pointing)
+            if ra_c is not None:
+                if ra is None:
+                    ra = np.empty(n)
+                    dec = np.empty(n)
+                ra[use] = ra_c
+                dec[use] = dec_c
+
+        stars = []
+        for i in range(n):
+            properties = { 'chipnum' : chipnums[i] }
+            for key in extra_props:
+                properties[key] = extra_props[key][i]
+            if ra is not None:
+                properties.setdefault('ra', ra[i])
+                properties.setdefault('dec', dec[i])
+            image = galsim.Image(nx, ny, dtype=float)
+            star = Star.makeTarget(x=x[i], y=y[i], u=u[i], v=v[i], wcs=self.wcs[chipnums[i]],
+                                   properties=properties, image=image)
+            center = star.offset_to_center(offset[i])
+            stars.append(star.withFlux(flux[i], center))
+
+        stars = self.drawStarList(stars, logger=logger)
+        for i, star in enumerate(stars):
+            out[i] = star.data.image.array
+        return out
+
+    def _getExtraProperties(self, kwargs, func_name):
+        # Pull the extra interpolation properties out of the kwargs of draw or drawMany.
+        properties = {}
+        for key in self.extra_interp_properties:
+            if key not in kwargs:
+                raise TypeError("Extra interpolation property %r is required"%key)
+            properties[key] = kwargs.pop(key)
+        if len(kwargs) != 0:
+            raise TypeError("%s got an unexpected keyword argument %r"%(func_name,
+                                                                         list(kwargs)[0]))
+        return properties
+
+    def drawStarList(self, stars, logger=None):
+        """Generate PSF images for a list of stars.
+
+        The base class just calls drawStar for each star, but derived classes may override
+        this to do the interpolation for all the stars at once.
+
+        :param stars:       A list of Star instances holding information needed for
+                            interpolation as well as an image/WCS into which PSF will be
+                            rendered.
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        :returns:           A list of Star instances with their images filled with the
+                            rendered PSF
+        """
+        return [ self.drawStar(star) for star in stars ]
+
+    def write(self, file_name, logger=None, format=None):
         """Write a PSF object to a file.
 
+        The default format is FITS.  The alternative 'npz' format stores the same information
+        in a numpy .npz file, which is much faster to read back in.  See
+        :class:`piff.NpzFile` for details.
+
         :param file_name:   The name of the file to write to.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param format:      The file format to use, either 'fits' or 'npz'.
+                            [default: None, which means use 'npz' if the file name ends in
+                            .npz and 'fits' otherwise]
         """
         if logger:
             logger.warning("Writing PSF to file %s",file_name)
 
-        with fitsio.FITS(file_name,'rw',clobber=True) as f:
+        with _open_file(file_name, 'rw', format) as f:
             self._write(f, 'psf', logger)
 
     def _write(self, fits, extname, logger=None):
@@ -209,30 +434,37 @@ class PSF(object):
         self._finish_write(fits, extname=extname, logger=logger)
 
     @classmethod
-    def read(cls, file_name, logger=None):
+    def read(cls, file_name, logger=None, format=None, chips=None):
         """Read a PSF object from a file.
 
         :param file_name:   The name of the file to read.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param format:      The file format, either 'fits' or 'npz'. [default: None, which
+                            means use 'npz' if the file name ends in .npz and 'fits' otherwise]
+        :param chips:       For PSF classes with a separate solution for each chip (e.g.
+                            SingleChipPSF), optionally a list of the chips to read.
+                            [default: None, which means all chips are available, but each
+                            one is only read from the file when it is first used]
 
         :returns: a PSF instance
         """
         if logger:
             logger.warning("Reading PSF from file %s",file_name)
 
-        with fitsio.FITS(file_name,'r') as f:
+        with _open_file(file_name, 'r', format) as f:
             if logger:
-                logger.debug('opened FITS file')
-            return cls._read(f, 'psf', logger)
+                logger.debug('opened %s file', f.__class__.__name__)
+            return cls._read(f, 'psf', logger, file_name=file_name, format=format, chips=chips)
 
     @classmethod
-    def _read(cls, fits, extname, logger):
+    def _read(cls, fits, extname, logger, **kwargs):
         """This is the function that actually does the work for the read function.
         Composite PSF classes that need to iterate can call this multiple times as needed.
 
         :param fits:        An open fitsio.FITS object
         :param extname:     The name of the extension with the psf information.
         :param logger:      A logger object for logging debug info.
+        :param **kwargs:    Any other kwargs are passed on to _finish_read.
         """
         import piff
 
@@ -269,11 +501,11 @@ class PSF(object):
         psf.pointing = pointing
 
         # Just in case the class needs to do something else at the end.
-        psf._finish_read(fits, extname, logger)
+        psf._finish_read(fits, extname, logger, **kwargs)
 
         return psf
 
-    def _finish_read(self, fits, extname):
+    def _finish_read(self, fits, extname, logger=None, **kwargs):
         """Finish up the read process
 
         In the base class, this is a no op, but for classes that need to do something else at
@@ -284,6 +516,8 @@ class PSF(object):
 
         :param fits:        An open fitsio.FITS object
         :param extname:     The name of the extension with the psf information.
+        :param logger:      A logger object for logging debug info. [default: None]
+        :param **kwargs:    Other options given to read, which most classes ignore.
         """
         pass
 
@@ -291,15 +525,15 @@ class PSF(object):
     def writeWCS(self, fits, extname):
         """Write the WCS information to a FITS file.
 
+        Uniform WCS types (e.g. PixelScale, JacobianWCS, AffineTransform) are written as
+        explicit coefficients, and GSFitsWCS is written as the FITS header keywords that
+        define it.  Any other WCS type is pickled.  These are marked in the wcs_type column
+        as 'jacobian', 'affine', 'header', or 'pickle' respectively.
+
         :param fits:        An open fitsio.FITS object
         :param extname:     The name of the extension to write to
         """
         import galsim
-        import base64
-        try:
-            import cPickle as pickle
-        except:
-            import pickle
 
         # Start with the chipnums, which may be int or str type.
         # Assume they are all the same type at least.
@@ -313,10 +547,15 @@ class PSF(object):
             max_len = np.max([ len(c) for c in chipnums ])
             dtypes = [ ('chipnums', bytes, max_len) ]
 
-        # GalSim WCS objects can be serialized via pickle
-        wcs_str = [ base64.b64encode(pickle.dumps(w)) for w in self.wcs.values() ]
-        cols.append(wcs_str)
-        max_len = np.max([ len(s) for s in wcs_str ])
+        rows = [ _serialize_wcs(w) for w in self.wcs.values() ]
+        wcs_type = [ r[0] for r in rows ]
+        wcs_params = [ r[1] for r in rows ]
+        wcs_str = [ r[2] for r in rows ]
+        cols.extend( (wcs_type, wcs_params, wcs_str) )
+        max_len = np.max([ len(t) for t in wcs_type ])
+        dtypes.append( ('wcs_type', bytes, max_len) )
+        dtypes.append( ('wcs_params', float, 8) )
+        max_len = max(1, np.max([ len(s) for s in wcs_str ]))
         dtypes.append( ('wcs_str', bytes, max_len) )
 
         if self.pointing is not None:
@@ -341,25 +580,29 @@ class PSF(object):
                                       pointing is a galsim.CelestialCoord instance
         """
         import galsim
-        import base64
-        try:
-            import cPickle as pickle
-        except:
-            import pickle
 
         assert extname in fits
-        assert 'chipnums' in fits[extname].get_colnames()
-        assert 'wcs_str' in fits[extname].get_colnames()
+        colnames = fits[extname].get_colnames()
+        assert 'chipnums' in colnames
+        assert 'wcs_str' in colnames
 
         data = fits[extname].read()
 
         chipnums = data['chipnums']
         wcs_str = data['wcs_str']
 
-        wcs_list = [ pickle.loads(base64.b64decode(s)) for s in wcs_str ]
+        if 'wcs_type' in colnames:
+            wcs_type = [ str(t.decode()) for t in data['wcs_type'] ]
+            wcs_params = data['wcs_params']
+        else:
+            # Older files pickled all the WCS objects.
+            wcs_type = [ 'pickle' ] * len(data)
+            wcs_params = [ None ] * len(data)
+
+        wcs_list = [ _deserialize_wcs(t, p, s) for t, p, s in zip(wcs_type, wcs_params, wcs_str) ]
         wcs = dict(zip(chipnums, wcs_list))
 
-        if 'ra' in fits[extname].get_colnames():
+        if 'ra' in colnames:
             ra = data['ra']
             dec = data['dec']
             pointing = galsim.CelestialCoord(ra[0] * galsim.hours, dec[0] * galsim.degrees)
@@ -368,14 +611,119 @@ class PSF(object):
 
         return wcs, pointing
 
+def _serialize_wcs(wcs):
+    # Returns (wcs_type, params, wcs_str) for a single WCS.
+    import galsim
+    import json
+    params = np.zeros(8)
+    # Each of the uniform WCS types is stored with its own parameters, so the same type
+    # comes back when it is read.
+    if type(wcs) is galsim.PixelScale:
+        params[0] = wcs.scale
+        return b'pixelscale', params, b''
+    elif type(wcs) is galsim.OffsetWCS:
+        params[:5] = (wcs.scale, wcs.origin.x, wcs.origin.y,
+                      wcs.world_origin.x, wcs.world_origin.y)
+        return b'offset', params, b''
+    elif type(wcs) is galsim.ShearWCS:
+        params[:3] = wcs.scale, wcs.shear.g1, wcs.shear.g2
+        return b'shear', params, b''
+    elif type(wcs) is galsim.OffsetShearWCS:
+        params[:7] = (wcs.scale, wcs.shear.g1, wcs.shear.g2, wcs.origin.x, wcs.origin.y,
+                      wcs.world_origin.x, wcs.world_origin.y)
+        return b'offsetshear', params, b''
+    elif type(wcs) is galsim.JacobianWCS:
+        params[:4] = wcs.dudx, wcs.dudy, wcs.dvdx, wcs.dvdy
+        return b'jacobian', params, b''
+    elif type(wcs) is galsim.AffineTransform:
+        params[:] = (wcs.dudx, wcs.dudy, wcs.dvdx, wcs.dvdy, wcs.origin.x, wcs.origin.y,
+                     wcs.world_origin.x, wcs.world_origin.y)
+        return b'affine', params, b''
+    elif type(wcs) is galsim.GSFitsWCS:
+        # Only use the header if it gives back exactly the same WCS.  Otherwise pickle it.
+        try:
+            header = galsim.FitsHeader()
+            wcs.writeToFitsHeader(header, galsim.BoundsI(1,1,1,1))
+            header_str = json.dumps(dict(header.items()))
+            if _deserialize_wcs('header', params, header_str) == wcs:
+                return b'header', params, header_str.encode()
+        except Exception:
+            pass
+    return b'pickle', params, _pickle_wcs(wcs)
+
+def _deserialize_wcs(wcs_type, params, wcs_str):
+    # The inverse of _serialize_wcs.
+    import galsim
+    import json
+    if wcs_type == 'pixelscale':
+        return galsim.PixelScale(params[0])
+    elif wcs_type == 'offset':
+        return galsim.OffsetWCS(params[0], origin=galsim.PositionD(params[1], params[2]),
+                                world_origin=galsim.PositionD(params[3], params[4]))
+    elif wcs_type == 'shear':
+        return galsim.ShearWCS(params[0], galsim.Shear(g1=params[1], g2=params[2]))
+    elif wcs_type == 'offsetshear':
+        return galsim.OffsetShearWCS(params[0], galsim.Shear(g1=params[1], g2=params[2]),
+                                     origin=galsim.PositionD(params[3], params[4]),
+                                     world_origin=galsim.PositionD(params[5], params[6]))
+    elif wcs_type == 'jacobian':
+        return galsim.JacobianWCS(*params[:4])
+    elif wcs_type == 'affine':
+        return galsim.AffineTransform(params[0], params[1], params[2], params[3],
+                                      origin=galsim.PositionD(params[4], params[5]),
+                                      world_origin=galsim.PositionD(params[6], params[7]))
+    elif wcs_type == 'header':
+        if isinstance(wcs_str, bytes):
+            wcs_str = wcs_str.decode()
+        header = galsim.FitsHeader(header=json.loads(wcs_str))
+        return galsim.GSFitsWCS(header=header)
+    elif wcs_type == 'pickle':
+        return _unpickle_wcs(wcs_str)
+    else:
+        raise ValueError("Invalid wcs_type %s"%wcs_type)
+
+def _pickle_wcs(wcs):
+    import base64
+    try:
+        import cPickle as pickle
+    except:
+        import pickle
+    return base64.b64encode(pickle.dumps(wcs))
+
+def _unpickle_wcs(wcs_str):
+    import base64
+    try:
+        import cPickle as pickle
+    except:
+        import pickle
+    return pickle.loads(base64.b64decode(wcs_str))
+
 # Make a global function, piff.read, as an alias for piff.PSF.read, since that's the main thing
 # users will want to do as their starting point for using a piff file.
-def read(file_name, logger=None):
+def read(file_name, logger=None, format=None, chips=None):
     """Read a Piff PSF object from a file.
 
     :param file_name:   The name of the file to read.
     :param logger:      A logger object for logging debug info. [default: None]
+    :param format:      The file format, either 'fits' or 'npz'. [default: None, which
+                        means use 'npz' if the file name ends in .npz and 'fits' otherwise]
+    :param chips:       For PSF classes with a separate solution for each chip, optionally
+                        a list of the chips to read. [default: None, which means all chips
+                        are available, but each is only read when it is first used]
 
     :returns: a piff.PSF instance
     """
-    return PSF.read(file_name, logger=logger)
+    return PSF.read(file_name, logger=logger, format=format, chips=chips)
+
+def _open_file(file_name, mode, format=None):
+    # Open a file for writing (mode='rw') or reading (mode='r') in the given format.
+    from .npz_file import NpzFile, is_npz_file
+    if format is None:
+        format = 'npz' if is_npz_file(file_name) else 'fits'
+    if format == 'fits':
+        import fitsio
+        return fitsio.FITS(file_name, mode, clobber=(mode == 'rw'))
+    elif format == 'npz':
+        return NpzFile(file_name, mode)
+    else:
+        raise ValueError("Invalid format %s.  Must be one of 'fits', 'npz'"%format)
@@ -24,6 +24,8 @@ from .model import Model, ModelFitError
 from .interp import Interp
 from .outliers import Outliers
 from .psf import PSF
+from .star import Star, StarFit, StarData, StarList
+from .util import Timings
 
 class SimplePSF(PSF):
     """A PSF class that uses a single model and interpolator.
@@ -92,7 +94,7 @@ class SimplePSF(PSF):
         return kwargs
 
     def fit(self, stars, wcs, pointing,
-            chisq_threshold=0.1, max_iterations=30, logger=None):
+            chisq_threshold=0.1, max_iterations=30, logger=None, timings=None):
         """Fit interpolated PSF model to star data using standard sequence of operations.
 
         :param stars:           A list of Star instances.
@@ -103,20 +105,41 @@ class SimplePSF(PSF):
                                 [default: 0.1]
         :param max_iterations:  Maximum number of iterations to try. [default: 30]
         :param logger:          A logger object for logging debug info. [default: None]
+        :param timings:         Optionally, a Timings instance in which to accumulate the time
+                                spent in each stage of the fit.  [default: None, which means
+                                start a new one]  Either way, it is available afterwards as
+                                self.timings.
         """
         # TODO: Make chisq_thresh and max_iterations configurable paramters and move them
         #       to the initialization.
+        # Outliers handlers that look at the fitted parameters (rather than the chisq of the
+        # refluxed stars) need individual fits.  With a degenerate interpolator, the stars'
+        # parameters are all replaced by the interpolated values, so they would never find
+        # anything.
+        if getattr(self.outliers, 'uses_params', False) and self.interp.degenerate_points:
+            raise ValueError("%s cannot be used with %s, since it doesn't fit the stars "
+                             "individually."%(self.outliers.__class__.__name__,
+                                              self.interp.__class__.__name__))
+
         self.stars = stars
         self.wcs = wcs
         self.pointing = pointing
+        self.clearDrawCache()
+        self._grids = None
+        if timings is None:
+            timings = Timings()
+        self.timings = timings
 
         if logger:
             logger.debug("Initializing models")
-        self.stars = [self.model.initialize(s, mask=True, logger=logger) for s in self.stars]
+        with timings('initialize'):
+            self.stars = [self.model.initialize(s, mask=True, logger=logger)
+                          for s in self.stars]
 
         if logger:
             logger.debug("Initializing interpolator")
-        self.stars = self.interp.initialize(self.stars, logger=logger)
+        with timings('initialize'):
+            self.stars = self.interp.initialize(self.stars, logger=logger)
 
         # For basis models, we can compute a quadratic form for chisq, and if we are using
         # a basis interpolator, then we can use it.  It's kind of ugly to query this, but
@@ -124,6 +147,8 @@ class SimplePSF(PSF):
         # now we just check if we have all the required parts to use the quadratic form
         quadratic_chisq = hasattr(self.model, 'chisq') and self.interp.degenerate_points
 
+        param_outliers = getattr(self.outliers, 'uses_params', False)
+
         # Begin iterations.  Very simple convergence criterion right now.
         oldchisq = 0.
         for iteration in range(max_iterations):
@@ -134,21 +159,46 @@ class SimplePSF(PSF):
 
             nremoved = 0
             new_stars = []
-            for s in self.stars:
-                try:
-                    new_star = fit_fn(s, logger=logger)
-                except ModelFitError:
-                    if logger:
-                        logger.warn("Error trying to fit star at %s.  Excluding it.",
-                                    s.image_pos)
-                    nremoved += 1
+            with timings('fit'):
+                if not quadratic_chisq and hasattr(self.model, 'fitStarList'):
+                    # Some models can fit all the stars at once.  Failures are None.
+                    fitted = self.model.fitStarList(self.stars, logger=logger)
                 else:
-                    new_stars.append(new_star)
+                    fitted = []
+                    for s in self.stars:
+                        try:
+                            fitted.append(fit_fn(s, logger=logger))
+                        except ModelFitError:
+                            fitted.append(None)
+                for s, new_star in zip(self.stars, fitted):
+                    if new_star is None:
+                        if logger:
+                            logger.warn("Error trying to fit star at %s.  Excluding it.",
+                                        s.image_pos)
+                        nremoved += 1
+                    else:
+                        new_stars.append(new_star)
             self.stars = new_stars
 
             if logger:
                 logger.debug("             Calculating the interpolation")
-            self.interp.solve(self.stars, logger=logger)
+            with timings('solve'):
+                self.interp.solve(self.stars, logger=logger)
+
+            if param_outliers:
+                # Outliers based on the fitted parameters need to be found before reflux
+                # replaces them with the interpolated values.
+                if logger:
+                    logger.debug("             Looking for outliers")
+                with timings('outliers'):
+                    self.stars, nremoved1 = self.outliers.removeOutliers(
+                            self.stars, logger=logger, interp=self.interp)
+                if logger:
+                    if nremoved1 == 0:
+                        logger.debug("             No outliers found")
+                    else:
+                        logger.info("             Removed %d outliers", nremoved1)
+                nremoved += nremoved1
 
             # Refit and recenter all stars, collect stats
             if logger:
@@ -156,23 +206,28 @@ class SimplePSF(PSF):
 
             if hasattr(self.model, 'reflux'):
                 new_stars = []
-                for s in self.stars:
-                    try:
-                        new_star = self.model.reflux(self.interp.interpolate(s),logger=logger)
-                    except:
-                        if logger:
-                            logger.warn("Error trying to reflux star at %s.  Excluding it.",
-                                        s.image_pos)
-                        nremoved += 1
-                    else:
-                        new_stars.append(new_star)
+                with timings('reflux'):
+                    for s in self.stars:
+                        try:
+                            new_star = self.model.reflux(self.interp.interpolate(s),
+                                                         logger=logger)
+                        except:
+                            if logger:
+                                logger.warn("Error trying to reflux star at %s.  Excluding it.",
+                                            s.image_pos)
+                            nremoved += 1
+                        else:
+                            new_stars.append(new_star)
                 self.stars = new_stars
 
-            if self.outliers and (iteration > 0 or not self.interp.degenerate_points):
+            if (self.outliers and not param_outliers and
+                    (iteration > 0 or not self.interp.degenerate_points)):
                 # Perform outlier rejection, but not on first iteration for degenerate solvers.
                 if logger:
                     logger.debug("             Looking for outliers")
-                self.stars, nremoved1 = self.outliers.removeOutliers(self.stars, logger=logger)
+                with timings('outliers'):
+                    self.stars, nremoved1 = self.outliers.removeOutliers(self.stars,
+                                                                         logger=logger)
                 if logger:
                     if nremoved1 == 0:
                         logger.debug("             No outliers found")
@@ -192,7 +247,9 @@ class SimplePSF(PSF):
                 return
             oldchisq = chisq
 
-        logger.warning("PSF fit did not converge.  Max iterations = %d reached.",max_iterations)
+        if logger:
+            logger.warning("PSF fit did not converge.  Max iterations = %d reached.",
+                           max_iterations)
 
 
     def drawStar(self, star):
@@ -203,11 +260,202 @@ class SimplePSF(PSF):
 
         :returns:           Star instance with its image filled with rendered PSF
         """
+        if getattr(self, '_grids', None) is not None:
+            params = self._getGridParams([star])[0]
+            if params is not None:
+                return self.model.draw(_withParams(star, params))
         # Interpolate parameters to this position/properties:
         star = self.interp.interpolate(star)
         # Render the image
         return self.model.draw(star)
 
+    def drawStarList(self, stars, logger=None):
+        """Generate PSF images for a list of stars.
+
+        :param stars:       A list of Star instances holding information needed for
+                            interpolation as well as an image/WCS into which PSF will be
+                            rendered.
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        If the model has a drawStarList method, it is used to draw all the stars at once.
+        For some models, this may be an approximation to drawing each star with drawStar.
+        E.g. the batch_draw option of the Optical model is only accurate to about 1.e-4 of
+        the peak value.
+
+        :returns:           A list of Star instances with their images filled with the
+                            rendered PSF
+        """
+        if getattr(self, '_grids', None) is not None:
+            grid_params = self._getGridParams(stars)
+            # Any stars outside the grid use the regular interpolation.
+            exact = [ i for i, p in enumerate(grid_params) if p is None ]
+            stars = [ _withParams(s, p) if p is not None else s
+                      for s, p in zip(stars, grid_params) ]
+            if exact:
+                exact_stars = self.interp.interpolateList([ stars[i] for i in exact ],
+                                                          logger=logger)
+                for i, star in zip(exact, exact_stars):
+                    stars[i] = star
+        else:
+            # Interpolate all the stars at once, which is faster for most interpolators.
+            stars = self.interp.interpolateList(stars, logger=logger)
+        if hasattr(self.model, 'drawStarList'):
+            # Some models can draw many stars more efficiently than one at a time.
+            return self.model.drawStarList(stars, logger=logger)
+        return [ self.model.draw(star) for star in stars ]
+
+    def buildGrid(self, nx=16, ny=16, per_chip=True, bounds=None, tol=None, ncheck=20,
+                  stamp_size=32, seed=None, logger=None):
+        """Precompute the interpolated PSF parameters on a regular grid, to speed up drawing.
+
+        After this call, drawStar, draw, and drawMany use bilinear interpolation of the
+        parameters at the grid points rather than doing the full interpolation for each
+        position.  This is an approximation, but for smoothly varying PSFs it is usually a very
+        good one, and for interpolators like GPInterp or kNNInterp it is much faster.
+        Positions outside the grid still use the full interpolation.
+
+        If per_chip is True, there is a separate grid in image coordinates for each chip.
+        Otherwise, there is a single grid in field coordinates covering all the chips.
+
+        The accuracy of the approximation is checked by drawing images at ncheck random
+        positions in each grid both ways.  The maximum difference relative to the peak of the
+        exact image is saved as self.grid_error and returned.  If tol is given and this error
+        is larger than tol, the grid is removed and a RuntimeError is raised.
+
+        The grid is removed by removeGrid or by fitting the PSF again.
+
+        :param nx:          The number of grid points in the x (or u) direction. [default: 16]
+        :param ny:          The number of grid points in the y (or v) direction. [default: 16]
+        :param per_chip:    Whether to use a separate grid for each chip. [default: True]
+        :param bounds:      Optionally, the range to cover with the grid.  If per_chip is True,
+                            this should be a dict of galsim.BoundsD instances in image
+                            coordinates indexed by chipnum.  Otherwise, it should be a single
+                            galsim.BoundsD in field coordinates.  [default: None, which means
+                            use the range covered by the stars used to fit the PSF]
+        :param tol:         The maximum acceptable relative error in the check images.
+                            [default: None, which means don't fail]
+        :param ncheck:      The number of positions to check in each grid. [default: 20]
+        :param stamp_size:  The size of the check images. [default: 32]
+        :param seed:        A seed for the random check positions. [default: None]
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        :returns: the maximum relative error in the check images
+        """
+        import galsim
+        if len(self.extra_interp_properties) > 0:
+            raise ValueError("buildGrid cannot be used with extra interpolation properties")
+        if nx < 2 or ny < 2:
+            raise ValueError("nx and ny must both be at least 2")
+        self.removeGrid()
+
+        grids = {}
+        if per_chip:
+            if bounds is None:
+                chipnums = _starColumn(self.stars, 'chipnum')
+                xs = _starColumn(self.stars, 'x')
+                ys = _starColumn(self.stars, 'y')
+            for chipnum in self.wcs:
+                if bounds is not None:
+                    b = bounds[chipnum]
+                    xmin, xmax, ymin, ymax = b.xmin, b.xmax, b.ymin, b.ymax
+                else:
+                    use = chipnums == chipnum
+                    if not np.any(use):
+                        continue
+                    x = xs[use]
+                    y = ys[use]
+                    xmin, xmax, ymin, ymax = np.min(x), np.max(x), np.min(y), np.max(y)
+                xgrid, ygrid = _makeGrid(xmin, xmax, ymin, ymax, nx, ny)
+                targets = [ self._gridTarget(chipnum, x, y) for y in ygrid for x in xgrid ]
+                grids[chipnum] = self._interpolateGrid(('x','y'), xgrid, ygrid, targets, logger)
+        else:
+            if bounds is not None:
+                umin, umax, vmin, vmax = bounds.xmin, bounds.xmax, bounds.ymin, bounds.ymax
+            else:
+                u = _starColumn(self.stars, 'u')
+                v = _starColumn(self.stars, 'v')
+                umin, umax, vmin, vmax = np.min(u), np.max(u), np.min(v), np.max(v)
+            ugrid, vgrid = _makeGrid(umin, umax, vmin, vmax, nx, ny)
+            targets = [ Star.makeTarget(u=u, v=v, scale=1., stamp_size=1)
+                        for v in vgrid for u in ugrid ]
+            grids[None] = self._interpolateGrid(('u','v'), ugrid, vgrid, targets, logger)
+        if logger:
+            logger.info("Built %d PSF grid%s with %d x %d points", len(grids),
+                        "s" if len(grids) > 1 else "", nx, ny)
+
+        # Check the accuracy at some random positions.
+        rng = np.random.RandomState(seed)
+        check_stars = []
+        for key, grid in grids.items():
+            coords, xgrid, ygrid, params = grid
+            xs = rng.uniform(xgrid[0], xgrid[-1], ncheck)
+            ys = rng.uniform(ygrid[0], ygrid[-1], ncheck)
+            for x, y in zip(xs, ys):
+                if per_chip:
+                    check_stars.append(self._gridTarget(key, x, y, stamp_size))
+                else:
+                    jac = self.stars[0].data.image.wcs.jacobian(self.stars[0].image_pos)
+                    check_stars.append(Star.makeTarget(u=x, v=y, wcs=jac,
+                                                       stamp_size=stamp_size))
+        exact = [ self.model.draw(s).image.array
+                  for s in self.interp.interpolateList(check_stars, logger=logger) ]
+        self._grids = grids
+        self._grid_per_chip = per_chip
+        # Any images drawn before now were made without the grid.
+        self.clearDrawCache()
+        approx = [ s.image.array for s in self.drawStarList(check_stars, logger=logger) ]
+        errors = [ np.max(np.abs(a-e)) / np.max(np.abs(e)) for a, e in zip(approx, exact) ]
+        self.grid_error = np.max(errors) if len(errors) > 0 else 0.
+        if logger:
+            logger.info("Maximum relative error of the PSF grid = %s", self.grid_error)
+        if tol is not None and self.grid_error > tol:
+            self.removeGrid()
+            raise RuntimeError("The PSF grid error %s is larger than tol = %s.  Try using "
+                               "larger nx, ny."%(self.grid_error, tol))
+        return self.grid_error
+
+    def removeGrid(self):
+        """Remove the grid built by buildGrid, so drawing uses the full interpolation again.
+        """
+        if getattr(self, '_grids', None) is not None:
+            self.clearDrawCache()
+        self._grids = None
+
+    def _gridTarget(self, chipnum, x, y, stamp_size=1):
+        # Make a target star at the given image position on a chip.
+        import galsim
+        wcs = self.wcs[chipnum]
+        properties = { 'chipnum' : chipnum }
+        field_pos = StarData.calculateFieldPos(galsim.PositionD(x,y), wcs, self.pointing,
+                                               properties)
+        return Star.makeTarget(x=x, y=y, u=field_pos.x, v=field_pos.y, wcs=wcs,
+                               properties=properties, stamp_size=stamp_size)
+
+    def _interpolateGrid(self, coords, xgrid, ygrid, targets, logger):
+        # Interpolate the parameters at the grid points.
+        targets = self.interp.interpolateList(targets, logger=logger)
+        params = np.array([ s.fit.params for s in targets ])
+        return coords, xgrid, ygrid, params.reshape(len(ygrid), len(xgrid), -1)
+
+    def _getGridParams(self, stars):
+        # Get the bilinearly interpolated parameters from the grid for each star.
+        # The result is None for stars that are not covered by any grid.
+        groups = {}
+        for i, star in enumerate(stars):
+            key = star.data.properties.get('chipnum') if self._grid_per_chip else None
+            if key in self._grids:
+                groups.setdefault(key, []).append(i)
+        result = [None] * len(stars)
+        for key, indices in groups.items():
+            coords, xgrid, ygrid, params = self._grids[key]
+            x = np.array([ stars[i][coords[0]] for i in indices ])
+            y = np.array([ stars[i][coords[1]] for i in indices ])
+            p, inside = _bilinear(xgrid, ygrid, params, x, y)
+            for k, i in enumerate(indices):
+                if inside[k]:
+                    result[i] = p[k]
+        return result
+
     def _finish_write(self, fits, extname, logger):
         """Finish the writing process with any class-specific steps.
 
@@ -226,12 +474,13 @@ class SimplePSF(PSF):
             if logger:
                 logger.debug("Wrote the PSF outliers to extension %s",extname + '_outliers')
 
-    def _finish_read(self, fits, extname, logger):
+    def _finish_read(self, fits, extname, logger, **kwargs):
         """Finish the reading process with any class-specific steps.
 
         :param fits:        An open fitsio.FITS object
         :param extname:     The base name of the extension to write to.
         :param logger:      A logger object for logging debug info.
+        :param **kwargs:    Other options given to read, which are ignored here.
         """
         self.model = Model.read(fits, extname + '_model')
         self.interp = Interp.read(fits, extname + '_interp')
@@ -239,3 +488,45 @@ class SimplePSF(PSF):
             self.outliers = Outliers.read(fits, extname + '_outliers')
         else:
             self.outliers = None
+
+
+def _withParams(star, params):
+    # Make a new Star with the given parameters.
+    if star.fit is None:
+        fit = StarFit(params)
+    else:
+        fit = star.fit.newParams(params)
+    return Star(star.data, fit)
+
+def _starColumn(stars, key):
+    # Get an array of the values of a star property for all the stars.
+    # For a StarList, read it from the table, rather than building all the stars.
+    if isinstance(stars, StarList):
+        return np.asarray(stars.data[key])
+    else:
+        return np.array([ s[key] for s in stars ])
+
+def _makeGrid(xmin, xmax, ymin, ymax, nx, ny):
+    # Make the grid points in each direction.  Make sure the range isn't empty.
+    if xmax <= xmin:
+        xmin, xmax = xmin - 0.5, xmin + 0.5
+    if ymax <= ymin:
+        ymin, ymax = ymin - 0.5, ymin + 0.5
+    return np.linspace(xmin, xmax, nx), np.linspace(ymin, ymax, ny)
+
+def _bilinear(xgrid, ygrid, params, x, y):
+    # Bilinear interpolation of params[iy,ix,:] at the positions (x,y).
+    # Returns the interpolated parameters and whether each position is inside the grid.
+    nx = len(xgrid)
+    ny = len(ygrid)
+    fx = (x - xgrid[0]) / (xgrid[1] - xgrid[0])
+    fy = (y - ygrid[0]) / (ygrid[1] - ygrid[0])
+    eps = 1.e-8
+    inside = (fx >= -eps) & (fx <= nx-1+eps) & (fy >= -eps) & (fy <= ny-1+eps)
+    ix = np.clip(np.floor(fx).astype(int), 0, nx-2)
+    iy = np.clip(np.floor(fy).astype(int), 0, ny-2)
+    wx = (fx - ix)[:,np.newaxis]
+    wy = (fy - iy)[:,np.newaxis]
+    p = ((1.-wx) * (1.-wy) * params[iy,ix] + wx * (1.-wy) * params[iy,ix+1] +
+         (1.-wx) * wy * params[iy+1,ix] + wx * wy * params[iy+1,ix+1])
+    return p, inside
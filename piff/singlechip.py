@@ -22,7 +22,12 @@ import numpy as np
 import copy
 
 from .psf import PSF
-from .util import write_kwargs, read_kwargs, make_dtype, adjust_value
+
+try:
+    from collections.abc import Mapping
+except ImportError:  # pragma: no cover  (python 2)
+    from collections import Mapping
+from .util import write_kwargs, read_kwargs, make_dtype, adjust_value, Timings
 
 class SingleChipPSF(PSF):
     """A PSF class that uses a separate PSF solution for each chip
@@ -68,7 +73,7 @@ class SingleChipPSF(PSF):
 
         return { 'single_psf' : single_psf }
 
-    def fit(self, stars, wcs, pointing, logger=None):
+    def fit(self, stars, wcs, pointing, logger=None, timings=None):
         """Fit interpolated PSF model to star data using standard sequence of operations.
 
         :param stars:           A list of Star instances.
@@ -76,10 +81,18 @@ class SingleChipPSF(PSF):
         :param pointing:        A galsim.CelestialCoord object giving the telescope pointing.
                                 [Note: pointing should be None if the WCS is not a CelestialWCS]
         :param logger:          A logger object for logging debug info. [default: None]
+        :param timings:         Optionally, a Timings instance in which to accumulate the time
+                                spent in each stage of the fit.  The times for all the chips
+                                are added together. [default: None, which means start a new
+                                one]  Either way, it is available afterwards as self.timings.
         """
         self.stars = stars
         self.wcs = wcs
         self.pointing = pointing
+        self.clearDrawCache()
+        if timings is None:
+            timings = Timings()
+        self.timings = timings
         self.psf_by_chip = {}
         for chipnum in wcs:
             # Make a copy of single_psf for each chip
@@ -94,7 +107,7 @@ class SingleChipPSF(PSF):
             if logger:
                 logger.warning("Building solution for chip %s with %d stars",
                                chipnum, len(stars_chip))
-            psf_chip.fit(stars_chip, wcs_chip, pointing, logger=logger)
+            psf_chip.fit(stars_chip, wcs_chip, pointing, logger=logger, timings=timings)
         # update stars from psf outlier rejection
         self.stars = [ star for chipnum in wcs for star in self.psf_by_chip[chipnum].stars ]
 
@@ -109,6 +122,83 @@ class SingleChipPSF(PSF):
         chipnum = star['chipnum']
         return self.psf_by_chip[chipnum].drawStar(star)
 
+    def buildGrid(self, nx=16, ny=16, per_chip=True, bounds=None, tol=None, ncheck=20,
+                  stamp_size=32, seed=None, logger=None):
+        """Precompute the interpolated PSF parameters on a regular grid for each chip, to speed
+        up drawing.
+
+        See SimplePSF.buildGrid for details.  Since the solutions are separate for each chip,
+        per_chip must be True.
+
+        :param nx:          The number of grid points in the x direction. [default: 16]
+        :param ny:          The number of grid points in the y direction. [default: 16]
+        :param per_chip:    Must be True for a SingleChipPSF. [default: True]
+        :param bounds:      Optionally, a dict of galsim.BoundsD instances in image coordinates
+                            indexed by chipnum giving the range to cover with each grid.
+                            [default: None, which means use the range covered by the stars]
+        :param tol:         The maximum acceptable relative error in the check images.
+                            [default: None, which means don't fail]
+        :param ncheck:      The number of positions to check on each chip. [default: 20]
+        :param stamp_size:  The size of the check images. [default: 32]
+        :param seed:        A seed for the random check positions. [default: None]
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        :returns: the maximum relative error in the check images over all the chips
+        """
+        if not per_chip:
+            raise ValueError("SingleChipPSF only supports per_chip=True")
+        errors = []
+        for chipnum in self.psf_by_chip:
+            chip_bounds = { chipnum : bounds[chipnum] } if bounds is not None else None
+            errors.append(self.psf_by_chip[chipnum].buildGrid(
+                    nx, ny, per_chip=True, bounds=chip_bounds, tol=tol, ncheck=ncheck,
+                    stamp_size=stamp_size, seed=seed, logger=logger))
+        self.grid_error = max(errors) if len(errors) > 0 else 0.
+        return self.grid_error
+
+    def removeGrid(self):
+        """Remove the grids built by buildGrid, so drawing uses the full interpolation again.
+        """
+        for chipnum in self.psf_by_chip:
+            self.psf_by_chip[chipnum].removeGrid()
+
+    def drawStarList(self, stars, logger=None):
+        """Generate PSF images for a list of stars.
+
+        The stars are grouped by chip, so each chip's PSF can draw all of its stars at once.
+
+        :param stars:       A list of Star instances holding information needed for
+                            interpolation as well as an image/WCS into which PSF will be
+                            rendered.
+        :param logger:      A logger object for logging debug info. [default: None]
+
+        :returns:           A list of Star instances with their images filled with the
+                            rendered PSF
+        """
+        indices = {}
+        for i, star in enumerate(stars):
+            indices.setdefault(star['chipnum'], []).append(i)
+        drawn = [None] * len(stars)
+        for chipnum, chip_indices in indices.items():
+            chip_stars = [ stars[i] for i in chip_indices ]
+            chip_stars = self.psf_by_chip[chipnum].drawStarList(chip_stars, logger=logger)
+            for i, star in zip(chip_indices, chip_stars):
+                drawn[i] = star
+        return drawn
+
+    def write(self, file_name, logger=None, format=None):
+        """Write a PSF object to a file.
+
+        :param file_name:   The name of the file to write to.
+        :param logger:      A logger object for logging debug info. [default: None]
+        :param format:      The file format to use, either 'fits' or 'npz'. [default: None]
+        """
+        # If the chips are being read lazily, make sure they are all read in now, in case
+        # the file being written is the one they are being read from.
+        if isinstance(self.psf_by_chip, LazyChipPSFs):
+            self.psf_by_chip = self.psf_by_chip.readAll()
+        super(SingleChipPSF, self).write(file_name, logger=logger, format=format)
+
     def _finish_write(self, fits, extname, logger):
         """Finish the writing process with any class-specific steps.
 
@@ -117,7 +207,7 @@ class SingleChipPSF(PSF):
         :param logger:      A logger object for logging debug info.
         """
         # Write the colnums to an extension.
-        chipnums = self.psf_by_chip.keys()
+        chipnums = list(self.psf_by_chip.keys())
         dt = make_dtype('chipnums', chipnums[0])
         chipnums = [ adjust_value(c,dt) for c in chipnums ]
         cols = [ chipnums ]
@@ -129,15 +219,114 @@ class SingleChipPSF(PSF):
         for chipnum in self.psf_by_chip:
             self.psf_by_chip[chipnum]._write(fits, extname + '_%s'%chipnum, logger)
 
-    def _finish_read(self, fits, extname, logger):
+    def _finish_read(self, fits, extname, logger, file_name=None, format=None, chips=None,
+                     **kwargs):
         """Finish the reading process with any class-specific steps.
 
+        If the file name is known, the PSF for each chip is only read from the file when it is
+        first used.  Alternatively, if chips is given, only those chips are read.
+
         :param fits:        An open fitsio.FITS object
         :param extname:     The base name of the extension to write to.
         :param logger:      A logger object for logging debug info.
+        :param file_name:   The name of the file being read. [default: None]
+        :param format:      The format of the file being read. [default: None]
+        :param chips:       A list of the chips to read. [default: None]
+        :param **kwargs:    Other options given to read, which are ignored here.
         """
         chipnums = fits[extname + '_chipnums'].read()['chipnums']
-        self.psf_by_chip = {}
-        for chipnum in chipnums:
-            self.psf_by_chip[chipnum] = PSF._read(fits, extname + '_%s'%chipnum, logger)
+        if chips is not None:
+            for chipnum in chips:
+                if chipnum not in chipnums:
+                    raise ValueError("chip %s is not in the PSF file"%chipnum)
+            self.psf_by_chip = {}
+            for chipnum in chips:
+                self.psf_by_chip[chipnum] = PSF._read(fits, extname + '_%s'%chipnum, logger)
+        elif file_name is not None:
+            self.psf_by_chip = LazyChipPSFs(chipnums, file_name, format, extname, logger)
+        else:
+            self.psf_by_chip = {}
+            for chipnum in chipnums:
+                self.psf_by_chip[chipnum] = PSF._read(fits, extname + '_%s'%chipnum, logger)
+
+
+class LazyChipPSFs(Mapping):
+    """A dict-like mapping from chipnum to the PSF for that chip, which reads each chip's PSF
+    from the file the first time it is accessed.
+
+    This is what SingleChipPSF uses for psf_by_chip when it is read from a file, since
+    typically only a few chips are needed at a time.  The file is opened when this is made
+    (i.e. when the SingleChipPSF is read) and kept open, so the chips are read from the
+    same file even if it is overwritten or removed later, and reading each chip doesn't
+    need to open the file and scan its extensions again.  It is closed once all the chips
+    have been read, or by calling close.  If a chip that hasn't been read yet is accessed
+    after that (or in a pickled copy), the file is reopened by name.
+
+    :param chipnums:    The chip numbers in the file.
+    :param file_name:   The name of the file.
+    :param format:      The format of the file, 'fits' or 'npz' (or None to infer from the
+                        file name).
+    :param extname:     The base name of the extensions for the SingleChipPSF.
+    :param logger:      A logger object for logging debug info. [default: None]
+    """
+    def __init__(self, chipnums, file_name, format, extname, logger=None):
+        self.chipnums = list(chipnums)
+        self.file_name = file_name
+        self.format = format
+        self.extname = extname
+        self.logger = logger
+        self._psfs = {}
+        self._file = None
+        self._getFile()
+
+    def __getitem__(self, chipnum):
+        if chipnum not in self._psfs:
+            if chipnum not in self.chipnums:
+                raise KeyError(chipnum)
+            if self.logger:
+                self.logger.info("Reading PSF for chip %s from %s",chipnum,self.file_name)
+            self._psfs[chipnum] = PSF._read(self._getFile(), self.extname + '_%s'%chipnum,
+                                            self.logger)
+            if len(self._psfs) == len(self.chipnums):
+                self.close()
+        return self._psfs[chipnum]
+
+    def _getFile(self):
+        # Open the file if it isn't already open.
+        if self._file is None:
+            from .psf import _open_file
+            self._file = _open_file(self.file_name, 'r', self.format)
+        return self._file
+
+    def readAll(self):
+        """Read the PSFs for all the chips that haven't been read yet, and close the file.
+
+        :returns: a dict of the PSFs indexed by chipnum
+        """
+        for chipnum in self.chipnums:
+            self[chipnum]
+        self.close()
+        return dict(self._psfs)
+
+    def close(self):
+        """Close the file, if it is open.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __getstate__(self):
+        # An open file can't be pickled or copied.
+        d = self.__dict__.copy()
+        d['_file'] = None
+        return d
+
+    def __contains__(self, chipnum):
+        # Don't read the chip's PSF just to check whether it is there.
+        return chipnum in self.chipnums
+
+    def __iter__(self):
+        return iter(self.chipnums)
 
+    def __len__(self):
+        return len(self.chipnums)
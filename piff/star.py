@@ -278,19 +278,17 @@ class Star(object):
                 dtypes.append( (key, float) )
                 cols.append( [ s.data.properties[key] for s in stars ] )
 
-        # Add the local WCS values
+        # Add the local WCS values.  Only compute each jacobian once.
         dtypes.extend( [('dudx', float), ('dudy', float), ('dvdx', float), ('dvdy', float) ] )
-        cols.append( [s.data.local_wcs.jacobian().dudx for s in stars] )
-        cols.append( [s.data.local_wcs.jacobian().dudy for s in stars] )
-        cols.append( [s.data.local_wcs.jacobian().dvdx for s in stars] )
-        cols.append( [s.data.local_wcs.jacobian().dvdy for s in stars] )
+        jac = np.array([ (j.dudx, j.dudy, j.dvdx, j.dvdy)
+                         for j in (s.data.local_wcs.jacobian() for s in stars) ])
+        cols.extend(jac.T)
 
         # Add the bounds
         dtypes.extend( [('xmin', int), ('xmax', int), ('ymin', int), ('ymax', int) ] )
-        cols.append( [s.data.image.bounds.xmin for s in stars] )
-        cols.append( [s.data.image.bounds.xmax for s in stars] )
-        cols.append( [s.data.image.bounds.ymin for s in stars] )
-        cols.append( [s.data.image.bounds.ymax for s in stars] )
+        bounds = np.array([ (b.xmin, b.xmax, b.ymin, b.ymax)
+                            for b in (s.data.image.bounds for s in stars) ])
+        cols.extend(bounds.T)
 
         # Now the easy parts of fit:
         dtypes.extend( [ ('flux', float), ('center', float, 2), ('chisq', float) ] )
@@ -303,25 +301,37 @@ class Star(object):
             dtypes.append( ('params', float, len(stars[0].fit.params)) )
             cols.append( [ s.fit.params for s in stars ] )
 
+        # If the HSM moments have been measured for all the stars, write them too, since the
+        # image data isn't written.
+        if all(s.data.hasHSM() for s in stars):
+            dtypes.append( ('hsm_moments', float, 7) )
+            cols.append( [ s.data.getHSM() for s in stars ] )
+
         # If pointing is set, write that
         if stars[0].data.pointing is not None:
             dtypes.extend( [('point_ra', float), ('point_dec', float)] )
             cols.append( [s.data.pointing.ra / galsim.degrees for s in stars ] )
             cols.append( [s.data.pointing.dec / galsim.degrees for s in stars ] )
 
-        data = np.array(list(zip(*cols)), dtype=dtypes)
+        # Fill the table one column at a time, rather than zipping up the rows.
+        data = np.empty(len(stars), dtype=dtypes)
+        for dt, col in zip(dtypes, cols):
+            data[dt[0]] = col
         fits.write_table(data, extname=extname)
 
     @classmethod
     def read(cls, fits, extname):
         """Read stars from a FITS file.
 
+        The stars are returned as a :class:`StarList`, which looks like a list of Star
+        instances, but only builds each Star (with its blank image and weight) when it is
+        accessed.
+
         :param fits:        An open fitsio.FITS object
         :param extname:     The name of the extension to read from
 
         :returns: a list of Star instances
         """
-        import galsim
         assert extname in fits
         colnames = fits[extname].get_colnames()
 
@@ -330,59 +340,9 @@ class Star(object):
                     'xmin', 'xmax', 'ymin', 'ymax',
                     'flux', 'center', 'chisq']:
             assert key in colnames
-            colnames.remove(key)
 
         data = fits[extname].read()
-        x_list = data['x']
-        y_list = data['y']
-        u_list = data['u']
-        v_list = data['v']
-        dudx = data['dudx']
-        dudy = data['dudy']
-        dvdx = data['dvdx']
-        dvdy = data['dvdy']
-        xmin = data['xmin']
-        xmax = data['xmax']
-        ymin = data['ymin']
-        ymax = data['ymax']
-        flux = data['flux']
-        center = data['center']
-        chisq = data['chisq']
-
-        if 'params' in colnames:
-            params = data['params']
-            colnames.remove('params')
-        else:
-            params = [ None ] * len(data)
-
-        if 'point_ra' in colnames:
-            pointing_list = [ galsim.CelestialCoord(row['point_ra'] * galsim.degrees,
-                                                    row['point_dec'] * galsim.degrees)
-                              for row in data ]
-            colnames.remove('point_ra')
-            colnames.remove('point_dec')
-        else:
-            pointing_list = [ None ] * len(data)
-
-        fit_list = [ StarFit(p, flux=f, center=c, chisq=x)
-                     for (p,f,c,x) in zip(params, flux, center, chisq) ]
-
-        # The rest of the columns are the data properties
-        prop_list = [ { c : row[c] for c in colnames } for row in data ]
-
-        wcs_list = [ galsim.JacobianWCS(*jac) for jac in zip(dudx,dudy,dvdx,dvdy) ]
-        pos_list = [ galsim.PositionD(*pos) for pos in zip(x_list,y_list) ]
-        wpos_list = [ galsim.PositionD(*pos) for pos in zip(u_list,v_list) ]
-        wcs_list = [ w.withOrigin(p, wp) for w,p,wp in zip(wcs_list, pos_list, wpos_list) ]
-        bounds_list = [ galsim.BoundsI(*b) for b in zip(xmin,xmax,ymin,ymax) ]
-        image_list = [ galsim.Image(bounds=b, wcs=w) for b,w in zip(bounds_list, wcs_list) ]
-        weight_list = [ galsim.Image(bounds=b, wcs=w) for b,w in zip(bounds_list, wcs_list) ]
-        data_list = [ StarData(im, pos, weight=w, properties=prop, pointing=point)
-                      for im,pos,w,prop,point in zip(image_list, pos_list, weight_list,
-                                                     prop_list, pointing_list) ]
-
-        stars = [ Star(d,f) for (d,f) in zip(data_list, fit_list) ]
-        return stars
+        return StarList(data)
 
     @staticmethod
     def load_images(stars, file_name, pointing=None,
@@ -593,12 +553,13 @@ class StarData(object):
                           [default: False]
     """
     def __init__(self, image, image_pos, weight=None, pointing=None, field_pos=None,
-                 values_are_sb=False, properties=None, logger=None, _xyuv_set=False):
+                 values_are_sb=False, properties=None, logger=None, _xyuv_set=False, _hsm=None):
         import galsim
         # Save all of these as attributes.
         self.image = image
         self.image_pos = image_pos
         self.values_are_sb = values_are_sb
+        self._hsm = _hsm
         # Make sure we have a local wcs in case the provided image is more complex.
         self.local_wcs = image.wcs.local(image_pos)
 
@@ -668,6 +629,42 @@ class StarData(object):
         else:
             return wcs.toWorld(image_pos)
 
+    @staticmethod
+    def calculateFieldPosArray(x, y, wcs, pointing):
+        """
+        Convert many positions from image coordinates to field coordinates at once.
+
+        This is equivalent to calling calculateFieldPos for each position, but the conversion
+        is done with numpy array operations, which is much faster for large numbers of
+        positions.  With GalSim 2.0 or later, the WCS conversion uses GalSim's array-capable
+        toWorld method.  The projection to field coordinates for a CelestialWCS is done here
+        with a vectorized gnomonic projection about the pointing.
+
+        :param x:           An array of x positions in image coordinates.
+        :param y:           An array of y positions in image coordinates.
+        :param wcs:         The wcs to use to connect image coordinates with sky coordinates:
+        :param pointing:    A galsim.CelestialCoord representing the pointing coordinate of the
+                            exposure.  This is required if image.wcs is a CelestialWCS, but should
+                            be None if image.wcs is a EuclideanWCS. [default: None]
+
+        :returns: u, v, ra, dec, where u,v are arrays of the field coordinates in arcsec, and
+                  ra, dec are the sky coordinates (in hours, degrees respectively) if the wcs is
+                  a CelestialWCS.  Otherwise ra, dec are None.
+        """
+        import galsim
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if wcs.isCelestial():
+            if pointing is None:
+                raise AttributeError("If the image uses a CelestialWCS then pointing is required.")
+            ra, dec = _toWorldArray(wcs, x, y)
+            u, v = _gnomonic(ra, dec, pointing)
+            return (u, v, ra * (galsim.radians / galsim.hours),
+                    dec * (galsim.radians / galsim.degrees))
+        else:
+            u, v = _toWorldArray(wcs, x, y)
+            return u, v, None, None
+
     def __getitem__(self, key):
         """Get a property of the star.
 
@@ -681,6 +678,30 @@ class StarData(object):
         """
         return self.properties[key]
 
+    def getHSM(self):
+        """Get the HSM adaptive moments of the image.
+
+        These are measured the first time they are needed and then kept, so they are only
+        measured once for each StarData.  They are also carried along to the new StarData made
+        by addPoisson, which doesn't change which pixels are used, and by maskPixels if no
+        additional pixels are masked.  The image should not be modified in place after they
+        have been measured.
+
+        :returns: (flux, cenu, cenv, sigma, g1, g2, flag) where cenu, cenv are relative to
+                  image_pos, and flag is nonzero if HSM failed.
+        """
+        if self._hsm is None:
+            from .util import _calculate_hsm
+            self._hsm = _calculate_hsm(self)
+        return self._hsm
+
+    def hasHSM(self):
+        """Check whether the HSM adaptive moments have already been measured.
+
+        :returns: whether getHSM will return the stored moments without running HSM.
+        """
+        return self._hsm is not None
+
     def getImage(self):
         """Get the pixel data as a galsim.Image.
 
@@ -807,13 +828,15 @@ class StarData(object):
         newweight.array[use] = 1. / (1./self.weight.array[use] + variance / gain)
 
         # Return new object
+        # HSM only uses the weight to choose which pixels to use, so the moments are the same.
         return StarData(image=self.image,
                         image_pos=self.image_pos,
                         weight=newweight,
                         pointing=self.pointing,
                         values_are_sb=self.values_are_sb,
                         properties=dict(self.properties, gain=gain),
-                        _xyuv_set = True)
+                        _xyuv_set = True,
+                        _hsm = self._hsm)
 
     def maskPixels(self, mask):
         """Return new StarData with weight nulled at pixels marked as False in the mask.
@@ -842,14 +865,15 @@ class StarData(object):
         newweight = self.weight.copy()
         newweight.array[use] = np.where(m, self.weight.array[use], 0.)
 
-        # Return new object
+        # Return new object.  The moments only change if some more pixels are masked.
         return StarData(image=self.image,
                         image_pos=self.image_pos,
                         weight=newweight,
                         pointing=self.pointing,
                         values_are_sb=self.values_are_sb,
                         properties=self.properties,
-                        _xyuv_set=True)
+                        _xyuv_set=True,
+                        _hsm=self._hsm if np.all(m) else None)
 
 
 class StarFit(object):
@@ -935,3 +959,108 @@ class StarFit(object):
         :returns: the value of the given property.
         """
         return self.params[key]
+
+
+try:
+    from collections.abc import Sequence
+except ImportError:  # pragma: no cover  (python 2)
+    from collections import Sequence
+
+class StarList(Sequence):
+    """A read-only list of stars, which builds each Star from a table row when it is accessed.
+
+    This is what :func:`Star.read` returns.  Making the Star objects, along with their
+    (blank) image and weight images and their WCS, is much slower and uses much more memory
+    than the table itself, so this is deferred until a given star is actually needed.
+    Once a star has been made, it is kept, so repeated access returns the same object.
+
+    :param data:        A numpy structured array, as written by :func:`Star.write`.
+    """
+    _star_keys = [ 'x', 'y', 'u', 'v', 'dudx', 'dudy', 'dvdx', 'dvdy',
+                   'xmin', 'xmax', 'ymin', 'ymax', 'flux', 'center', 'chisq', 'params',
+                   'hsm_moments', 'point_ra', 'point_dec' ]
+
+    def __init__(self, data):
+        self.data = data
+        self._stars = [ None ] * len(data)
+        # The rest of the columns are the data properties
+        self._prop_keys = [ c for c in data.dtype.names if c not in self._star_keys ]
+
+    def __len__(self):
+        return len(self._stars)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [ self[i] for i in range(*index.indices(len(self))) ]
+        star = self._stars[index]
+        if star is None:
+            star = self._stars[index] = self._make_star(self.data[index])
+        return star
+
+    def __repr__(self):
+        return 'piff.StarList(%r)'%(self.data,)
+
+    def _make_star(self, row):
+        import galsim
+        names = row.dtype.names
+
+        params = row['params'] if 'params' in names else None
+        fit = StarFit(params, flux=row['flux'], center=row['center'], chisq=row['chisq'])
+
+        if 'point_ra' in names:
+            pointing = galsim.CelestialCoord(row['point_ra'] * galsim.degrees,
+                                             row['point_dec'] * galsim.degrees)
+        else:
+            pointing = None
+
+        prop = { c : row[c] for c in self._prop_keys }
+        pos = galsim.PositionD(row['x'], row['y'])
+        wpos = galsim.PositionD(row['u'], row['v'])
+        wcs = galsim.JacobianWCS(row['dudx'], row['dudy'], row['dvdx'], row['dvdy'])
+        wcs = wcs.withOrigin(pos, wpos)
+        bounds = galsim.BoundsI(row['xmin'], row['xmax'], row['ymin'], row['ymax'])
+        image = galsim.Image(bounds=bounds, wcs=wcs)
+        weight = galsim.Image(bounds=bounds, wcs=wcs)
+        if 'hsm_moments' in names:
+            flux, cenu, cenv, sigma, g1, g2, flag = row['hsm_moments']
+            hsm = (flux, cenu, cenv, sigma, g1, g2, int(flag))
+        else:
+            hsm = None
+        data = StarData(image, pos, weight=weight, properties=prop, pointing=pointing, _hsm=hsm)
+        return Star(data, fit)
+
+
+def _toWorldArray(wcs, x, y):
+    # Convert arrays of image positions to world coordinates.
+    # For a CelestialWCS, this returns ra, dec in radians.  Otherwise u, v.
+    import galsim
+    if int(galsim.__version__.split('.')[0]) >= 2:
+        # GalSim 2.0 and later can convert arrays of positions all at once.
+        if wcs.isCelestial():
+            return wcs.toWorld(x, y, units=galsim.radians)
+        else:
+            return wcs.toWorld(x, y)
+    else:
+        # Earlier versions only take one position at a time.
+        pos = [ wcs.toWorld(galsim.PositionD(xx,yy)) for xx, yy in zip(x, y) ]
+        if wcs.isCelestial():
+            return (np.array([ p.ra / galsim.radians for p in pos ]),
+                    np.array([ p.dec / galsim.radians for p in pos ]))
+        else:
+            return np.array([ p.x for p in pos ]), np.array([ p.y for p in pos ])
+
+def _gnomonic(ra, dec, pointing):
+    # The gnomonic projection of ra, dec (in radians) about pointing, which matches what
+    # pointing.project(coord) does for a single position.  Returns u, v in arcsec.
+    import galsim
+    ra0 = pointing.ra / galsim.radians
+    dec0 = pointing.dec / galsim.radians
+    sindec0, cosdec0 = np.sin(dec0), np.cos(dec0)
+    sindec, cosdec = np.sin(dec), np.cos(dec)
+    sindra, cosdra = np.sin(ra - ra0), np.cos(ra - ra0)
+    cosc = sindec0 * sindec + cosdec0 * cosdec * cosdra
+    # Note: +u is in the direction of decreasing ra.
+    u = -cosdec * sindra / cosc
+    v = (cosdec0 * sindec - sindec0 * cosdec * cosdra) / cosc
+    factor = galsim.radians / galsim.arcsec
+    return u * factor, v * factor
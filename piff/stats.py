@@ -88,14 +88,20 @@ class Stats(object):
         kwargs.update(config_stats)
         return kwargs
 
-    def compute(self, psf, stars, logger=None):
+    def compute(self, psf, stars, logger=None, shapes=None):
         """Compute the given statistic for a PSF solution on a set of stars.
 
         This needs to be done before the statistic is plotted or written to a file.
 
+        The shape measurements are the expensive part of most statistics, so if several
+        Stats objects are computed for the same PSF and stars, the output of
+        :func:`measureShapes` may be computed once and passed in as ``shapes``.
+
         :param psf:         A PSF Object
         :param stars:       A list of Star instances.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param shapes:      Optionally, the output of measureShapes(psf, stars) if it has
+                            already been computed. [default: None]
         """
         raise NotImplemented("Derived classes must define the plot function")
 
@@ -139,40 +145,108 @@ class Stats(object):
         fig.set_tight_layout(True)
         canvas.print_figure(file_name, dpi=100)
 
-    def measureShapes(self, psf, stars, logger=None):
+    @staticmethod
+    def measureShapes(psf, stars, logger=None, nproc=1, use_threads=False, chunk_size=None):
         """Compare PSF and true star shapes with HSM algorithm
 
+        This doesn't depend on the particular statistic, so it may be called as
+        ``piff.Stats.measureShapes(psf, stars)`` and the result shared among several
+        Stats instances via the ``shapes`` parameter of :func:`compute`.
+
+        The measurements may optionally be done in parallel by setting ``nproc``.  The stars
+        are split into chunks, each of which is measured by a worker in a multiprocessing
+        Pool (or a ThreadPool if ``use_threads`` is True).  The PSF is only sent to each
+        worker process once, when the pool starts, so the chunks just contain the stars.
+        The results are returned in the same order as the input stars.
+
         :param psf:         A PSF Object
         :param stars:       A list of Star instances.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param nproc:       How many processes (or threads) to use.  nproc <= 0 means use
+                            the number of cpus. [default: 1]
+        :param use_threads: Whether to use threads rather than processes when nproc != 1.
+                            [default: False]
+        :param chunk_size:  How many stars to send to each worker at a time.  [default: None,
+                            which means to split the stars into 4 chunks per worker]
 
         :returns:           positions of stars, shapes of stars, and shapes of
                             models of stars (sigma, g1, g2)
         """
-        import piff
-        # measure moments with Gaussian on image
-        if logger:
-            logger.debug("Measuring shapes of real stars")
-        shapes_truth = np.array([ piff.util.hsm(star) for star in stars ])
-        for star, shape in zip(stars, shapes_truth):
+        import time
+        t0 = time.time()
+
+        if nproc <= 0:
+            import multiprocessing
+            nproc = multiprocessing.cpu_count()
+        nproc = min(nproc, len(stars))
+
+        if nproc <= 1:
+            if logger:
+                logger.debug("Measuring shapes of real and model stars")
+            shapes = _measure_shapes(psf, stars)
+        else:
+            if chunk_size is None:
+                chunk_size = max(1, len(stars) // (4 * nproc))
+            chunks = [ stars[i:i+chunk_size] for i in range(0, len(stars), chunk_size) ]
             if logger:
-                logger.debug("real shape for star at %s is %s",star.image_pos, shape)
+                logger.info("Measuring shapes of %d stars using %d %s in %d chunks",
+                            len(stars), nproc, 'threads' if use_threads else 'processes',
+                            len(chunks))
+            if use_threads:
+                # The threads can all use the same psf object directly.
+                from multiprocessing.pool import ThreadPool
+                from functools import partial
+                pool = ThreadPool(nproc)
+                measure = partial(_measure_shapes, psf)
+            else:
+                # Send the psf to each worker process once, rather than with every chunk.
+                from multiprocessing import Pool
+                pool = Pool(nproc, initializer=_init_worker_psf, initargs=(psf,))
+                measure = _measure_shapes_chunk
+            try:
+                # map returns the chunks in order, so concatenating them keeps the star order.
+                results = pool.map(measure, chunks)
+            finally:
+                pool.close()
+                pool.join()
+            shapes = [ shape for chunk in results for shape in chunk ]
+
+        shapes_truth = np.array([ shape[0] for shape in shapes ])
+        shapes_model = np.array([ shape[1] for shape in shapes ])
+        if logger:
+            for star, truth, model in zip(stars, shapes_truth, shapes_model):
+                logger.debug("real shape for star at %s is %s",star.image_pos, truth)
+                logger.debug("model shape for star at %s is %s",star.image_pos, model)
 
         # Pull out the positions to return
         positions = np.array([ (star.data.properties['u'], star.data.properties['v'])
                                for star in stars ])
 
-        # generate the model stars and measure moments
         if logger:
-            logger.debug("Generating and Measuring Model Stars")
-        shapes_model = np.array([ piff.util.hsm(psf.drawStar(star)) for star in stars ])
-        for star, shape in zip(stars, shapes_model):
-            if logger:
-                logger.debug("model shape for star at %s is %s",star.image_pos, shape)
+            logger.info("Measured shapes of %d stars in %.2f seconds",len(stars),time.time()-t0)
 
         return positions, shapes_truth, shapes_model
 
 
+def _measure_shapes(psf, stars):
+    # Measure the shapes of the real stars and the model stars.
+    from .util import hsm
+    return [ (hsm(star), hsm(psf.drawStar(star))) for star in stars ]
+
+# The psf used by _measure_shapes_chunk in each worker process.
+_worker_psf = None
+
+def _init_worker_psf(psf):
+    # Set up a worker process in measureShapes with the psf to use.
+    global _worker_psf
+    _worker_psf = psf
+
+def _measure_shapes_chunk(stars):
+    # Measure the shapes for a chunk of stars in a worker process.
+    # This needs to be a module-level function so it can be pickled for multiprocessing.
+    return _measure_shapes(_worker_psf, stars)
+
+
 class ShapeHistogramsStats(Stats):
     """Stats class for calculating histograms of shape residuals
 
@@ -211,16 +285,20 @@ class ShapeHistogramsStats(Stats):
         self.bins_shape = bins_shape
         self.file_name = file_name
 
-    def compute(self, psf, stars, logger=None):
+    def compute(self, psf, stars, logger=None, shapes=None):
         """
         :param psf:         A PSF Object
         :param stars:       A list of Star instances.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param shapes:      Optionally, the output of measureShapes(psf, stars) if it has
+                            already been computed. [default: None]
         """
         # get the shapes
         if logger:
             logger.warning("Calculating shape histograms for %d stars",len(stars))
-        positions, shapes_truth, shapes_model = self.measureShapes(psf, stars, logger=logger)
+        if shapes is None:
+            shapes = self.measureShapes(psf, stars, logger=logger)
+        positions, shapes_truth, shapes_model = shapes
 
         # Only use stars for which hsm was successful
         flag_truth = shapes_truth[:, 6]
@@ -332,15 +410,23 @@ class RhoStats(Stats):
     in some cases, so we provide access to the full object.
     """
     def __init__(self, min_sep=0.5, max_sep=300, bin_size=0.1, file_name=None,
-                 logger=None, **kwargs):
+                 num_threads=None, corr_file_name=None, logger=None, **kwargs):
         """
-        :param min_sep:     Minimum separation (in arcmin) for pairs. [default: 0.5]
-        :param max_sep:     Maximum separation (in arcmin) for pairs. [default: 300]
-        :param bin_size:    Size of bins in log(sep). [default 0.1]
-        :param file_name:   Name of the file to output to. [default: None]
-        :param logger:      A logger object for logging debug info. [default: None]
-        :param **kwargs:    Any additional kwargs are passed on to TreeCorr.
+        :param min_sep:         Minimum separation (in arcmin) for pairs. [default: 0.5]
+        :param max_sep:         Maximum separation (in arcmin) for pairs. [default: 300]
+        :param bin_size:        Size of bins in log(sep). [default 0.1]
+        :param file_name:       Name of the file to output to. [default: None]
+        :param num_threads:     How many threads TreeCorr should use. [default: None, which
+                                means to use all available cores]
+        :param corr_file_name:  Optionally, the base name of the files to which to write the
+                                computed correlation functions.  See :func:`writeCorrelations`.
+                                They can be read back in with :func:`readCorrelations`.
+                                [default: None]
+        :param logger:          A logger object for logging debug info. [default: None]
+        :param **kwargs:        Any additional kwargs are passed on to TreeCorr.
         """
+        self.num_threads = num_threads
+        self.corr_file_name = corr_file_name
         self.tckwargs = kwargs
         self.tckwargs['min_sep'] = min_sep
         self.tckwargs['max_sep'] = max_sep
@@ -349,18 +435,22 @@ class RhoStats(Stats):
             self.tckwargs['sep_units'] = 'arcmin'
         self.file_name = file_name
 
-    def compute(self, psf, stars, logger=None):
+    def compute(self, psf, stars, logger=None, shapes=None):
         """
         :param psf:         A PSF Object
         :param stars:       A list of Star instances.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param shapes:      Optionally, the output of measureShapes(psf, stars) if it has
+                            already been computed. [default: None]
         """
         import treecorr
 
         # get the shapes
         if logger:
             logger.warning("Calculating rho statistics for %d stars",len(stars))
-        positions, shapes_truth, shapes_model = self.measureShapes(psf, stars, logger=logger)
+        if shapes is None:
+            shapes = self.measureShapes(psf, stars, logger=logger)
+        positions, shapes_truth, shapes_model = shapes
 
         # Only use stars for which hsm was successful
         flag_truth = shapes_truth[:, 6]
@@ -392,17 +482,72 @@ class RhoStats(Stats):
         if logger:
             logger.info("Processing rho PSF statistics")
 
+        # Each catalog is used in several correlations.  TreeCorr caches the fields it builds
+        # for a catalog, so keeping the same three catalog objects for all five correlations
+        # means the trees are only built once for each of them.
+        pairs = [ (cat_dg, None), (cat_g, cat_dg), (cat_gdTT, None),
+                  (cat_dg, cat_gdTT), (cat_g, cat_gdTT) ]
+        rhos = []
+        for cat1, cat2 in pairs:
+            rho = treecorr.GGCorrelation(self.tckwargs)
+            rho.process(cat1, cat2, num_threads=self.num_threads)
+            rhos.append(rho)
+
         # save the rho objects
-        self.rho1 = treecorr.GGCorrelation(self.tckwargs)
-        self.rho1.process(cat_dg)
-        self.rho2 = treecorr.GGCorrelation(self.tckwargs)
-        self.rho2.process(cat_g, cat_dg)
-        self.rho3 = treecorr.GGCorrelation(self.tckwargs)
-        self.rho3.process(cat_gdTT)
-        self.rho4 = treecorr.GGCorrelation(self.tckwargs)
-        self.rho4.process(cat_dg, cat_gdTT)
-        self.rho5 = treecorr.GGCorrelation(self.tckwargs)
-        self.rho5.process(cat_g, cat_gdTT)
+        self.rho1, self.rho2, self.rho3, self.rho4, self.rho5 = rhos
+
+        if self.corr_file_name is not None:
+            self.writeCorrelations(self.corr_file_name, logger=logger)
+
+    @staticmethod
+    def corrFileNames(file_name):
+        """Get the names of the files used by :func:`writeCorrelations` for each of rho1..rho5.
+
+        These are the given file name with _rho1, _rho2, etc. inserted before the extension.
+
+        :param file_name:   The base file name.
+
+        :returns: a list of the five file names
+        """
+        root, ext = os.path.splitext(file_name)
+        return [ root + '_rho%d'%(k+1) + ext for k in range(5) ]
+
+    def writeCorrelations(self, file_name, logger=None):
+        """Write the computed rho statistics to files.
+
+        Each of rho1..rho5 is written to its own file (see :func:`corrFileNames`) using the
+        TreeCorr GGCorrelation.write method.  As in TreeCorr, the file type is determined from
+        the extension, e.g. a FITS file for .fits.
+
+        :param file_name:   The base name of the files to write to.
+        :param logger:      A logger object for logging debug info. [default: None]
+        """
+        if not hasattr(self, 'rho1'):
+            raise RuntimeError("Rho statistics have not been computed yet.  Cannot write.")
+        rhos = [self.rho1, self.rho2, self.rho3, self.rho4, self.rho5]
+        for rho, name in zip(rhos, self.corrFileNames(file_name)):
+            if logger:
+                logger.info("Writing rho statistics to file %s",name)
+            rho.write(name)
+
+    def readCorrelations(self, file_name, logger=None):
+        """Read rho statistics that were written by :func:`writeCorrelations`.
+
+        After this, the statistics may be plotted without calling :func:`compute` again.
+        The binning parameters should be the same as the ones used to compute them.
+
+        :param file_name:   The base name of the files to read from.
+        :param logger:      A logger object for logging debug info. [default: None]
+        """
+        import treecorr
+        rhos = []
+        for name in self.corrFileNames(file_name):
+            if logger:
+                logger.info("Reading rho statistics from file %s",name)
+            rho = treecorr.GGCorrelation(self.tckwargs)
+            rho.read(name)
+            rhos.append(rho)
+        self.rho1, self.rho2, self.rho3, self.rho4, self.rho5 = rhos
 
     def alt_plot(self, logger=None, **kwargs):  # pragma: no cover
         # Leaving this version here in case useful, but I (MJ) have a new version of this
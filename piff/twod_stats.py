@@ -23,6 +23,61 @@ import numpy as np
 from .stats import Stats
 import warnings
 
+def _sort_into_bins(indx_u, indx_v, number_bins_u, number_bins_v):
+    """Sort objects by their 2d bin, so each occupied bin is a contiguous segment.
+
+    :param indx_u:          The u bin index of each object.
+    :param indx_v:          The v bin index of each object.
+    :param number_bins_u:   The number of bin edges in the u direction.
+    :param number_bins_v:   The number of bin edges in the v direction.
+
+    :returns: a tuple (shape, order, bins, starts), where shape is the shape of the 2d
+              histogram, order sorts the objects by bin, bins are the flattened indices of
+              the occupied bins, and starts are the indices in the sorted arrays where each
+              occupied bin starts.
+    """
+    shape = (number_bins_v - 1, number_bins_u - 1)
+    flat_indx = np.ravel_multi_index((indx_v, indx_u), shape)
+    order = np.argsort(flat_indx, kind='mergesort')
+    bins, starts = np.unique(flat_indx[order], return_index=True)
+    return shape, order, bins, starts
+
+def _binned_reduce(z, bin_info, reducing_function):
+    """Apply reducing_function to the values of z in each occupied bin.
+
+    np.mean, np.sum and np.median are done with vectorized numpy operations on the sorted
+    segments.  Any other function is called once for each occupied bin.
+
+    :param z:                   The values for each object.
+    :param bin_info:            The output of _sort_into_bins.
+    :param reducing_function:   The function to apply to the values in each bin.
+
+    :returns: a masked array with the reduced values, where empty bins are masked.
+    """
+    shape, order, bins, starts = bin_info
+    zs = np.asarray(z)[order]
+    counts = np.diff(np.append(starts, len(zs)))
+
+    if len(zs) == 0:
+        values = np.zeros(0)
+    elif reducing_function is np.mean:
+        values = np.add.reduceat(zs, starts) / counts
+    elif reducing_function is np.sum:
+        values = np.add.reduceat(zs, starts)
+    elif reducing_function is np.median:
+        # Sort the values within each segment, then take the middle one (or two).
+        bin_of_sorted = np.repeat(np.arange(len(bins)), counts)
+        zs = zs[np.lexsort((zs, bin_of_sorted))]
+        values = 0.5 * (zs[starts + (counts-1)//2] + zs[starts + counts//2])
+    else:
+        values = np.array([ reducing_function(sample) for sample in np.split(zs, starts[1:]) ])
+
+    C = np.ma.zeros(shape)
+    C.mask = np.ones(shape)
+    C.data.flat[bins] = values
+    C.mask.flat[bins] = 0
+    return C
+
 class TwoDHistStats(Stats):
     """Statistics class that can make pretty colormaps where each bin has some
     arbitrary function applied to it.
@@ -59,17 +114,21 @@ class TwoDHistStats(Stats):
 
         self.file_name = file_name
 
-    def compute(self, psf, stars, logger=None):
+    def compute(self, psf, stars, logger=None, shapes=None):
         """
         :param psf:         A PSF Object
         :param stars:       A list of Star instances.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param shapes:      Optionally, the output of measureShapes(psf, stars) if it has
+                            already been computed. [default: None]
         """
 
         # get the shapes
         if logger:
             logger.info("Measuring Star and Model Shapes")
-        positions, shapes_truth, shapes_model = self.measureShapes(psf, stars, logger=logger)
+        if shapes is None:
+            shapes = self.measureShapes(psf, stars, logger=logger)
+        positions, shapes_truth, shapes_model = shapes
 
         # Only use stars for which hsm was successful
         flag_truth = shapes_truth[:, 6]
@@ -103,8 +162,8 @@ class TwoDHistStats(Stats):
         indx_u = np.digitize(u, self.bins_u) - 1
         indx_v = np.digitize(v, self.bins_v) - 1
 
-        # get unique indices
-        unique_indx = np.vstack({tuple(row) for row in np.vstack((indx_u, indx_v)).T})
+        # sort the stars by bin, so each occupied bin is a contiguous segment
+        bin_info = _sort_into_bins(indx_u, indx_v, self.number_bins_u, self.number_bins_v)
 
         # compute the arrays
         if logger:
@@ -112,34 +171,34 @@ class TwoDHistStats(Stats):
         self.twodhists = {}
 
         # throw in coordinates for good measure
-        self.twodhists['u'] = self._array_to_2dhist(u, indx_u, indx_v, unique_indx)
-        self.twodhists['v'] = self._array_to_2dhist(v, indx_u, indx_v, unique_indx)
+        self.twodhists['u'] = self._array_to_2dhist(u, bin_info)
+        self.twodhists['v'] = self._array_to_2dhist(v, bin_info)
         # T
-        self.twodhists['T'] = self._array_to_2dhist(T, indx_u, indx_v, unique_indx)
+        self.twodhists['T'] = self._array_to_2dhist(T, bin_info)
 
         # g1
-        self.twodhists['g1'] = self._array_to_2dhist(g1, indx_u, indx_v, unique_indx)
+        self.twodhists['g1'] = self._array_to_2dhist(g1, bin_info)
 
         # g2
-        self.twodhists['g2'] = self._array_to_2dhist(g2, indx_u, indx_v, unique_indx)
+        self.twodhists['g2'] = self._array_to_2dhist(g2, bin_info)
 
         # T_model
-        self.twodhists['T_model'] = self._array_to_2dhist(T, indx_u, indx_v, unique_indx)
+        self.twodhists['T_model'] = self._array_to_2dhist(T, bin_info)
 
         # g1_model
-        self.twodhists['g1_model'] = self._array_to_2dhist(g1_model, indx_u, indx_v, unique_indx)
+        self.twodhists['g1_model'] = self._array_to_2dhist(g1_model, bin_info)
 
         # g2_model
-        self.twodhists['g2_model'] = self._array_to_2dhist(g2_model, indx_u, indx_v, unique_indx)
+        self.twodhists['g2_model'] = self._array_to_2dhist(g2_model, bin_info)
 
         # dT
-        self.twodhists['dT'] = self._array_to_2dhist(dT, indx_u, indx_v, unique_indx)
+        self.twodhists['dT'] = self._array_to_2dhist(dT, bin_info)
 
         # dg1
-        self.twodhists['dg1'] = self._array_to_2dhist(dg1, indx_u, indx_v, unique_indx)
+        self.twodhists['dg1'] = self._array_to_2dhist(dg1, bin_info)
 
         # dg2
-        self.twodhists['dg2'] = self._array_to_2dhist(dg2, indx_u, indx_v, unique_indx)
+        self.twodhists['dg2'] = self._array_to_2dhist(dg2, bin_info)
 
     def plot(self, logger=None, **kwargs):
         """Make the plots.
@@ -274,20 +333,8 @@ class TwoDHistStats(Stats):
 
         return fig, axs
 
-    def _array_to_2dhist(self, z, indx_u, indx_v, unique_indx):
-        C = np.ma.zeros((self.number_bins_v - 1, self.number_bins_u - 1))
-        C.mask = np.ones((self.number_bins_v - 1, self.number_bins_u - 1))
-
-        for unique in unique_indx:
-            ui, vi = unique
-
-            sample = z[(indx_u == ui) & (indx_v == vi)]
-            if len(sample) > 0:
-                value = self.reducing_function(sample)
-                C[vi, ui] = value
-                C.mask[vi, ui] = 0
-
-        return C
+    def _array_to_2dhist(self, z, bin_info):
+        return _binned_reduce(z, bin_info, self.reducing_function)
 
     def _shift_cmap(self, vmin, vmax):
         from matplotlib import cm
@@ -413,17 +460,21 @@ class WhiskerStats(Stats):
 
         self.file_name = file_name
 
-    def compute(self, psf, stars, logger=None):
+    def compute(self, psf, stars, logger=None, shapes=None):
         """
         :param psf:         A PSF Object
         :param stars:       A list of Star instances.
         :param logger:      A logger object for logging debug info. [default: None]
+        :param shapes:      Optionally, the output of measureShapes(psf, stars) if it has
+                            already been computed. [default: None]
         """
 
         # get the shapes
         if logger:
             logger.info("Measuring Star and Model Shapes")
-        positions, shapes_truth, shapes_model = self.measureShapes(psf, stars, logger=logger)
+        if shapes is None:
+            shapes = self.measureShapes(psf, stars, logger=logger)
+        positions, shapes_truth, shapes_model = shapes
 
         # Only use stars for which hsm was successful
         flag_truth = shapes_truth[:, 6]
@@ -470,34 +521,34 @@ class WhiskerStats(Stats):
         indx_u = np.digitize(u, self.bins_u) - 1
         indx_v = np.digitize(v, self.bins_v) - 1
 
-        # get unique indices
-        unique_indx = np.vstack({tuple(row) for row in np.vstack((indx_u, indx_v)).T})
+        # sort the stars by bin, so each occupied bin is a contiguous segment
+        bin_info = _sort_into_bins(indx_u, indx_v, self.number_bins_u, self.number_bins_v)
 
         # compute the arrays
         if logger:
             logger.info("Computing TwoDHist arrays")
         self.twodhists = {}
 
-        self.twodhists['u'] = self._array_to_2dhist(u, indx_u, indx_v, unique_indx)
-        self.twodhists['v'] = self._array_to_2dhist(v, indx_u, indx_v, unique_indx)
+        self.twodhists['u'] = self._array_to_2dhist(u, bin_info)
+        self.twodhists['v'] = self._array_to_2dhist(v, bin_info)
 
         # w1
-        self.twodhists['w1'] = self._array_to_2dhist(w1, indx_u, indx_v, unique_indx)
+        self.twodhists['w1'] = self._array_to_2dhist(w1, bin_info)
 
         # w2
-        self.twodhists['w2'] = self._array_to_2dhist(w2, indx_u, indx_v, unique_indx)
+        self.twodhists['w2'] = self._array_to_2dhist(w2, bin_info)
 
         # w1_model
-        self.twodhists['w1_model'] = self._array_to_2dhist(w1_model, indx_u, indx_v, unique_indx)
+        self.twodhists['w1_model'] = self._array_to_2dhist(w1_model, bin_info)
 
         # w2_model
-        self.twodhists['w2_model'] = self._array_to_2dhist(w2_model, indx_u, indx_v, unique_indx)
+        self.twodhists['w2_model'] = self._array_to_2dhist(w2_model, bin_info)
 
         # dw1
-        self.twodhists['dw1'] = self._array_to_2dhist(dw1, indx_u, indx_v, unique_indx)
+        self.twodhists['dw1'] = self._array_to_2dhist(dw1, bin_info)
 
         # dw2
-        self.twodhists['dw2'] = self._array_to_2dhist(dw2, indx_u, indx_v, unique_indx)
+        self.twodhists['dw2'] = self._array_to_2dhist(dw2, bin_info)
 
     def plot(self, logger=None, **kwargs):
         """Make the plots.
@@ -570,17 +621,5 @@ class WhiskerStats(Stats):
 
         return fig, axs
 
-    def _array_to_2dhist(self, z, indx_u, indx_v, unique_indx):
-        C = np.ma.zeros((self.number_bins_v - 1, self.number_bins_u - 1))
-        C.mask = np.ones((self.number_bins_v - 1, self.number_bins_u - 1))
-
-        for unique in unique_indx:
-            ui, vi = unique
-
-            sample = z[(indx_u == ui) & (indx_v == vi)]
-            if len(sample) > 0:
-                value = self.reducing_function(sample)
-                C[vi, ui] = value
-                C.mask[vi, ui] = 0
-
-        return C
+    def _array_to_2dhist(self, z, bin_info):
+        return _binned_reduce(z, bin_info, self.reducing_function)
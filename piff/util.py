@@ -163,9 +163,20 @@ def read_kwargs(fits, extname):
 
 def hsm(star):
     """ Use HSM to measure moments of star image.
+
+    The moments are kept in star.data, so they are only measured once for each star.
+    See StarData.getHSM.
+
+    :param star:    The Star to measure.
+
+    :returns: (flux, cenu, cenv, sigma, g1, g2, flag)
     """
+    return star.data.getHSM()
+
+def _calculate_hsm(data):
+    # The implementation of hsm for a StarData instance.
     import galsim
-    image, weight, image_pos = star.data.getImage()
+    image, weight, image_pos = data.getImage()
     # Note that FindAdaptiveMom only respects the weight function in a binary sense.  I.e., pixels
     # with non-zero weight will be included in the moment measurement, those with weight=0.0 will be
     # excluded.
@@ -193,3 +204,300 @@ def hsm(star):
     flag = mom.moments_status
 
     return flux, center.x, center.y, sigma, shape.g1, shape.g2, flag
+
+def radial_kvalues(gsobj, dq=0.005, tol=1.e-10, qmax=100.):
+    """Tabulate the Fourier transform of a radially symmetric profile as a function of |k|.
+
+    The table goes out until the transform is negligible (or qmax).
+
+    :param gsobj:       A radially symmetric galsim.GSObject.
+    :param dq:          The spacing of the table. [default: 0.005]
+    :param tol:         Stop once all the values in a chunk of the table are smaller than this.
+                        [default: 1.e-10]
+    :param qmax:        The maximum |k| to go out to. [default: 100]
+
+    :returns: (q, g), where g = gsobj.kValue(q,0).
+    """
+    import galsim
+    nchunk = 1000
+    chunks = []
+    while True:
+        q = (len(chunks) * nchunk + np.arange(nchunk)) * dq
+        g = np.array([ gsobj.kValue(galsim.PositionD(qq, 0.)).real for qq in q ])
+        chunks.append(g)
+        if np.max(np.abs(g)) < tol or q[-1] > qmax:
+            break
+    g = np.concatenate(chunks)
+    q = np.arange(len(g)) * dq
+    return q, g
+
+def adaptive_moments(images, u, v, mask=None, max_iter=50, tol=1.e-6):
+    """Measure adaptive moments of many images at once.
+
+    This is a vectorized version of the adaptive moments that HSM measures (in hsm above),
+    iterating the elliptical Gaussian weight function of all the images together.
+    The images are given along with the world coordinates of each pixel relative to the
+    nominal center, so the results are in world coordinates.
+
+    :param images:      An array of shape (n, npix) with the pixel values of each image.
+    :param u, v:        Arrays of the same shape with the world coordinates of each pixel
+                        relative to the nominal center of its image.
+    :param mask:        Optionally, a boolean array of the same shape giving which pixels to use.
+                        Like FindAdaptiveMom, any weight map is only used in this binary sense.
+                        [default: None]
+    :param max_iter:    The maximum number of iterations. [default: 50]
+    :param tol:         The tolerance on the change in the moments to call them converged.
+                        [default: 1.e-6]
+
+    :returns: (flux, cenu, cenv, sigma, g1, g2, flag), each an array of length n.  flag is
+              nonzero for images where the moments failed to converge.
+    """
+    images = np.asarray(images, dtype=float)
+    if mask is not None:
+        images = images * mask
+    n = images.shape[0]
+    flag = np.zeros(n, dtype=int)
+
+    # Start with the unweighted moments of the positive pixels.
+    pos = np.clip(images, 0., None)
+    norm = np.sum(pos, axis=1)
+    norm[norm <= 0.] = 1.
+    cenu = np.sum(pos * u, axis=1) / norm
+    cenv = np.sum(pos * v, axis=1) / norm
+    sigsq = 0.5 * np.sum(pos * ((u-cenu[:,np.newaxis])**2 + (v-cenv[:,np.newaxis])**2),
+                         axis=1) / norm
+    sigsq[sigsq <= 0.] = 1.
+    muu = sigsq.copy()
+    mvv = sigsq.copy()
+    muv = np.zeros(n)
+
+    converged = np.zeros(n, dtype=bool)
+    for it in range(max_iter):
+        # The weight function is exp(-1/2 x^T M^-1 x)
+        det = muu * mvv - muv**2
+        bad = det <= 0.
+        det[bad] = 1.
+        du = u - cenu[:,np.newaxis]
+        dv = v - cenv[:,np.newaxis]
+        chisq = (mvv[:,np.newaxis] * du**2 - 2.*muv[:,np.newaxis] * du * dv
+                 + muu[:,np.newaxis] * dv**2) / det[:,np.newaxis]
+        wimage = np.exp(-0.5 * chisq) * images
+        sumw = np.sum(wimage, axis=1)
+        bad |= sumw <= 0.
+        sumw[bad] = 1.
+        mu = np.sum(wimage * du, axis=1) / sumw
+        mv = np.sum(wimage * dv, axis=1) / sumw
+        # For a Gaussian profile, the weighted moments are half the true ones when the weight
+        # function matches the profile.  So iterate M -> 2 * weighted moments.
+        new_muu = 2. * (np.sum(wimage * du**2, axis=1) / sumw - mu**2)
+        new_mvv = 2. * (np.sum(wimage * dv**2, axis=1) / sumw - mv**2)
+        new_muv = 2. * (np.sum(wimage * du * dv, axis=1) / sumw - mu * mv)
+
+        size = muu + mvv
+        change = (np.abs(new_muu-muu) + np.abs(new_mvv-mvv) + np.abs(new_muv-muv)
+                  + np.sqrt(mu**2 + mv**2)) / size
+        flag[bad] = 1
+        converged = ~bad & (change < tol)
+        update = ~bad
+        cenu[update] += mu[update]
+        cenv[update] += mv[update]
+        muu[update] = new_muu[update]
+        mvv[update] = new_mvv[update]
+        muv[update] = new_muv[update]
+        if np.all(converged | (flag != 0)):
+            break
+    flag[~converged] = 1
+
+    # For a Gaussian, the weighted sum is half the total flux.
+    flux = 2. * sumw
+    det = muu * mvv - muv**2
+    flag[det <= 0.] = 1
+    det[det <= 0.] = 1.
+    sigma = det**0.25
+    # Convert the distortion e to the reduced shear g.
+    trace = muu + mvv
+    e1 = (muu - mvv) / trace
+    e2 = 2. * muv / trace
+    esq = np.clip(e1**2 + e2**2, 0., 1.)
+    factor = 1. / (1. + np.sqrt(1. - esq))
+    return flux, cenu, cenv, sigma, e1 * factor, e2 * factor, flag
+
+def add_shears(g1a, g2a, g1b, g2b):
+    """Compose two shears, given as arrays of g1, g2 values.
+
+    This is the array equivalent of galsim.Shear(g1=g1a, g2=g2a) + galsim.Shear(g1=g1b, g2=g2b).
+
+    :returns: g1, g2 of the composed shear.
+    """
+    ga = g1a + 1j * g2a
+    gb = g1b + 1j * g2b
+    g = (ga + gb) / (1. + np.conj(ga) * gb)
+    return g.real, g.imag
+
+def peak_rss():
+    """Get the peak resident set size (memory usage) of the current process so far.
+
+    :returns: the peak RSS in MB, or None if it is not available on this system.
+    """
+    try:
+        import resource
+    except ImportError:
+        # e.g. on Windows
+        return None
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OSX, but in kB on Linux.
+    if sys.platform == 'darwin':
+        return rss / 1024.**2
+    else:
+        return rss / 1024.
+
+class Timings(object):
+    """Accumulate the time spent in various named stages of a calculation, along with the
+    peak memory usage at the end of each stage.
+
+    Use it as a context manager with the name of the stage:
+
+        >>> timings = Timings()
+        >>> with timings('fit'):
+        ...     do_fit()
+        >>> print(timings.report())
+
+    Times for a stage that is run more than once (e.g. in each iteration of the fit) are
+    added together, and the number of calls is recorded.  The peak RSS is the high water
+    mark for the whole process, so it only tells you that the peak was reached during or
+    before a given stage.
+    """
+    def __init__(self):
+        from collections import OrderedDict
+        self.stages = OrderedDict()
+
+    def __call__(self, name):
+        return _TimingsStage(self, name)
+
+    def add(self, name, t):
+        """Add some time to a stage.
+
+        :param name:        The name of the stage.
+        :param t:           The time in seconds to add.
+        """
+        if name not in self.stages:
+            self.stages[name] = { 'time' : 0., 'ncalls' : 0, 'peak_rss' : None }
+        stage = self.stages[name]
+        stage['time'] += t
+        stage['ncalls'] += 1
+        stage['peak_rss'] = peak_rss()
+
+    def __getitem__(self, name):
+        return self.stages[name]['time']
+
+    def __contains__(self, name):
+        return name in self.stages
+
+    def keys(self):
+        return self.stages.keys()
+
+    def report(self):
+        """Make a report of the timings.
+
+        :returns: a dict with the total time, the peak RSS in MB, and the details for each
+                  stage.
+        """
+        return { 'total_time' : sum([ s['time'] for s in self.stages.values() ]),
+                 'peak_rss' : peak_rss(),
+                 'stages' : self.stages }
+
+    def write(self, file_name, logger=None):
+        """Write the report to a JSON file.
+
+        :param file_name:   The name of the file to write to.
+        :param logger:      A logger object for logging debug info. [default: None]
+        """
+        import json
+        if logger:
+            logger.warning("Writing timings to %s", file_name)
+        ensure_dir(file_name)
+        with open(file_name, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def log(self, logger):
+        """Log a summary of the timings at info level.
+
+        :param logger:      A logger object for logging the summary.
+        """
+        for name, stage in self.stages.items():
+            logger.info("    %-20s %10.3f s in %d calls, peak RSS = %s MB",
+                        name, stage['time'], stage['ncalls'], stage['peak_rss'])
+
+class _TimingsStage(object):
+    # The context manager returned by Timings.__call__
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        import time
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, *args):
+        import time
+        self.timings.add(self.name, time.time() - self.t0)
+
+class LRUCache(object):
+    """A simple least-recently-used cache with a maximum size.
+
+    The number of hits and misses are counted, which is useful for tuning the size.
+
+        >>> cache = LRUCache(100)
+        >>> value = cache.get(key)
+        >>> if value is None:
+        ...     value = calculate(key)
+        ...     cache.put(key, value)
+
+    :param max_size:    The maximum number of items to keep.
+    """
+    def __init__(self, max_size):
+        from collections import OrderedDict
+        if max_size < 1:
+            raise ValueError("max_size must be at least 1")
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """Get an item from the cache.
+
+        :param key:         The key for the item.
+
+        :returns: the item, or None if it is not in the cache.
+        """
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        # Put it back at the end, since it is now the most recently used.
+        self._items[key] = value
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Add an item to the cache, removing the least recently used item if it is full.
+
+        :param key:         The key for the item.
+        :param value:       The item to store.
+        """
+        self._items.pop(key, None)
+        self._items[key] = value
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        """Remove all the items from the cache.  The hit and miss counters are not reset.
+        """
+        self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
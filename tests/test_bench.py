@@ -0,0 +1,57 @@
+# Copyright (c) 2016 by Mike Jarvis and the other collaborators on GitHub at
+# https://github.com/rmjarvis/Piff  All rights reserved.
+#
+# Piff is free software: Redistribution and use in source and binary forms
+# with or without modification, are permitted provided that the following
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the disclaimer given in the accompanying LICENSE
+#    file.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the disclaimer given in the documentation
+#    and/or other materials provided with the distribution.
+
+from __future__ import print_function
+import os
+import json
+import piff
+import piff.bench
+
+from piff_test_helper import timer
+
+
+@timer
+def test_bench():
+    """Run a small version of the benchmark suite.
+    """
+    dir = os.path.join('output', 'bench')
+    out_file = os.path.join('output', 'bench.json')
+    piff.bench.main(['--nstars', '20', '--ndraw', '5', '--models', 'Gaussian',
+                     '--interps', 'Mean', 'Polynomial', '--dir', dir, '--output', out_file,
+                     '--verbosities', '0', '3', '--fitters', 'lmfit', 'least_squares',
+                     '-v', '0'])
+
+    with open(out_file) as f:
+        results = json.load(f)
+    print('results = ',results)
+    assert results['nstars'] == 20
+    assert len(results['runs']) == 2
+    for run in results['runs']:
+        assert run['model'] == 'Gaussian'
+        assert 'error' not in run
+        for stage in ['Input.makeStars', 'Model.initialize', 'Interp.solve', 'SimplePSF.fit',
+                      'PSF.draw', 'PSF.write_fits', 'PSF.read_npz', 'RhoStats.compute']:
+            assert stage in run['times']
+            assert run['times'][stage] >= 0.
+        # json turns the verbosity keys into strings.
+        assert sorted(run['fit_time_by_verbosity'].keys()) == ['0', '3']
+    assert len(results['fitters']) == 4
+    for run in results['fitters']:
+        assert run['nstars'] == 20
+        assert run['nfev'] > 0
+        assert run['time'] >= 0.
+
+
+if __name__ == '__main__':
+    test_bench()
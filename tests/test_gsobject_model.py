@@ -657,6 +657,225 @@ def test_direct():
         assert model.__dict__ == roundtrip_model.__dict__
 
 
+@timer
+def test_profile_cache():
+    """Test that the transformed profiles match the direct construction, and that repeated
+    draws reuse them.
+    """
+    scale = 1.3
+    g1 = 0.23
+    g2 = -0.17
+    du = 0.1
+    dv = 0.4
+    for model in [ piff.Gaussian(), piff.Kolmogorov(force_model_center=False) ]:
+        prof = model._transform(2.3, du, dv, scale, g1, g2)
+        prof2 = model.gsobj.dilate(scale).shear(g1=g1, g2=g2).shift(du, dv) * 2.3
+        image = prof.drawImage(nx=32, ny=32, scale=0.3)
+        image2 = prof2.drawImage(nx=32, ny=32, scale=0.3)
+        np.testing.assert_almost_equal(image.array, image2.array, decimal=10)
+        np.testing.assert_almost_equal(prof.flux, 2.3)
+
+        if model._force_model_center:
+            params = np.array([ scale, g1, g2 ])
+        else:
+            params = np.array([ du, dv, scale, g1, g2 ])
+        star = piff.Star.makeTarget(x=10, y=20, scale=0.3, stamp_size=32)
+        star = piff.Star(star.data, piff.StarFit(params, flux=2.3))
+        hits = model._profile_cache.hits
+        im1 = model.draw(star).image
+        im2 = model.draw(star).image
+        assert model._profile_cache.hits == hits + 1
+        # The cache isn't part of the model's state.
+        assert '_profile_cache' not in model.__dict__
+        np.testing.assert_array_equal(im1.array, im2.array)
+        assert model.getProfile(params) is model.getProfile(params)
+
+
+@timer
+def test_least_squares():
+    """Test the least_squares fitter, which uses derivatives computed in Fourier space.
+    """
+    scale = 1.3
+    g1 = 0.23
+    g2 = -0.17
+    du = 0.1
+    dv = 0.4
+    flux = 123.
+    wcs = galsim.JacobianWCS(0.26, 0.05, -0.08, -0.29)
+    for fiducial in [fiducial_gaussian, fiducial_kolmogorov, fiducial_moffat]:
+        print()
+        print("fiducial = ", fiducial)
+        print()
+        psf = fiducial.dilate(scale).shear(g1=g1, g2=g2).shift(du, dv) * flux
+        image = galsim.Image(64, 64, wcs=wcs)
+        psf.drawImage(image)
+        stardata = piff.StarData(image, image.trueCenter())
+        star = piff.Star(stardata, None)
+
+        model = piff.GSObjectModel(fiducial, fitter='least_squares')
+        star = model.initialize(star)
+
+        # The model image and derivatives should match drawing the profile with GalSim.
+        values = np.array([flux, du, dv, scale, g1, g2])
+        vary = np.ones(6, dtype=bool)
+        kfit = piff.gsobject_model._KSpaceFitter(model, star, values, vary)
+        kfit._compute(values)
+        np.testing.assert_allclose(kfit._model, image.array, rtol=0,
+                                   atol=1.e-4 * np.max(image.array))
+        h = 1.e-5
+        for i in range(6):
+            v1 = values.copy()
+            v2 = values.copy()
+            v1[i] -= h
+            v2[i] += h
+            im1 = model._transform(*v1).drawImage(image.copy())
+            im2 = model._transform(*v2).drawImage(image.copy())
+            deriv = (im2.array - im1.array) / (2*h)
+            np.testing.assert_allclose(kfit._deriv[i], deriv, rtol=0,
+                                       atol=1.e-3 * np.max(np.abs(deriv)))
+
+        fit = model.fit(star).fit
+        print('True scale = ', scale, ', model scale = ', fit.params[0])
+        print('True g1 = ', g1, ', model g1 = ', fit.params[1])
+        print('True g2 = ', g2, ', model g2 = ', fit.params[2])
+        print('True du = ', du, ', model du = ', fit.center[0])
+        print('True dv = ', dv, ', model dv = ', fit.center[1])
+        np.testing.assert_allclose(fit.flux, flux, rtol=1e-3)
+        np.testing.assert_allclose(fit.params[0], scale, rtol=1e-3)
+        np.testing.assert_allclose(fit.params[1], g1, rtol=0, atol=1e-3)
+        np.testing.assert_allclose(fit.params[2], g2, rtol=0, atol=1e-3)
+        np.testing.assert_allclose(fit.center[0], du, rtol=0, atol=1e-3)
+        np.testing.assert_allclose(fit.center[1], dv, rtol=0, atol=1e-3)
+
+        # It should take fewer function evaluations than lmfit.
+        _, results = model._least_squares_minimize(star)
+        model2 = piff.GSObjectModel(fiducial, fitter='lmfit')
+        results2 = model2._lmfit_minimize(model2._lmfit_params(star), star)
+        print('nfev = ', results.nfev, results.njev, results2.nfev)
+        assert results.nfev + results.njev < results2.nfev
+
+        # Reflux also uses least_squares.
+        refluxed = model.reflux(star)
+        np.testing.assert_allclose(refluxed.fit.flux, flux, rtol=1e-3)
+
+    # The fitter goes through the config processing.
+    config = { 'type' : 'Kolmogorov', 'fitter' : 'least_squares' }
+    model = piff.Model.process(config)
+    assert model._fitter == 'least_squares'
+    assert model.kwargs['fitter'] == 'least_squares'
+    np.testing.assert_raises(ValueError, piff.Gaussian, fitter='invalid')
+
+    # The k-space tables assume a radially symmetric fiducial profile.
+    for fiducial in [ fiducial_gaussian.shear(g1=0.1, g2=0.),
+                      fiducial_gaussian.shear(g1=0., g2=0.05),
+                      fiducial_moffat + fiducial_gaussian.shift(0.5, 0.) ]:
+        np.testing.assert_raises(ValueError, piff.GSObjectModel, fiducial,
+                                 fitter='least_squares')
+        # The other fitter is fine with these.
+        piff.GSObjectModel(fiducial, fitter='lmfit')
+    # A sum of radial profiles is still radial.
+    piff.GSObjectModel(fiducial_moffat + fiducial_gaussian, fitter='least_squares')
+
+
+@timer
+def test_batch_fastfit():
+    """Test the batched moment fitting in fitStarList.
+    """
+    # First check the vectorized moments against HSM for some sheared Gaussians.
+    rng = np.random.RandomState(1234)
+    wcs = galsim.JacobianWCS(0.26, 0.05, -0.08, -0.29)
+    nstars = 20
+    sigma = rng.uniform(0.6, 1.2, nstars)
+    g1 = rng.uniform(-0.2, 0.2, nstars)
+    g2 = rng.uniform(-0.2, 0.2, nstars)
+    du = rng.uniform(-0.3, 0.3, nstars)
+    dv = rng.uniform(-0.3, 0.3, nstars)
+    flux = rng.uniform(100, 1000, nstars)
+    stars = []
+    for k in range(nstars):
+        prof = galsim.Gaussian(sigma=sigma[k]).shear(g1=g1[k], g2=g2[k]).shift(du[k], dv[k])
+        image = prof.drawImage(nx=32, ny=32, wcs=wcs, method='no_pixel') * flux[k]
+        stars.append(piff.Star(piff.StarData(image, image.trueCenter()), None))
+
+    images = np.array([ s.image.array.ravel() for s in stars ])
+    jac = wcs.jacobian()
+    x, y = np.meshgrid(np.arange(1,33) - 16.5, np.arange(1,33) - 16.5)
+    u = np.tile((jac.dudx * x + jac.dudy * y).ravel(), (nstars,1))
+    v = np.tile((jac.dvdx * x + jac.dvdy * y).ravel(), (nstars,1))
+    mom = piff.util.adaptive_moments(images, u, v)
+    np.testing.assert_array_equal(mom[6], 0)
+    np.testing.assert_allclose(mom[0], flux, rtol=1.e-4)
+    np.testing.assert_allclose(mom[1], du, atol=1.e-5)
+    np.testing.assert_allclose(mom[2], dv, atol=1.e-5)
+    np.testing.assert_allclose(mom[3], sigma, rtol=1.e-4)
+    np.testing.assert_allclose(mom[4], g1, atol=1.e-5)
+    np.testing.assert_allclose(mom[5], g2, atol=1.e-5)
+    for s, f, cu, cv, sig, e1, e2 in zip(stars, *mom[:6]):
+        hsm = piff.util.hsm(s)
+        np.testing.assert_allclose([f, cu, cv, sig, e1, e2], hsm[:6], rtol=1.e-4, atol=1.e-5)
+
+    # The array shear addition matches galsim.Shear addition.
+    sum_g1, sum_g2 = piff.util.add_shears(g1, g2, g2, -g1)
+    for k in range(nstars):
+        shear = galsim.Shear(g1=g1[k], g2=g2[k]) + galsim.Shear(g1=g2[k], g2=-g1[k])
+        np.testing.assert_allclose([sum_g1[k], sum_g2[k]], [shear.g1, shear.g2], atol=1.e-12)
+
+    # Now check that fitStarList gives nearly the same results as fit for each star.
+    # Use an elliptical Kolmogorov as the truth and include the pixel.
+    for model in [ piff.Gaussian(fastfit=True, batch_fastfit=True),
+                   piff.Kolmogorov(fastfit=True, batch_fastfit=True),
+                   piff.Kolmogorov(fastfit=True, batch_fastfit=True, force_model_center=False) ]:
+        true_stars = [ make_data(fiducial_kolmogorov, 1.+0.2*g1[k], g1[k], g2[k], du[k], dv[k],
+                                 flux[k], pix_scale=0.3, nside=32)
+                       for k in range(nstars) ]
+        init_stars = [ model.initialize(s) for s in true_stars ]
+        batch = model.fitStarList(init_stars)
+        assert len(batch) == nstars
+        for s, b in zip(init_stars, batch):
+            f = model.fit(s)
+            np.testing.assert_allclose(b.fit.flux, f.fit.flux, rtol=1.e-3)
+            np.testing.assert_allclose(b.fit.params, f.fit.params, rtol=1.e-3, atol=1.e-3)
+            np.testing.assert_allclose(b.fit.center, f.fit.center, atol=1.e-3)
+            np.testing.assert_allclose(b.fit.chisq, f.fit.chisq, rtol=1.e-2, atol=1.e-3)
+            assert b.fit.dof == f.fit.dof
+
+        # Stars that can't be fit are None.  Here, an empty image.
+        bad = init_stars[0].data.copy()
+        bad.image.setZero()
+        bad_star = piff.Star(bad, init_stars[0].fit)
+        batch = model.fitStarList([bad_star] + init_stars[1:])
+        assert batch[0] is None
+        assert all([ b is not None for b in batch[1:] ])
+
+    # Without fastfit or without batch_fastfit, it is the same as fit.
+    for model in [ piff.Gaussian(fastfit=False), piff.Gaussian(fastfit=True),
+                   piff.Gaussian(fastfit=False, batch_fastfit=True) ]:
+        init_stars = [ model.initialize(s) for s in true_stars[:3] ]
+        batch = model.fitStarList(init_stars)
+        for s, b in zip(init_stars, batch):
+            np.testing.assert_array_equal(b.fit.params, model.fit(s).fit.params)
+
+    # batch_fastfit is saved with the other kwargs.
+    model = piff.Kolmogorov(fastfit=True, batch_fastfit=True)
+    assert model.kwargs['batch_fastfit'] is True
+    assert piff.Gaussian().kwargs['batch_fastfit'] is False
+
+
+@timer
+def test_fit_after_hsm():
+    """Test fitting a star whose HSM moments were measured before it was initialized.
+    """
+    for fastfit in [True, False]:
+        model = piff.Gaussian(fastfit=fastfit)
+        star = make_data(galsim.Gaussian(sigma=1.0), 1.1, 0.05, -0.03, 0.1, -0.2, 500.,
+                         pix_scale=0.3)
+        piff.util.hsm(star)
+        assert star.data.hasHSM()
+        assert star.fit.params is None
+        fit = model.fit(star)
+        np.testing.assert_allclose(fit.fit.params, [1.1, 0.05, -0.03], rtol=2.e-2, atol=1.e-2)
+
+
 if __name__ == '__main__':
     test_simple()
     test_center()
@@ -665,3 +884,7 @@ if __name__ == '__main__':
     test_gradient()
     test_gradient_center()
     test_direct()
+    test_profile_cache()
+    test_least_squares()
+    test_batch_fastfit()
+    test_fit_after_hsm()
@@ -0,0 +1,65 @@
+# Copyright (c) 2016 by Mike Jarvis and the other collaborators on GitHub at
+# https://github.com/rmjarvis/Piff  All rights reserved.
+#
+# Piff is free software: Redistribution and use in source and binary forms
+# with or without modification, are permitted provided that the following
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the disclaimer given in the accompanying LICENSE
+#    file.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the disclaimer given in the documentation
+#    and/or other materials provided with the distribution.
+
+from __future__ import print_function
+import os
+import sys
+import subprocess
+import piff
+
+from piff_test_helper import timer
+
+
+@timer
+def test_import():
+    """Check that import piff doesn't import the slow dependencies, and that the lazily
+    imported names are still available.
+    """
+    # Do the import in a fresh process, so nothing has been imported yet.
+    piff_dir = os.path.dirname(os.path.dirname(os.path.abspath(piff.__file__)))
+    code = '\n'.join([
+        'import sys, time',
+        'sys.path.insert(0, %r)'%piff_dir,
+        't0 = time.time()',
+        'import piff',
+        't1 = time.time()',
+        'heavy = [ m for m in ["sklearn", "galsim", "scipy"] if m in sys.modules ]',
+        'print(t1-t0, ",".join(heavy))',
+    ])
+    p = subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE)
+    out, _ = p.communicate()
+    out = out.decode().split()
+    print('Time to import piff = ',out[0])
+    if sys.version_info >= (3,7):
+        heavy = out[1:]
+        print('heavy modules imported: ',heavy)
+        assert heavy == []
+
+    # The lazy names are found when accessed, including via getattr as in the config
+    # processing.
+    assert 'GPInterp' in dir(piff)
+    assert getattr(piff, 'GPInterp') is piff.gp_interp.GPInterp
+    assert piff.AnisotropicRBF is piff.gp_interp.AnisotropicRBF
+    assert 'des' in piff.optical_templates
+    assert piff.des.DECamInfo is not None
+    try:
+        piff.NotAClass
+    except AttributeError:
+        pass
+    else:
+        assert False, "piff.NotAClass should raise AttributeError"
+
+
+if __name__ == '__main__':
+    test_import()
@@ -256,6 +256,86 @@ def test_decaminfo():
     np.testing.assert_allclose(icen, icen_ret)
     np.testing.assert_allclose(jcen, jcen_ret)
 
+
+@timer
+def test_decaminfo_vectorized():
+    # test the vectorized chip lookup and the batch focal plane conversions
+    np_rng = np.random.RandomState(1234)
+    decaminfo = piff.des.DECamInfo()
+
+    # getChipnum matches a brute force check of all the chip boundaries, including for
+    # positions that are off the focal plane or in the gaps between chips.
+    n_samples = 20000
+    xPos = np_rng.uniform(-250, 250, n_samples)
+    yPos = np_rng.uniform(-250, 250, n_samples)
+    chipnums = decaminfo.getChipnum(xPos, yPos)
+    lower = decaminfo.infoLowerLeftCorner[1:]
+    upper = decaminfo.infoUpperRightCorner[1:]
+    conds = ((xPos[:, None] >= lower[None, :, 0]) & (xPos[:, None] <= upper[None, :, 0]) &
+             (yPos[:, None] >= lower[None, :, 1]) & (yPos[:, None] <= upper[None, :, 1]))
+    chipnums_brute = np.where(np.any(conds, axis=1), np.argmax(conds, axis=1) + 1, 0)
+    np.testing.assert_array_equal(chipnums, chipnums_brute)
+    print('fraction on chips = ',np.mean(chipnums > 0))
+    assert np.any(chipnums == 0)
+    assert np.any(chipnums > 0)
+
+    # getPixel keeps the output aligned with the input.  Off-chip positions get chipnum 0
+    # and nan pixel coordinates.
+    chipnums2, ix, iy = decaminfo.getPixel(xPos, yPos)
+    assert len(chipnums2) == len(ix) == len(iy) == n_samples
+    np.testing.assert_array_equal(chipnums2, chipnums)
+    off = chipnums == 0
+    assert np.all(np.isnan(ix[off]))
+    assert np.all(np.isnan(iy[off]))
+    xPos_ret, yPos_ret = decaminfo.getPosition(chipnums[~off], ix[~off], iy[~off])
+    np.testing.assert_allclose(xPos_ret, xPos[~off])
+    np.testing.assert_allclose(yPos_ret, yPos[~off])
+
+    # Scalar input works too.
+    chipnum, ix, iy = decaminfo.getPixel(xPos[~off][0], yPos[~off][0])
+    assert chipnum[0] == chipnums[~off][0]
+    chipnum, ix, iy = decaminfo.getPixel(1000., 1000.)
+    assert chipnum[0] == 0
+    assert np.isnan(ix[0]) and np.isnan(iy[0])
+
+    # pixel_to_focalList gives the same answer as converting each star separately.
+    star_list = []
+    for k in range(50):
+        ccdnum = np_rng.randint(1, 63)
+        icen = np_rng.randint(100, 2048)
+        jcen = np_rng.randint(100, 4096)
+        star = piff.Star.makeTarget(x=icen, y=jcen, scale=0.26, stamp_size=16,
+                                    properties={'ccdnum': ccdnum})
+        star_list.append(star)
+    focal_list = decaminfo.pixel_to_focalList(star_list)
+    assert len(focal_list) == len(star_list)
+    for star, focal_star in zip(star_list, focal_list):
+        star1 = decaminfo.pixel_to_focal(star)
+        np.testing.assert_almost_equal(focal_star.data['focal_x'], star1.data['focal_x'])
+        np.testing.assert_almost_equal(focal_star.data['focal_y'], star1.data['focal_y'])
+        assert focal_star.data['ccdnum'] == star.data['ccdnum']
+        assert focal_star.data.image_pos == star.data.image_pos
+        assert focal_star.data.field_pos == star.data.field_pos
+    assert decaminfo.pixel_to_focalList([]) == []
+
+    # The catalog version takes the columns directly.
+    catalog = np.array([ (s.data['ccdnum'], s.data['x'], s.data['y']) for s in star_list ],
+                       dtype=[('ccdnum', int), ('x', float), ('y', float)])
+    focal_x, focal_y = decaminfo.pixel_to_focal_catalog(catalog)
+    np.testing.assert_almost_equal(focal_x, [ s.data['focal_x'] for s in focal_list ])
+    np.testing.assert_almost_equal(focal_y, [ s.data['focal_y'] for s in focal_list ])
+
+    # A StarList, as read from a file, uses its table directly.
+    star_file = os.path.join('output','decaminfo_stars.fits')
+    with fitsio.FITS(star_file,'rw',clobber=True) as f:
+        piff.Star.write(star_list, f, 'stars')
+        stars2 = piff.Star.read(f, 'stars')
+    assert isinstance(stars2, piff.star.StarList)
+    focal_list2 = decaminfo.pixel_to_focalList(stars2)
+    np.testing.assert_almost_equal([ s.data['focal_x'] for s in focal_list2 ], focal_x)
+    np.testing.assert_almost_equal([ s.data['focal_y'] for s in focal_list2 ], focal_y)
+
+
 if __name__ == '__main__':
     print('test init')
     test_init()
@@ -271,3 +351,5 @@ if __name__ == '__main__':
     test_decam_disk()
     print('test decaminfo')
     test_decaminfo()
+    print('test decaminfo vectorized')
+    test_decaminfo_vectorized()
@@ -152,6 +152,85 @@ def test_disk():
     assert model.g1 == model2.g1,'g1 mismatch'
     assert model.g2 == model2.g2,'g2 mismatch'
 
+
+@timer
+def test_profile_cache():
+    """Test that profiles with the same aberrations are reused.
+    """
+    import galsim
+    params = np.array([0.5, 0.1, -0.2, 0.05, 0.3, -0.1, 0.02, 0.0])
+    model = piff.Optical(r0=0.1, template='des')
+    prof = model.getProfile(params)
+    assert model.getProfile(params) is prof
+    # Tiny differences in the aberrations use the same profile.
+    assert model.getProfile(params + 1.e-9) is prof
+    assert model.getProfile(params + 1.e-3) is not prof
+    # So does another model with the same parameters.
+    model2 = piff.Optical(r0=0.1, template='des')
+    assert model2.getProfile(params) is prof
+    # But not one with different parameters.
+    model3 = piff.Optical(r0=0.2, template='des')
+    assert model3.getProfile(params) is not prof
+
+    # The profile is the same as building it directly, even though the aperture is reused.
+    for p in [params, 2*params]:
+        optics = galsim.OpticalPSF(aberrations=[0,0,0,0] + list(p), **model.optical_psf_kwargs)
+        direct = galsim.Convolve([galsim.Kolmogorov(**model.kolmogorov_kwargs), optics])
+        im1 = model.getProfile(p).drawImage(nx=32, ny=32, scale=0.26)
+        im2 = direct.drawImage(nx=32, ny=32, scale=0.26)
+        np.testing.assert_allclose(im1.array, im2.array, rtol=0, atol=1.e-8*np.max(im2.array))
+
+
+@timer
+def test_draw_star_list():
+    """Test the batched drawing in drawStarList against drawing each star with draw.
+    """
+    np_rng = np.random.RandomState(1234)
+    nstars = 10
+    for model in [ piff.Optical(r0=0.1, template='des', batch_draw=True),
+                   piff.Optical(r0=0.15, sigma=0.2, g1=0.05, g2=-0.03, template='des',
+                                batch_draw=True) ]:
+        stars = []
+        for k in range(nstars):
+            params = np_rng.normal(scale=0.2, size=8)
+            star = make_empty_star(icen=500+k, jcen=700+0.3*k, params=params,
+                                   fit_kwargs={'center': (0.1*k, -0.05*k)})
+            stars.append(star)
+
+        batch = model.drawStarList(stars)
+        assert len(batch) == nstars
+        for star, b in zip(stars, batch):
+            im = model.draw(star).image.array
+            assert b.image.bounds == star.image.bounds
+            assert b.fit is star.fit
+            np.testing.assert_allclose(b.image.array, im, rtol=0, atol=1.e-4 * np.max(im))
+
+    # With no aberrations, this just uses draw.
+    star = make_empty_star(params=np.array([]))
+    np.testing.assert_array_equal(model.drawStarList([star])[0].image.array,
+                                  model.draw(star).image.array)
+
+    # Without batch_draw, it is exactly the same as draw.
+    model = piff.Optical(r0=0.1, template='des')
+    assert model.batch_draw is False
+    for star, b in zip(stars, model.drawStarList(stars)):
+        np.testing.assert_array_equal(b.image.array, model.draw(star).image.array)
+    assert piff.Optical(r0=0.1, template='des', batch_draw=True).kwargs['batch_draw'] is True
+
+    # The Zernike polynomials match GalSim's.
+    import galsim
+    if hasattr(galsim, 'zernike'):
+        r = np.linspace(0., 1., 11)
+        theta = np.linspace(0., 2.*np.pi, 11)
+        for j in range(1, 23):
+            coef = np.zeros(j+1)
+            coef[j] = 1.
+            Z = galsim.zernike.Zernike(coef)
+            np.testing.assert_allclose(piff.optical_model._zernike(j, r, theta),
+                                       Z.evalCartesian(r*np.cos(theta), r*np.sin(theta)),
+                                       atol=1.e-12)
+
+
 #####
 # convenience functions
 #####
@@ -199,3 +278,5 @@ if __name__ == '__main__':
     test_shearing()
     test_gaussian()
     test_disk()
+    test_profile_cache()
+    test_draw_star_list()
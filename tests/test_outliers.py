@@ -0,0 +1,162 @@
+# Copyright (c) 2016 by Mike Jarvis and the other collaborators on GitHub at
+# https://github.com/rmjarvis/Piff  All rights reserved.
+#
+# Piff is free software: Redistribution and use in source and binary forms
+# with or without modification, are permitted provided that the following
+# conditions are met:
+#
+# 1. Redistributions of source code must retain the above copyright notice, this
+#    list of conditions and the disclaimer given in the accompanying LICENSE
+#    file.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+#    this list of conditions and the disclaimer given in the documentation
+#    and/or other materials provided with the distribution.
+
+from __future__ import print_function
+import numpy as np
+import piff
+import os
+import fitsio
+from scipy.stats import chi2
+
+from piff_test_helper import timer
+
+
+def make_param_stars(params):
+    """Make a list of blank stars with the given parameter vectors in their fits.
+    """
+    stars = []
+    for k, p in enumerate(params):
+        star = piff.Star.makeTarget(x=10.*k, y=20.*k, scale=0.26, stamp_size=8)
+        fit = piff.StarFit(np.array(p), flux=1., center=(0.,0.))
+        stars.append(piff.Star(star.data, fit))
+    return stars
+
+
+def make_chisq_stars(chisq, dof):
+    """Make a list of blank stars with the given chisq and dof values in their fits.
+    """
+    stars = []
+    for k, (c, d) in enumerate(zip(chisq, dof)):
+        star = piff.Star.makeTarget(x=10.*k, y=20.*k, scale=0.26, stamp_size=8)
+        fit = piff.StarFit(None, flux=1., center=(0.,0.), chisq=c, dof=d)
+        stars.append(piff.Star(star.data, fit))
+    return stars
+
+
+@timer
+def test_chisq():
+    """Test the ChisqOutliers selection and max_remove ranking.
+    """
+    np_rng = np.random.RandomState(1234)
+    nstars = 200
+    dof = np_rng.randint(90, 110, nstars)
+    chisq = np_rng.chisquare(dof)
+    # Make a few obvious outliers
+    chisq[[3, 17, 42, 100, 150]] = [ 500., 600., 700., 900., 1000. ]
+    stars = make_chisq_stars(chisq, dof)
+
+    outliers = piff.ChisqOutliers(nsigma=5)
+    thresh = outliers.getThresholds(dof)
+    np.testing.assert_almost_equal(thresh, chi2.isf(outliers.prob, dof))
+    # Each unique dof is only computed once.
+    assert len(outliers._thresh_memo) == len(np.unique(dof))
+
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    print('nremoved = ',nremoved)
+    assert nremoved == 5
+    assert len(good_stars) == nstars - 5
+    np.testing.assert_almost_equal(outliers.last_thresh, thresh)
+    np.testing.assert_array_equal(outliers.last_chisq, chisq)
+
+    # With max_remove, the ones with the largest chisq - thresh are the ones removed.
+    outliers = piff.ChisqOutliers(nsigma=5, max_remove=2)
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    assert nremoved == 2
+    good_chisq = [ s.fit.chisq for s in good_stars ]
+    assert chisq[150] not in good_chisq
+    assert chisq[100] not in good_chisq
+    assert chisq[42] in good_chisq
+
+    # thresh and ndof are simpler
+    outliers = piff.ChisqOutliers(thresh=150.)
+    np.testing.assert_almost_equal(outliers.getThresholds(dof), 150.)
+    outliers = piff.ChisqOutliers(ndof=2.)
+    np.testing.assert_almost_equal(outliers.getThresholds(dof), 2.*dof)
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    assert nremoved == np.sum(chisq > 2.*dof)
+
+    # Nothing to remove returns the same list.
+    outliers = piff.ChisqOutliers(thresh=1.e10)
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    assert nremoved == 0
+    assert good_stars is stars
+
+
+@timer
+def test_mad():
+    """Test the MADOutliers rejection based on the fitted parameters.
+    """
+    np_rng = np.random.RandomState(1234)
+    nstars = 500
+    params = np_rng.normal(size=(nstars,3)) * [0.1, 0.02, 0.02] + [1.0, 0.0, 0.1]
+    params[7,0] = 2.0
+    params[19,1] = 0.5
+    params[123,2] = -0.4
+    stars = make_param_stars(params)
+
+    outliers = piff.MADOutliers(nsigma=5)
+    np.testing.assert_almost_equal(outliers.nmad, np.sqrt(np.pi/2) * 5)
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    print('nremoved = ',nremoved)
+    assert nremoved == 3
+    assert len(good_stars) == nstars - 3
+    assert np.all(np.argsort(outliers.last_dev)[-3:] == [19, 123, 7])
+
+    # With an interpolator, the residuals from the interpolated values are used.
+    # For Mean, this is equivalent up to a constant offset.
+    interp = piff.Mean()
+    interp.solve(stars)
+    good_stars, nremoved = outliers.removeOutliers(stars, interp=interp)
+    assert nremoved == 3
+
+    # max_remove removes the worst ones.
+    outliers = piff.MADOutliers(nsigma=5, max_remove=1)
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    assert nremoved == 1
+    assert stars[7] not in good_stars
+    assert stars[19] in good_stars
+
+    # A subsample gives nearly the same answer.
+    outliers = piff.MADOutliers(nsigma=5, nsample=200)
+    good_stars, nremoved = outliers.removeOutliers(stars)
+    assert nremoved == 3
+
+    # Check the errors
+    np.testing.assert_raises(TypeError, piff.MADOutliers)
+    np.testing.assert_raises(TypeError, piff.MADOutliers, nmad=3, nsigma=4)
+
+    # Check the config processing and I/O
+    config = { 'type' : 'MAD', 'nsigma' : 4, 'max_remove' : 10 }
+    outliers = piff.Outliers.process(config)
+    assert isinstance(outliers, piff.MADOutliers)
+    assert outliers.max_remove == 10
+    file_name = os.path.join('output','mad_outliers.fits')
+    with fitsio.FITS(file_name,'rw',clobber=True) as f:
+        outliers.write(f, 'outliers')
+    with fitsio.FITS(file_name,'r') as f:
+        outliers2 = piff.Outliers.read(f, 'outliers')
+    assert isinstance(outliers2, piff.MADOutliers)
+    np.testing.assert_almost_equal(outliers2.nmad, outliers.nmad)
+    assert outliers2.max_remove == outliers.max_remove
+
+    # With a degenerate interpolator, the stars' parameters are never fit individually,
+    # so MADOutliers can't be used.
+    psf = piff.SimplePSF(piff.PixelGrid(0.3, 10), piff.BasisPolynomial(order=1),
+                         outliers=piff.MADOutliers(nsigma=4))
+    np.testing.assert_raises(ValueError, psf.fit, stars, None, None)
+
+
+if __name__ == '__main__':
+    test_chisq()
+    test_mad()
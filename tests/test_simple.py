@@ -18,8 +18,11 @@ import numpy as np
 import piff
 import os
 import subprocess
+import time
+import json
 import yaml
 import fitsio
+import copy
 
 from piff_test_helper import get_script_name, timer
 
@@ -248,6 +251,121 @@ def test_single_image():
     test_star = psf.interp.interpolate(target)
     np.testing.assert_almost_equal(test_star.fit.params, true_params, decimal=4)
 
+    # The time spent in each stage of the fit is recorded.
+    print('timings = ',psf.timings.report())
+    for stage in ['initialize', 'fit', 'solve', 'reflux']:
+        assert stage in psf.timings
+        assert psf.timings[stage] >= 0.
+    assert psf.timings.stages['fit']['ncalls'] >= 2
+    assert 'outliers' not in psf.timings
+
+    # drawMany draws the same images as draw, all at once.
+    xs = [ 123.4, 834.2, 1592.7 ]
+    ys = [ 1943.2, 99.3, 1012.0 ]
+    stamps = psf.drawMany(xs, ys, stamp_size=32, flux=[1., 2., 3.])
+    assert stamps.shape == (3, 32, 32)
+    for k in range(3):
+        image = psf.draw(xs[k], ys[k], stamp_size=32, flux=k+1.)
+        np.testing.assert_almost_equal(stamps[k], image.array, decimal=12)
+    # An offset and a preallocated, non-square output array
+    out = np.zeros((3, 20, 24))
+    stamps = psf.drawMany(xs, ys, offset=(0.3,-0.2), out=out)
+    assert stamps is out
+    image = psf.draw(xs[1], ys[1], offset=(0.3,-0.2), image=galsim.Image(24, 20,
+                     wcs=psf.wcs[0].local(galsim.PositionD(xs[1],ys[1]))))
+    np.testing.assert_almost_equal(out[1], image.array, decimal=12)
+    np.testing.assert_raises(ValueError, psf.drawMany, xs, ys[:2])
+    np.testing.assert_raises(ValueError, psf.drawMany, xs, ys, out=np.zeros((2, 20, 20)))
+    np.testing.assert_raises(TypeError, psf.drawMany, xs, ys, color=0.3)
+
+    # With the draw cache, repeated draws return copies of the same image.
+    assert psf.draw_cache_hits == psf.draw_cache_misses == 0
+    psf.enableDrawCache(max_size=2)
+    im1 = psf.draw(xs[0], ys[0], stamp_size=32)
+    im2 = psf.draw(xs[0], ys[0], stamp_size=32, flux=3.)
+    assert psf.draw_cache_misses == 1
+    assert psf.draw_cache_hits == 1
+    np.testing.assert_almost_equal(im2.array, 3. * im1.array, decimal=12)
+    np.testing.assert_almost_equal(im1.array, stamps[0], decimal=12)
+    im2 *= 0.
+    im3 = psf.draw(xs[0], ys[0], stamp_size=32)
+    np.testing.assert_array_equal(im3.array, im1.array)
+    # Different stamp sizes, offsets and positions are different entries.
+    psf.draw(xs[0], ys[0], stamp_size=48)
+    psf.draw(xs[0], ys[0], stamp_size=32, offset=(0.5,0))
+    psf.draw(xs[0]+0.1, ys[0], stamp_size=32)
+    assert psf.draw_cache_misses == 4
+    assert len(psf._draw_cache) == 2
+    # The first one was dropped from the cache, since max_size = 2.
+    psf.draw(xs[0], ys[0], stamp_size=32)
+    assert psf.draw_cache_misses == 5
+    # With a tolerance, nearby positions use the same image.
+    psf.enableDrawCache(tol=0.5)
+    psf.draw(xs[0], ys[0], stamp_size=32)
+    psf.draw(xs[0]+0.1, ys[0]-0.1, stamp_size=32)
+    assert psf.draw_cache_hits == 1
+    assert psf.draw_cache_misses == 1
+    # Refitting clears the cache.
+    psf.fit(orig_stars, wcs, pointing, logger=logger)
+    assert len(psf._draw_cache) == 0
+    psf.disableDrawCache()
+    assert psf.draw_cache_hits == 0
+
+    # With a grid, the parameters are interpolated from precomputed values.
+    # For Mean, this is exact.
+    exact_stamps = psf.drawMany(xs, ys, stamp_size=32)
+    err = psf.buildGrid(nx=4, ny=5, tol=1.e-8, seed=1234)
+    print('grid error = ',err)
+    assert err < 1.e-8
+    assert psf._grids[0][3].shape == (5, 4, 3)
+    np.testing.assert_almost_equal(psf.drawMany(xs, ys, stamp_size=32), exact_stamps, decimal=12)
+    np.testing.assert_almost_equal(psf.draw(xs[0], ys[0], stamp_size=32).array,
+                                   exact_stamps[0], decimal=12)
+    # A grid over the whole field of view in field coordinates
+    err = psf.buildGrid(nx=3, ny=3, per_chip=False, seed=1234)
+    assert err < 1.e-8
+    assert list(psf._grids.keys()) == [None]
+    np.testing.assert_almost_equal(psf.drawMany(xs, ys, stamp_size=32), exact_stamps, decimal=12)
+    # Given bounds
+    bounds = { 0 : galsim.BoundsD(0, 2048, 0, 2048) }
+    psf.buildGrid(bounds=bounds)
+    np.testing.assert_almost_equal(psf._grids[0][1][[0,-1]], [0, 2048])
+    # A linear polynomial interpolation is also exact with bilinear interpolation.
+    psf2 = piff.SimplePSF(piff.Gaussian(fastfit=True, include_pixel=False),
+                          piff.Polynomial(order=1))
+    psf2.fit(orig_stars, wcs, pointing)
+    exact_stamps = psf2.drawMany(xs, ys, stamp_size=32)
+    err = psf2.buildGrid(nx=3, ny=3, tol=1.e-6)
+    print('grid error = ',err)
+    np.testing.assert_almost_equal(psf2.drawMany(xs, ys, stamp_size=32), exact_stamps, decimal=8)
+    psf2.removeGrid()
+    np.testing.assert_raises(ValueError, psf2.buildGrid, nx=1)
+    # kNNInterp is one of the slow interpolators the grid is meant for.  All the check
+    # positions are inside the grid, so none of them need the full interpolation.
+    psf3 = piff.SimplePSF(piff.Gaussian(fastfit=True, include_pixel=False),
+                          piff.kNNInterp(keys=('u','v'), n_neighbors=5))
+    psf3.fit(orig_stars, wcs, pointing)
+    exact_stamps = psf3.drawMany(xs, ys, stamp_size=32)
+    err = psf3.buildGrid(nx=8, ny=8, seed=1234)
+    print('kNN grid error = ',err)
+    assert psf3._grids is not None
+    stamps = psf3.drawMany(xs, ys, stamp_size=32)
+    assert stamps.shape == exact_stamps.shape
+    # Building or removing the grid clears the draw cache.
+    psf3.enableDrawCache()
+    psf3.draw(xs[0], ys[0], stamp_size=32)
+    assert len(psf3._draw_cache) == 1
+    psf3.removeGrid()
+    assert len(psf3._draw_cache) == 0
+    np.testing.assert_almost_equal(psf3.draw(xs[0], ys[0], stamp_size=32).array,
+                                   exact_stamps[0], decimal=12)
+    psf3.buildGrid(nx=8, ny=8, per_chip=False)
+    assert len(psf3._draw_cache) == 0
+    psf3.disableDrawCache()
+    # Fitting again removes the grid.
+    psf.fit(orig_stars, wcs, pointing, logger=logger)
+    assert psf._grids is None
+
     # Round trip to a file
     psf.write(psf_file, logger)
     psf = piff.read(psf_file, logger)
@@ -255,6 +373,109 @@ def test_single_image():
     assert type(psf.interp) is piff.Mean
     test_star = psf.interp.interpolate(target)
     np.testing.assert_almost_equal(test_star.fit.params, true_params, decimal=4)
+    # Building a grid for a PSF read from a file reads the star positions from the table,
+    # rather than building all the stars.
+    assert isinstance(psf.stars, piff.StarList)
+    psf.buildGrid(nx=3, ny=3, tol=1.e-8)
+    assert all(s is None for s in psf.stars._stars)
+    psf.buildGrid(nx=3, ny=3, per_chip=False, tol=1.e-8)
+    psf.removeGrid()
+
+    # The npz format holds the same information.
+    npz_file = os.path.join('output','simple_psf.npz')
+    psf.write(npz_file, logger)
+    psf2 = piff.read(npz_file, logger)
+    assert type(psf2.model) is piff.Gaussian
+    assert type(psf2.interp) is piff.Mean
+    np.testing.assert_array_equal(psf2.interp.mean, psf.interp.mean)
+    assert len(psf2.stars) == len(psf.stars)
+    np.testing.assert_array_equal(psf2.stars.data, psf.stars.data)
+    assert psf2.wcs == psf.wcs
+    assert psf2.pointing == psf.pointing
+    test_star = psf2.interp.interpolate(target)
+    np.testing.assert_almost_equal(test_star.fit.params, true_params, decimal=4)
+
+    # The format can also be given explicitly, regardless of the file name.
+    psf.write(psf_file + '.bin', format='npz')
+    psf2 = piff.read(psf_file + '.bin', format='npz')
+    np.testing.assert_array_equal(psf2.interp.mean, psf.interp.mean)
+    np.testing.assert_raises(ValueError, piff.read, psf_file, format='hdf5')
+
+    # Compare the read speed of the two formats.
+    t0 = time.time()
+    for i in range(20):
+        piff.read(psf_file)
+    t1 = time.time()
+    for i in range(20):
+        piff.read(npz_file)
+    t2 = time.time()
+    print('Time to read fits file = ',(t1-t0)/20)
+    print('Time to read npz file = ',(t2-t1)/20)
+
+    # A SingleChipPSF read from a file only reads the solution for a chip when it is used.
+    chip_psf = piff.SingleChipPSF(piff.SimplePSF(model, interp))
+    chip_psf.fit(orig_stars, wcs, pointing, logger=logger)
+    chip_file = os.path.join('output','simple_chip_psf.fits')
+    chip_psf.write(chip_file, logger)
+    chipnum = list(wcs.keys())[0]
+    psf2 = piff.read(chip_file, logger)
+    assert isinstance(psf2.psf_by_chip, piff.singlechip.LazyChipPSFs)
+    assert list(psf2.psf_by_chip.keys()) == [chipnum]
+    assert len(psf2.psf_by_chip._psfs) == 0
+    test_star = psf2.psf_by_chip[chipnum].interp.interpolate(target)
+    assert len(psf2.psf_by_chip._psfs) == 1
+    np.testing.assert_almost_equal(test_star.fit.params, true_params, decimal=4)
+    stamps = psf2.drawMany(xs, ys, chipnum=chipnum, stamp_size=32)
+    psf2.buildGrid(nx=3, ny=3, tol=1.e-8)
+    np.testing.assert_almost_equal(psf2.drawMany(xs, ys, chipnum=chipnum, stamp_size=32),
+                                   stamps, decimal=12)
+    psf2.removeGrid()
+    np.testing.assert_raises(ValueError, psf2.buildGrid, per_chip=False)
+    np.testing.assert_almost_equal(stamps[2], psf2.draw(xs[2], ys[2], chipnum=chipnum,
+                                                        stamp_size=32).array, decimal=12)
+    # Rewriting the same file works, since all the chips are read first.
+    psf2 = piff.read(chip_file)
+    psf2.write(chip_file)
+    # Or just read the given chips.
+    psf2 = piff.read(chip_file, chips=[chipnum])
+    assert type(psf2.psf_by_chip) is dict
+    assert list(psf2.psf_by_chip.keys()) == [chipnum]
+    np.testing.assert_raises(ValueError, piff.read, chip_file, chips=[999])
+    # With several chips, the file is opened once and kept open until all the chips are read.
+    chip_psf.psf_by_chip[chipnum+1] = copy.deepcopy(chip_psf.psf_by_chip[chipnum])
+    chip_psf.write(chip_file, logger)
+    psf2 = piff.read(chip_file, logger)
+    f = psf2.psf_by_chip._file
+    assert f is not None
+    assert chipnum+1 in psf2.psf_by_chip
+    assert 999 not in psf2.psf_by_chip
+    assert len(psf2.psf_by_chip._psfs) == 0
+    psf2.psf_by_chip[chipnum]
+    assert psf2.psf_by_chip._file is f
+    psf3 = copy.deepcopy(psf2)
+    assert psf3.psf_by_chip._file is None
+    assert len(psf3.psf_by_chip._psfs) == 1
+    psf2.psf_by_chip[chipnum+1]
+    assert psf2.psf_by_chip._file is None
+    np.testing.assert_almost_equal(psf2.psf_by_chip[chipnum+1].interp.mean,
+                                   psf2.psf_by_chip[chipnum].interp.mean)
+    # write reads the rest of the chips and closes the file before writing.
+    psf3.write(chip_file)
+    assert type(psf3.psf_by_chip) is dict
+    assert sorted(psf3.psf_by_chip.keys()) == [chipnum, chipnum+1]
+    psf3 = piff.read(chip_file)
+    psf3.psf_by_chip[chipnum]
+    psf3.psf_by_chip.close()
+    assert psf3.psf_by_chip._file is None
+    np.testing.assert_almost_equal(psf3.psf_by_chip[chipnum+1].interp.mean,
+                                   psf2.psf_by_chip[chipnum+1].interp.mean)
+    # The chips are read from the file as it was when it was read, even if it is overwritten.
+    psf3 = piff.read(chip_file)
+    assert len(psf3.psf_by_chip._psfs) == 0
+    chip_psf.psf_by_chip[chipnum].interp.mean = chip_psf.psf_by_chip[chipnum].interp.mean * 2
+    chip_psf.write(chip_file)
+    np.testing.assert_almost_equal(psf3.psf_by_chip[chipnum].interp.mean,
+                                   psf2.psf_by_chip[chipnum].interp.mean)
 
     # Do the whole thing with the config parser
     os.remove(psf_file)
@@ -302,6 +523,26 @@ def test_single_image():
     rho_psf_file = os.path.join('output','simple_psf_rhostats.pdf')
     stats.write(rho_psf_file)
 
+    # The correlations can be saved and read back in without recomputing them.
+    rho_corr_file = os.path.join('output','simple_psf_rhostats.fits')
+    stats.writeCorrelations(rho_corr_file)
+    corr_files = piff.RhoStats.corrFileNames(rho_corr_file)
+    assert corr_files[0] == os.path.join('output','simple_psf_rhostats_rho1.fits')
+    assert all(os.path.exists(name) for name in corr_files)
+    stats2 = piff.RhoStats(min_sep=min_sep, max_sep=max_sep, bin_size=bin_size, num_threads=1)
+    stats2.readCorrelations(rho_corr_file)
+    for rho, rho2 in zip(rhos, [stats2.rho1, stats2.rho2, stats2.rho3, stats2.rho4, stats2.rho5]):
+        np.testing.assert_allclose(rho2.xip, rho.xip, rtol=1.e-10)
+        np.testing.assert_allclose(rho2.meanr, rho.meanr, rtol=1.e-10)
+        np.testing.assert_allclose(rho2.varxi, rho.varxi, rtol=1.e-10)
+    stats2.write(rho_psf_file)
+    # The output dir applies to corr_file_name too.
+    output = piff.OutputFile('psf.fits', dir='output',
+                             stats_list=[piff.RhoStats(file_name='rho.pdf',
+                                                       corr_file_name='rho.fits')])
+    assert output.stats_list[0].file_name == os.path.join('output','rho.pdf')
+    assert output.stats_list[0].corr_file_name == os.path.join('output','rho.fits')
+
     # Test that we can make summary shape statistics, using HSM
     shapeStats = piff.ShapeHistogramsStats()
     shapeStats.compute(psf, orig_stars)
@@ -314,6 +555,20 @@ def test_single_image():
     np.testing.assert_array_almost_equal(g2, shapeStats.g2, decimal=4)
     np.testing.assert_array_almost_equal(g2, shapeStats.g2_model, decimal=3)
 
+    # The shape measurements can be done once and shared among several stats.
+    shapes = piff.Stats.measureShapes(psf, orig_stars)
+    shapeStats2 = piff.ShapeHistogramsStats()
+    shapeStats2.compute(psf, orig_stars, shapes=shapes)
+    np.testing.assert_array_equal(shapeStats2.T, shapeStats.T)
+    np.testing.assert_array_equal(shapeStats2.g1_model, shapeStats.g1_model)
+
+    # Measuring in parallel gives the same answers in the same order.
+    for use_threads in [True, False]:
+        shapes2 = piff.Stats.measureShapes(psf, orig_stars, nproc=2, use_threads=use_threads,
+                                           chunk_size=3)
+        for a, b in zip(shapes2, shapes):
+            np.testing.assert_array_equal(a, b)
+
     shape_psf_file = os.path.join('output','simple_psf_shapestats.pdf')
     shapeStats.write(shape_psf_file)
 
@@ -345,7 +600,16 @@ def test_single_image():
     os.remove(psf_file)
     os.remove(rho_psf_file)
     os.remove(shape_psf_file)
+    timing_file = os.path.join('output','simple_timings.json')
+    config['output']['timing_file'] = timing_file
     piff.piffify(config, logger)
+    with open(timing_file) as f:
+        timings = json.load(f)
+    print('timings = ',timings)
+    for stage in ['input', 'initialize', 'fit', 'solve', 'write', 'measureShapes', 'stats']:
+        assert stage in timings['stages']
+    assert timings['total_time'] > 0.
+    del config['output']['timing_file']
 
     # Test using the piffify executable
     os.remove(psf_file)
@@ -357,7 +621,63 @@ def test_single_image():
     p = subprocess.Popen( [piffify_exe, 'simple.yaml'] )
     p.communicate()
 
+@timer
+def test_wcs_io():
+    """Test writing and reading the various kinds of WCS that a PSF might have.
+    """
+    header = { 'CTYPE1' : 'RA---TAN', 'CTYPE2' : 'DEC--TAN',
+               'CRPIX1' : 1024., 'CRPIX2' : 2048.,
+               'CD1_1' : -7.3e-5, 'CD1_2' : 1.2e-7, 'CD2_1' : -2.3e-7, 'CD2_2' : 7.3e-5,
+               'CRVAL1' : 33.7, 'CRVAL2' : -12.3 }
+    wcs = {
+        1 : galsim.PixelScale(0.26),
+        2 : galsim.JacobianWCS(0.26, 0.05, -0.08, -0.29),
+        3 : galsim.AffineTransform(0.26, 0.05, -0.08, -0.29, origin=galsim.PositionD(12,34),
+                                   world_origin=galsim.PositionD(-1.2,3.4)),
+        4 : galsim.GSFitsWCS(header=galsim.FitsHeader(header=header)),
+        5 : galsim.UVFunction('0.26*x + 1.e-5*x*y', '0.26*y'),
+        6 : galsim.OffsetWCS(0.26, origin=galsim.PositionD(12,34),
+                             world_origin=galsim.PositionD(-1.2,3.4)),
+        7 : galsim.ShearWCS(0.26, galsim.Shear(g1=0.02, g2=-0.03)),
+        8 : galsim.OffsetShearWCS(0.26, galsim.Shear(g1=0.02, g2=-0.03),
+                                  origin=galsim.PositionD(12,34),
+                                  world_origin=galsim.PositionD(-1.2,3.4)),
+    }
+    pointing = galsim.CelestialCoord(33.7 * galsim.degrees, -12.3 * galsim.degrees)
+    psf = piff.SimplePSF(piff.Gaussian(), piff.Mean())
+    psf.wcs = wcs
+    psf.pointing = pointing
+
+    for file_name in [ os.path.join('output','wcs_io.fits'), os.path.join('output','wcs_io.npz') ]:
+        with piff.psf._open_file(file_name, 'rw') as f:
+            psf.writeWCS(f, 'wcs')
+        with piff.psf._open_file(file_name, 'r') as f:
+            data = f['wcs'].read()
+            wcs2, pointing2 = piff.PSF.readWCS(f, 'wcs')
+        wcs_type = dict(zip(data['chipnums'], data['wcs_type']))
+        assert wcs_type == { 1 : b'pixelscale', 2 : b'jacobian', 3 : b'affine', 4 : b'header',
+                             5 : b'pickle', 6 : b'offset', 7 : b'shear', 8 : b'offsetshear' }
+        assert pointing2 == pointing
+        assert sorted(wcs2.keys()) == sorted(wcs.keys())
+        # Each WCS comes back as the same type.
+        for chipnum in wcs:
+            assert type(wcs2[chipnum]) is type(wcs[chipnum])
+        assert wcs2[1] == wcs[1]
+        assert wcs2[2] == wcs[2]
+        assert wcs2[3] == wcs[3]
+        assert wcs2[4] == wcs[4]
+        assert wcs2[5] == wcs[5]
+        assert wcs2[6] == wcs[6]
+        # The shears go through g1, g2, so they may differ in the last digit.
+        for chipnum in [7, 8]:
+            np.testing.assert_allclose(wcs2[chipnum].jacobian().getMatrix(),
+                                       wcs[chipnum].jacobian().getMatrix(), rtol=1.e-12)
+            assert wcs2[chipnum].origin == wcs[chipnum].origin
+            assert wcs2[chipnum].world_origin == wcs[chipnum].world_origin
+
+
 if __name__ == '__main__':
     test_Gaussian()
     test_Mean()
     test_single_image()
+    test_wcs_io()
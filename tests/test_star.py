@@ -239,6 +239,35 @@ def test_celestial():
     print("Passed tests of StarData with CelestialWCS")
 
 
+@timer
+def test_field_pos_array():
+    """Test converting many positions to field coordinates at once.
+    """
+    np_rng = np.random.RandomState(1234)
+    x = np_rng.uniform(1, 2048, 100)
+    y = np_rng.uniform(1, 2048, 100)
+    affine = galsim.AffineTransform(0.26, -0.02, 0.03, 0.28,
+                                    world_origin=galsim.PositionD(912.4, -833.1))
+    pointing = galsim.CelestialCoord(13.2343 * galsim.hours, -39.8484 * galsim.degrees)
+    wcs = galsim.TanWCS(affine, world_origin=pointing)
+
+    for w, p in [ (affine, None), (wcs, pointing) ]:
+        u, v, ra, dec = piff.StarData.calculateFieldPosArray(x, y, w, p)
+        assert (ra is None) == (p is None)
+        for k in range(len(x)):
+            props = {}
+            field_pos = piff.StarData.calculateFieldPos(galsim.PositionD(x[k],y[k]), w, p, props)
+            np.testing.assert_almost_equal(u[k], field_pos.x, decimal=8)
+            np.testing.assert_almost_equal(v[k], field_pos.y, decimal=8)
+            if p is not None:
+                np.testing.assert_almost_equal(ra[k], props['ra'], decimal=10)
+                np.testing.assert_almost_equal(dec[k], props['dec'], decimal=10)
+
+    # Pointing is required for a CelestialWCS.
+    np.testing.assert_raises(AttributeError, piff.StarData.calculateFieldPosArray, x, y, wcs,
+                             None)
+
+
 @timer
 def test_io():
     np_rng = np.random.RandomState(1234)
@@ -266,6 +295,15 @@ def test_io():
     with fitsio.FITS(file_name,'r') as fin:
         stars2 = piff.Star.read(fin, extname='stars')
 
+    # The stars are only built when accessed.
+    assert isinstance(stars2, piff.StarList)
+    assert len(stars2) == nstars
+    assert all(s is None for s in stars2._stars)
+    assert stars2[3] is stars2[3]
+    assert stars2[-1] is stars2[nstars-1]
+    assert len(stars2[10:20]) == 10
+    assert sum(s is not None for s in stars2._stars) == 12
+
     for s1, s2 in zip(stars,stars2):
         assert s1.data['x'] == s2.data['x']
         assert s1.data['y'] == s2.data['y']
@@ -286,8 +324,70 @@ def test_io():
         #np.testing.assert_almost_equal(s1.data.weight.array,s2.data.weight.array)
 
 
+@timer
+def test_hsm_cache():
+    """Test that the HSM moments are only measured once for each star.
+    """
+    wcs = galsim.JacobianWCS(0.26, 0.05, -0.08, -0.29)
+    nstars = 5
+    stars = []
+    for k in range(nstars):
+        prof = galsim.Gaussian(sigma=1.+0.1*k).shear(g1=0.1, g2=-0.05*k)
+        image = prof.drawImage(nx=32, ny=32, wcs=wcs) * 100.
+        stars.append(piff.Star(piff.StarData(image, image.trueCenter()), None))
+
+    star = stars[0]
+    assert star.data._hsm is None
+    assert not star.data.hasHSM()
+    hsm = piff.util.hsm(star)
+    assert star.data._hsm is hsm
+    assert star.data.hasHSM()
+    assert piff.util.hsm(star) is hsm
+    assert star.data.getHSM() is hsm
+    assert hsm[6] == 0
+    np.testing.assert_allclose(hsm[0], 100., rtol=1.e-3)
+
+    # Things that don't change the pixels used keep the moments.
+    assert star.data.copy()._hsm == hsm
+    assert star.data.addPoisson(gain=1.7)._hsm is hsm
+    mask = np.ones(star.image.array.shape, dtype=bool)
+    assert star.data.maskPixels(mask)._hsm is hsm
+    # Things that do change them don't.
+    mask[10,10] = False
+    assert star.data.maskPixels(mask)._hsm is None
+    data, _, _, _ = star.data.getDataVector()
+    assert star.data.setData(data)._hsm is None
+
+    # Fitting a GSObjectModel only measures them once.
+    model = piff.Gaussian(fastfit=True)
+    star2 = model.initialize(stars[1])
+    hsm = star2.data._hsm
+    assert hsm is not None
+    star2 = model.fit(star2)
+    star2 = model.fit(star2)
+    assert star2.data._hsm is hsm
+
+    # They are written along with the stars if they have all been measured.
+    file_name = os.path.join('output','star_hsm_io.fits')
+    with fitsio.FITS(file_name,'rw',clobber=True) as fout:
+        piff.Star.write(stars, fout, extname='stars')
+    with fitsio.FITS(file_name,'r') as fin:
+        assert 'hsm_moments' not in fin['stars'].get_colnames()
+    for s in stars:
+        s.data.getHSM()
+    with fitsio.FITS(file_name,'rw',clobber=True) as fout:
+        piff.Star.write(stars, fout, extname='stars')
+    with fitsio.FITS(file_name,'r') as fin:
+        stars2 = piff.Star.read(fin, extname='stars')
+    for s1, s2 in zip(stars, stars2):
+        np.testing.assert_almost_equal(s2.data.getHSM(), s1.data.getHSM())
+        assert 'hsm_moments' not in s2.data.properties
+
+
 if __name__ == '__main__':
     test_init()
     test_euclidean()
     test_celestial()
+    test_field_pos_array()
     test_io()
+    test_hsm_cache()
@@ -76,6 +76,33 @@ def test_twodstats():
     twodstats_file = os.path.join('output','whiskerstats.pdf')
     stats.write(twodstats_file)
 
+@timer
+def test_binned_reduce():
+    """Check the vectorized binned reductions against a direct loop over the bins.
+    """
+    from piff.twod_stats import _sort_into_bins, _binned_reduce
+    np_rng = np.random.RandomState(1234)
+    nbins_u = 21
+    nbins_v = 41
+    n = 2000
+    indx_u = np_rng.randint(0, nbins_u - 1, n)
+    indx_v = np_rng.randint(0, nbins_v - 1, n)
+    z = np_rng.normal(size=n)
+    bin_info = _sort_into_bins(indx_u, indx_v, nbins_u, nbins_v)
+
+    for func in [np.mean, np.median, np.sum, np.std, lambda x: np.percentile(x, 90)]:
+        C = _binned_reduce(z, bin_info, func)
+        assert C.shape == (nbins_v - 1, nbins_u - 1)
+        for vi in range(nbins_v - 1):
+            for ui in range(nbins_u - 1):
+                sample = z[(indx_u == ui) & (indx_v == vi)]
+                if len(sample) > 0:
+                    assert not C.mask[vi, ui]
+                    np.testing.assert_almost_equal(C[vi, ui], func(sample))
+                else:
+                    assert C.mask[vi, ui]
+
+
 def make_star(icen=500, jcen=700, ccdnum=28,
               sigma=1, g1=0, g2=0,
               pixel_to_focal=False,
@@ -135,4 +162,5 @@ def generate_starlist(n_samples=500):
 
 if __name__ == '__main__':
     test_twodstats()
+    test_binned_reduce()
     # yaml test is in test_simple